@@ -0,0 +1,87 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measure the cold start of pyGenieScript in fresh interpreters: importing
+`pyGenieScript.geniescript`, and constructing a `Genie` (including the
+genie-toolkit version check when genie-toolkit is installed).
+
+Run with `python benchmarks/bench_startup.py [--runs N] [--max-ms MS]`.
+Exits with status 1 if the median of any phase exceeds `--max-ms`,
+so it can guard against start-up regressions in CI.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# run from a checkout without installing the package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV = dict(os.environ, PYTHONPATH = os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+
+PHASES = {
+    "import": "import pyGenieScript.geniescript",
+    "Genie(url)": "import pyGenieScript.geniescript as g; g.Genie(url = 'http://127.0.0.1:1/')",
+}
+
+genie_installed = os.path.exists(os.path.join(ROOT, "pyGenieScript", "node_modules", "genie-toolkit", "dist"))
+if genie_installed:
+    PHASES["Genie()"] = "import pyGenieScript.geniescript as g; g.Genie()"
+
+
+def measure(code):
+    timed = "import time; start = time.perf_counter(); {}; print(time.perf_counter() - start)".format(code)
+    output = subprocess.check_output([sys.executable, "-c", timed], env = ENV)
+    return float(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type = int, default = 5)
+    parser.add_argument("--max-ms", type = float, default = None)
+    args = parser.parse_args()
+
+    results = {}
+    for name, code in PHASES.items():
+        samples = [measure(code) for _ in range(args.runs)]
+        results[name] = statistics.median(samples) * 1000
+        print("{:<12} median {:8.1f} ms".format(name, results[name]))
+
+    if args.max_ms is not None:
+        slow = {name: ms for name, ms in results.items() if ms > args.max_ms}
+        if slow:
+            print("start-up regression, over {} ms: {}".format(args.max_ms, json.dumps(slow)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
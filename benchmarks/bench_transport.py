@@ -0,0 +1,76 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compare per-query latency of one-shot `requests.post` calls against the pooled
+keep-alive transport used by `Genie`, both talking to a local stand-in server.
+
+Run with `python benchmarks/bench_transport.py [num_queries]`.
+"""
+
+import statistics
+import sys
+import time
+
+import requests
+
+from suite import percentile  # also puts the checkout on sys.path
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+
+def report(name, samples):
+    print("{:<24} p50 {:7.3f} ms   p95 {:7.3f} ms   mean {:7.3f} ms".format(
+        name, percentile(samples, 0.5) * 1000, percentile(samples, 0.95) * 1000, statistics.mean(samples) * 1000))
+
+
+def bench_one_shot(url, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        requests.post(url = url + "queryContext", json = {"q": "show me a chinese restaurant", "aux": []}).json()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_pooled(url, n):
+    genie = Genie(url = url)
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        genie.query("show me a chinese restaurant")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with MockGenieServer() as server:
+        report("requests.post", bench_one_shot(server.url, n))
+        report("Genie (pooled)", bench_pooled(server.url, n))
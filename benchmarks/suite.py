@@ -0,0 +1,192 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Client-side benchmark suite for pyGenieScript, run against local stand-in
+contextual-genie servers (`pyGenieScript.tests.mock_server`), so it needs
+neither node, models nor network.
+
+Run with `python benchmarks/suite.py`. Results are compared to
+`benchmarks/baseline.json` and the run exits with status 1 if any metric
+regressed by more than `--tolerance`. Use `--save-baseline` to record the
+current results as the new baseline (baselines are machine specific).
+Tail latency (`latency_p99_ms`) is only reported, never gated.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+# run from a checkout without installing the package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.pool import GeniePool
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# whether a larger value of a metric is better, by metric name suffix
+HIGHER_IS_BETTER = ("_qps",)
+
+# tail latencies are reported, but too machine and load dependent to gate on or record in a shared baseline
+REPORT_ONLY = ("latency_p99_ms",)
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def timed_queries(genie, n, **kwargs):
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        genie.query("show me a chinese restaurant", **kwargs)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_latency(n):
+    with MockGenieServer(latency = 0.001, record_calls = False) as server:
+        samples = timed_queries(Genie(url = server.url), n)
+    return {"latency_p50_ms": percentile(samples, 0.5) * 1000, "latency_p99_ms": percentile(samples, 0.99) * 1000}
+
+
+def bench_throughput(n, num_servers = 4, num_threads = 16):
+    servers = [MockGenieServer(latency = 0.005, record_calls = False).start() for _ in range(num_servers)]
+    try:
+        pool = GeniePool(urls = [server.url for server in servers])
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers = num_threads) as executor:
+            list(executor.map(lambda i: pool.query("restaurant {}".format(i), dialog_state = "ds"), range(n)))
+        elapsed = time.perf_counter() - start
+    finally:
+        for server in servers:
+            server.stop()
+    return {"pool_throughput_qps": n / elapsed}
+
+
+def bench_settings_switch(n):
+    settings = [
+        {"num_results": 3, "neglect_filters": ["price"], "use_direct_sentence_state": True},
+        {"num_results": 1, "neglect_filters": ["price"], "use_direct_sentence_state": False},
+    ]
+    with MockGenieServer(latency = 0.001, control_latency = 0.002, record_calls = False) as server:
+        genie = Genie(url = server.url)
+        steady = timed_queries(genie, n)
+        switching = []
+        for i in range(n):
+            start = time.perf_counter()
+            genie.query("show me a chinese restaurant", **settings[i % 2])
+            switching.append(time.perf_counter() - start)
+    return {"settings_switch_cost_ms": (statistics.median(switching) - statistics.median(steady)) * 1000}
+
+
+def bench_large_payload(n):
+    with MockGenieServer(payload_size = 2000, record_calls = False) as server:
+        genie = Genie(url = server.url)
+        samples = timed_queries(genie, n, num_results = 10)
+        tracemalloc.start()
+        timed_queries(genie, n, num_results = 10)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {"large_payload_p50_ms": percentile(samples, 0.5) * 1000, "large_payload_peak_kb": peak / 1024}
+
+
+def bench_startup(runs):
+    code = "import time; start = time.perf_counter(); import pyGenieScript.geniescript; print(time.perf_counter() - start)"
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    samples = [float(subprocess.check_output([sys.executable, "-c", code], env = env).decode().split()[-1]) for _ in range(runs)]
+    return {"startup_import_ms": statistics.median(samples) * 1000}
+
+
+def run(quick = False):
+    n = 200 if quick else 2000
+    results = {}
+    for bench in (bench_latency, bench_throughput, bench_settings_switch, bench_large_payload):
+        results.update(bench(n))
+    results.update(bench_startup(3 if quick else 10))
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    found = {}
+    for name, value in results.items():
+        if name not in baseline or name in REPORT_ONLY:
+            continue
+        if name.endswith(HIGHER_IS_BETTER):
+            if value < baseline[name] * (1 - tolerance):
+                found[name] = (baseline[name], value)
+        # costs near zero are dominated by noise, so they get an absolute allowance of 1 ms as well
+        elif value > baseline[name] * (1 + tolerance) + (1.0 if name.endswith("_ms") else 0.0):
+            found[name] = (baseline[name], value)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action = "store_true", help = "fewer iterations")
+    parser.add_argument("--baseline", default = BASELINE)
+    parser.add_argument("--tolerance", type = float, default = 0.5, help = "allowed relative regression (default: 0.5)")
+    parser.add_argument("--save-baseline", action = "store_true")
+    args = parser.parse_args()
+
+    results = run(args.quick)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as fd:
+            baseline = json.load(fd)
+
+    for name, value in results.items():
+        reference = " (baseline {:.3f})".format(baseline[name]) if name in baseline else ""
+        print("{:<28} {:10.3f}{}".format(name, value, reference))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as fd:
+            json.dump({name: round(value, 3) for name, value in results.items() if name not in REPORT_ONLY}, fd, indent = 2, sort_keys = True)
+            fd.write("\n")
+        return
+
+    found = regressions(results, baseline, args.tolerance)
+    for name, (before, after) in found.items():
+        print("regression: {} went from {:.3f} to {:.3f}".format(name, before, after))
+    if found:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
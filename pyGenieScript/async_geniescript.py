@@ -0,0 +1,297 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import functools
+
+from pyGenieScript.geniescript import Genie
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncGenie:
+    """An asyncio counterpart of `Genie` built on a non-blocking HTTP client."""
+    def __init__(self,
+                 check_genie_version = True,
+                 max_concurrency = 64,
+                 pool_size = 100,
+                 timeout = None,
+                 url = None,
+                 single_flight = None):
+        """
+        Install `genie-toolkit` if needed (see `Genie`) and prepare an asyncio client.
+
+        Requires `aiohttp` (`pip install pyGenieScript[async]`).
+
+        At most `max_concurrency` HTTP calls are in flight at once; further calls wait for a free slot,
+        so callers that produce queries faster than the backend answers are slowed down instead of queuing without bound.
+
+        ### Args:
+
+        `check_genie_version` (bool, optional): see `Genie`. Default to True.
+
+        `max_concurrency` (int, optional): maximum number of in-flight HTTP calls to this backend. Defaults to 64.
+
+        `pool_size` (int, optional): maximum number of keep-alive connections to this backend. Defaults to 100.
+
+        `timeout` (float, optional): total timeout in seconds of each HTTP call. Defaults to None (wait forever).
+
+        `url` (str, optional): address of an already running contextual-genie server, see `Genie`. Defaults to None.
+
+        `single_flight` (`pyGenieScript.coalesce.AsyncSingleFlight`, optional): coalesce identical concurrent queries carrying their own
+        `dialog_state` into one backend call, see `Genie`. Defaults to None (no coalescing).
+
+        ### Raises:
+
+        `ImportError`: in case `aiohttp` is not installed.
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncGenie requires aiohttp, install it with `pip install pyGenieScript[async]`")
+
+        self.genie = Genie(check_genie_version = check_genie_version, url = url)
+        self.logger = self.genie.logger
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.single_flight = single_flight
+        self.session = None
+        self._semaphore = None
+        self._settings_cond = None
+        self._inflight = 0
+        self._switching = False
+        self._waiting_switches = 0
+
+    @property
+    def url(self):
+        return self.genie.url
+
+    async def initialize(self,
+                         nlu_server_address : str,
+                         thingpedia_dir : str = 'None',
+                         log_file_name : str = 'log.log',
+                         force_update_model = False,
+                         force_update_manifest = False) -> None:
+        """
+        ### Description:
+
+        Start a contextual-genie server, see `Genie.initialize`.
+        The blocking start-up runs in the default executor so the event loop keeps running.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+            self.genie.initialize,
+            nlu_server_address,
+            thingpedia_dir = thingpedia_dir,
+            log_file_name = log_file_name,
+            force_update_model = force_update_model,
+            force_update_manifest = force_update_manifest))
+
+    async def query(
+        self,
+        query : str,
+        num_results = 1,
+        neglect_filters = [],
+        neglect_projections = [],
+        dialog_state = None,
+        use_existing_ds = False,
+        aux = [],
+        use_direct_sentence_state = False,
+        timeout = None
+    ):
+        """
+        ### Description:
+
+        Query Genie, see `Genie.query` for arguments and the returned JSON object.
+        
+        With a `timeout`, the whole call (waiting for a settings switch included) is cancelled after `timeout` seconds
+        and `asyncio.TimeoutError` is raised.
+
+        Settings (`num_results`, `neglect_filters`, `neglect_projections`, `use_direct_sentence_state`) are global to the backend,
+        so queries with the current settings run concurrently, while a query that changes them waits for in-flight queries to finish first,
+        and queries arriving meanwhile wait for it.
+        Concurrent queries should carry their own `dialog_state`, since the backend also keeps a single current dialog state.
+        """
+        args = (query, num_results, neglect_filters, neglect_projections, dialog_state, use_existing_ds, aux, use_direct_sentence_state)
+        if self.single_flight is not None and dialog_state is not None and not use_existing_ds:
+            key = self.single_flight.key(query, dialog_state, aux, num_results, neglect_filters, neglect_projections, use_direct_sentence_state)
+            return await self.single_flight.do(key, lambda: self.__query(*args), timeout = timeout)
+        if timeout is not None:
+            return await asyncio.wait_for(self.__query(*args), timeout)
+        return await self.__query(*args)
+
+    async def __query(self, query, num_results, neglect_filters, neglect_projections, dialog_state, use_existing_ds, aux, use_direct_sentence_state):
+        await self.__acquire_settings(num_results, neglect_filters, neglect_projections, use_direct_sentence_state)
+        try:
+            method, endpoint, params = self.genie._query_request(query, dialog_state, use_existing_ds, aux)
+            return await self.__request(method, endpoint, params)
+        finally:
+            async with self._settings_cond:
+                self._inflight -= 1
+                self._settings_cond.notify_all()
+
+    async def query_many(self, queries, **kwargs):
+        """
+        ### Description:
+
+        Run many queries concurrently and return their responses in order.
+
+        `queries` is an iterable (or async iterable) of utterances or of dicts of `query` keyword arguments.
+        It is consumed lazily, with at most `max_concurrency` queries outstanding, so it can be an unbounded stream.
+        `kwargs` are passed to every `query` call. If a query fails, the queries still running are cancelled
+        and its exception is raised.
+        """
+        results = {}
+        pending = set()
+        index = 0
+
+        async def run(i, item):
+            params = dict(kwargs)
+            if isinstance(item, dict):
+                params.update(item)
+            else:
+                params["query"] = item
+            results[i] = await self.query(**params)
+
+        async def items():
+            if hasattr(queries, "__aiter__"):
+                async for item in queries:
+                    yield item
+            else:
+                for item in queries:
+                    yield item
+
+        try:
+            async for item in items():
+                if len(pending) >= self.max_concurrency:
+                    done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                pending.add(asyncio.ensure_future(run(index, item)))
+                index += 1
+            if pending:
+                await asyncio.gather(*pending)
+        except BaseException:
+            # the other queries would otherwise keep running unobserved after this call failed or was cancelled
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions = True)
+            raise
+        return [results[i] for i in range(index)]
+
+    async def quit(self):
+        """
+        ### Description:
+
+        Shut down this Genie engine and close the HTTP session, see `Genie.quit`.
+        """
+        res = await self.__request("POST", "quit")
+        await self.close()
+        return res
+
+    async def clean(self):
+        """
+        ### Description:
+
+        Erase and flush the current contextual state of Genie, see `Genie.clean`.
+        """
+        return await self.__request("POST", "clean")
+
+    async def close(self):
+        """Close the HTTP session without shutting down the backend."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __ensure_session(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit = self.pool_size),
+                timeout = aiohttp.ClientTimeout(total = self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._settings_cond = asyncio.Condition()
+
+    async def __request(self, method, endpoint, params = None):
+        self.__ensure_session()
+        async with self._semaphore:
+            if (method == "GET"):
+                request = self.session.get(self.url + endpoint, params = params)
+            else:
+                request = self.session.post(self.url + endpoint, json = params)
+            async with request as r:
+                return await r.json(content_type = None)
+
+    async def __acquire_settings(self, num_results, neglect_filters, neglect_projections, use_direct_sentence_state):
+        self.__ensure_session()
+        async with self._settings_cond:
+            # a waiting switch holds back new queries with the current settings, so a steady stream of them cannot starve it
+            waiting = False
+            try:
+                while True:
+                    differ = self.genie._settings_differ(num_results, neglect_filters, neglect_projections, use_direct_sentence_state)
+                    if not self._switching:
+                        if not differ and (waiting or self._waiting_switches == 0):
+                            self._inflight += 1
+                            return
+                        if differ and self._inflight == 0:
+                            self._switching = True
+                            break
+                    if differ and not waiting:
+                        waiting = True
+                        self._waiting_switches += 1
+                    await self._settings_cond.wait()
+            finally:
+                if waiting:
+                    self._waiting_switches -= 1
+                    self._settings_cond.notify_all()
+
+        applied = False
+        try:
+            updates = self.genie._settings_requests(num_results, neglect_filters, neglect_projections, use_direct_sentence_state)
+            try:
+                responses = await asyncio.gather(*[self.__request("POST", endpoint, payload) for endpoint, payload, _ in updates])
+            except BaseException:
+                # some of the updates may have been applied, so all of them are sent again next time
+                self.genie._settings_stale = True
+                raise
+            self.genie._settings_synced(num_results, neglect_filters, neglect_projections, use_direct_sentence_state, updates, responses)
+            applied = True
+        finally:
+            async with self._settings_cond:
+                self._switching = False
+                if applied:
+                    self._inflight += 1
+                self._settings_cond.notify_all()
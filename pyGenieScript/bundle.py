@@ -0,0 +1,378 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Relocatable runtime bundles: the installed `genie-toolkit`, the built manifests and a model packed into one
+versioned, checksummed archive.
+
+Build the bundle once (e.g. in a CI job or an image build stage) and unpack it wherever Genie should start:
+
+    genie-bundle pack genie-runtime.tar.gz --model yelp
+    genie-bundle unpack genie-runtime.tar.gz /opt/genie-runtime
+
+then run `Genie(bundle = "/opt/genie-runtime")`, which neither installs, checks versions nor touches the network.
+
+A bundle directory holds `node_modules/`, `manifests/`, `models/<name>/` and a `bundle.json` describing them,
+including the SHA-256 of every regular file. The archive is accompanied by a `<archive>.sha256` file.
+Pack with `--compression none` to trade disk space for a faster unpack.
+
+Run `python -m pyGenieScript.bundle --help` (or `genie-bundle --help`) for the command line.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+
+FORMAT = 1
+METADATA_NAME = "bundle.json"
+
+current_file_directory = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger(__name__)
+
+
+def _sha256(path : str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _package_version() -> str:
+    try:
+        from importlib.metadata import version
+        return version("pyGenieScript")
+    except Exception:
+        return "unknown"
+
+
+def _genie_toolkit_version() -> str:
+    with open(os.path.join(current_file_directory, "package.json"), "r") as fd:
+        return json.load(fd)["dependencies"]["genie-toolkit"]
+
+
+def _add_tree(tar : tarfile.TarFile, src : str, prefix : str, files : dict, dereference : bool):
+    """
+    Add the files under `src` as `prefix/...`, recording the digest of each regular file in `files`.
+    
+    Without `dereference`, relative symlinks to files or directories under `src` (e.g. `.bin`) stay valid after relocation
+    and are kept as links, while other symlinks (e.g. packages linked by `npm link` or workspaces) are replaced by their content.
+    """
+    real_src = os.path.realpath(src)
+    
+    def relocatable(path):
+        real_path = os.path.realpath(path)
+        return not os.path.isabs(os.readlink(path)) and (real_path == real_src or real_path.startswith(real_src + os.sep))
+    
+    for root, dirs, names in os.walk(src, followlinks = dereference):
+        dirs.sort()
+        for name in list(dirs):
+            path = os.path.join(root, name)
+            if dereference or not os.path.islink(path):
+                continue
+            # os.walk does not descend into symlinked directories
+            dirs.remove(name)
+            arcname = "/".join([prefix] + os.path.relpath(path, src).split(os.sep))
+            if relocatable(path):
+                tar.add(path, arcname = arcname, recursive = False)
+            else:
+                _add_tree(tar, os.path.realpath(path), arcname, files, dereference = False)
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            arcname = "/".join([prefix] + os.path.relpath(path, src).split(os.sep))
+            if os.path.islink(path) and not dereference and relocatable(path):
+                tar.add(path, arcname = arcname, recursive = False)
+                continue
+            real_path = os.path.realpath(path)
+            files[arcname] = _sha256(real_path)
+            tar.add(real_path, arcname = arcname, recursive = False)
+
+
+def _pack_dirs(output : str, node_modules : str, manifest_dir : str, models : dict, compression = "gz") -> dict:
+    """Pack the given directories into `output`, see `pack`. `models` maps names to model directories."""
+    metadata = {
+        "format": FORMAT,
+        "pygeniescript": _package_version(),
+        "genie_toolkit": _genie_toolkit_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "manifests": "manifests",
+        "models": {name: "models/" + name for name in models},
+        "files": {},
+    }
+    
+    output = os.path.abspath(output)
+    mode = "w:" + compression if compression != "none" else "w"
+    fd, tmp_path = tempfile.mkstemp(prefix = os.path.basename(output) + ".", dir = os.path.dirname(output))
+    os.close(fd)
+    try:
+        with tarfile.open(tmp_path, mode) as tar:
+            _add_tree(tar, node_modules, "node_modules", metadata["files"], dereference = False)
+            # models and manifests in caches are symlinks to shared blobs, the bundle holds their content
+            _add_tree(tar, manifest_dir, "manifests", metadata["files"], dereference = True)
+            for name, model_dir in models.items():
+                _add_tree(tar, model_dir, "models/" + name, metadata["files"], dereference = True)
+            
+            data = json.dumps(metadata, indent = 2, sort_keys = True).encode("utf-8")
+            info = tarfile.TarInfo(METADATA_NAME)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    
+    with open(output + ".sha256", "w") as fd:
+        fd.write("{}  {}\n".format(_sha256(output), os.path.basename(output)))
+    logger.info("packed {} file(s) into {}".format(len(metadata["files"]), output))
+    return metadata
+
+
+def pack(output : str, model_name = "yelp", manifest_dir = "None", genie = None, compression = "gz") -> dict:
+    """
+    ### Description:
+    
+    Pack the installed `genie-toolkit`, the manifests and the model into the archive `output`,
+    and write its checksum to `<output>.sha256`.
+    
+    The model is stored under its name when `model_name` is an available model (e.g. yelp), or under the name of
+    its directory when it is a path; `Genie.initialize` in bundle mode accepts either name.
+    
+    ### Args:
+    
+    `output` (str): path of the archive to write.
+    
+    `model_name` (str, optional): see `Genie.initialize`; the model must be local or downloadable. Defaults to "yelp".
+    
+    `manifest_dir` (str, optional): see `Genie.initialize`. Defaults to "None".
+    
+    `genie` (`pyGenieScript.geniescript.Genie`, optional): instance used to find (or install and download) the pieces. Defaults to None (a new one).
+    
+    `compression` (str, optional): "gz", "bz2", "xz" or "none". Defaults to "gz".
+    
+    ### Raises:
+    
+    `ValueError`: in case `model_name` refers to a remote NLU server
+    
+    ### Returns:
+    
+    (dict): the metadata stored as `bundle.json`
+    """
+    if genie is None:
+        from pyGenieScript.geniescript import Genie
+        genie = Genie()
+    
+    model_dir = genie.download_or_find_model(model_name)
+    if not os.path.exists(os.path.join(model_dir, "config.json")):
+        raise ValueError("a bundle needs a local model, not " + model_name)
+    name = os.path.basename(os.path.normpath(model_name)) if os.path.exists(model_name) else model_name.lower()
+    
+    return _pack_dirs(output,
+                      genie.node_modules,
+                      genie.download_or_find_manifests(manifest_dir),
+                      {name: model_dir},
+                      compression = compression)
+
+
+def load(bundle_dir : str) -> dict:
+    """
+    ### Description:
+    
+    Read the metadata of the unpacked bundle in `bundle_dir`.
+    
+    ### Raises:
+    
+    `ValueError`: in case `bundle_dir` is not a bundle, or one of an unsupported format
+    
+    ### Returns:
+    
+    (dict): the metadata, with the absolute path of the bundle under "path"
+    """
+    try:
+        with open(os.path.join(bundle_dir, METADATA_NAME), "r") as fd:
+            metadata = json.load(fd)
+    except (OSError, ValueError) as e:
+        raise ValueError("not a pyGenieScript bundle: {} ({})".format(bundle_dir, e))
+    if metadata.get("format") != FORMAT:
+        raise ValueError("unsupported bundle format {} in {}".format(metadata.get("format"), bundle_dir))
+    metadata["path"] = os.path.abspath(bundle_dir)
+    return metadata
+
+
+def verify(bundle_dir : str) -> list:
+    """
+    ### Description:
+    
+    Check every file of the unpacked bundle in `bundle_dir` against its recorded checksum.
+    
+    ### Returns:
+    
+    (list): relative paths of the files that are missing or differ, empty if the bundle is intact
+    """
+    metadata = load(bundle_dir)
+    bad = []
+    for relpath, digest in sorted(metadata["files"].items()):
+        path = os.path.join(bundle_dir, *relpath.split("/"))
+        try:
+            if _sha256(path) == digest:
+                continue
+        except OSError:
+            pass
+        bad.append(relpath)
+    return bad
+
+
+def _safe_members(tar : tarfile.TarFile):
+    for member in tar:
+        parts = member.name.split("/")
+        if member.name.startswith("/") or ".." in parts:
+            raise ValueError("unsafe path in bundle: " + member.name)
+        if member.issym() and (member.linkname.startswith("/") or
+                               os.path.normpath(os.path.join(os.path.dirname(member.name), member.linkname)).startswith("..")):
+            raise ValueError("unsafe link in bundle: {} -> {}".format(member.name, member.linkname))
+        if not (member.isfile() or member.isdir() or member.issym()):
+            raise ValueError("unsupported member in bundle: " + member.name)
+        yield member
+
+
+def unpack(archive : str, dest : str, check = True) -> dict:
+    """
+    ### Description:
+    
+    Unpack the bundle `archive` into the directory `dest`.
+    
+    The bundle is unpacked and verified next to `dest` and then renamed to it, so `dest` is never left half written.
+    An existing `dest` is only replaced if it is a bundle itself, and is briefly missing while being replaced;
+    unpack into a new directory instead to switch running deployments without such a gap.
+    
+    ### Args:
+    
+    `archive` (str): path of the archive written by `pack`.
+    
+    `dest` (str): directory to unpack into.
+    
+    `check` (bool, optional): verify the archive against `<archive>.sha256` (if present) and every unpacked file
+    against `bundle.json`. Defaults to True.
+    
+    ### Raises:
+    
+    `ValueError`: in case the archive is corrupt, unsafe or of an unsupported format
+
+    `FileExistsError`: in case `dest` exists and is not a bundle
+    
+    ### Returns:
+    
+    (dict): the metadata of the unpacked bundle, see `load`
+    """
+    dest = os.path.abspath(dest)
+    if os.path.exists(dest) and not os.path.exists(os.path.join(dest, METADATA_NAME)):
+        raise FileExistsError("refusing to replace {}, which is not a bundle".format(dest))
+    
+    checksum_file = archive + ".sha256"
+    if check and os.path.exists(checksum_file):
+        with open(checksum_file, "r") as fd:
+            expected = fd.read().split()[0]
+        if _sha256(archive) != expected:
+            raise ValueError("checksum mismatch for " + archive)
+    
+    os.makedirs(os.path.dirname(dest), exist_ok = True)
+    tmp_dir = tempfile.mkdtemp(prefix = os.path.basename(dest) + ".", dir = os.path.dirname(dest))
+    try:
+        with tarfile.open(archive, "r:*") as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(tmp_dir, members = _safe_members(tar), filter = "data")
+            else:
+                tar.extractall(tmp_dir, members = _safe_members(tar))
+        metadata = load(tmp_dir)
+        if check:
+            bad = verify(tmp_dir)
+            if bad:
+                raise ValueError("{} file(s) of {} failed verification, e.g. {}".format(len(bad), archive, bad[0]))
+        os.chmod(tmp_dir, 0o755)
+        
+        if os.path.exists(dest):
+            old_dir = tempfile.mkdtemp(prefix = os.path.basename(dest) + ".old.", dir = os.path.dirname(dest))
+            os.rename(dest, os.path.join(old_dir, "bundle"))
+            os.rename(tmp_dir, dest)
+            shutil.rmtree(old_dir, ignore_errors = True)
+        else:
+            os.rename(tmp_dir, dest)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+        raise
+    
+    metadata["path"] = dest
+    logger.info("unpacked {} file(s) into {}".format(len(metadata["files"]), dest))
+    return metadata
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest = "command")
+    commands.required = True
+    
+    pack_parser = commands.add_parser("pack", help = "pack the installed runtime into an archive")
+    pack_parser.add_argument("output", help = "archive to write")
+    pack_parser.add_argument("--model", default = "yelp", help = "model name or directory (default: yelp)")
+    pack_parser.add_argument("--thingpedia-dir", default = "None", help = "see Genie.initialize")
+    pack_parser.add_argument("--compression", default = "gz", choices = ["gz", "bz2", "xz", "none"])
+    
+    unpack_parser = commands.add_parser("unpack", help = "unpack and verify an archive")
+    unpack_parser.add_argument("archive")
+    unpack_parser.add_argument("dest", help = "directory to unpack into, pass it to Genie(bundle = ...)")
+    unpack_parser.add_argument("--no-verify", action = "store_true", help = "skip checksum verification")
+    
+    verify_parser = commands.add_parser("verify", help = "verify an unpacked bundle")
+    verify_parser.add_argument("dest")
+    args = parser.parse_args(argv)
+    
+    if args.command == "pack":
+        metadata = pack(args.output, model_name = args.model, manifest_dir = args.thingpedia_dir, compression = args.compression)
+    elif args.command == "unpack":
+        metadata = unpack(args.archive, args.dest, check = not args.no_verify)
+    else:
+        bad = verify(args.dest)
+        print(json.dumps({"path": os.path.abspath(args.dest), "bad": bad}))
+        if bad:
+            raise SystemExit(1)
+        return
+    print(json.dumps({key: metadata[key] for key in ("format", "pygeniescript", "genie_toolkit", "created", "models")}))
+
+
+if __name__ == "__main__":
+    main()
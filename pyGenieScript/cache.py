@@ -0,0 +1,180 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """An LRU cache of `Genie.query` results with TTL expiry and an optional on-disk tier."""
+    def __init__(self, max_size = 1024, ttl = 300, path = None, max_disk_size = 100000):
+        """
+        ### Args:
+        
+        `max_size` (int, optional): maximum number of results kept in memory. Defaults to 1024.
+        
+        `ttl` (float, optional): seconds after which a result expires, since results come from live skills. None never expires. Defaults to 300.
+        
+        `path` (str, optional): path to a SQLite file used as a second, persistent tier that survives restarts. Defaults to None (memory only).
+        
+        `max_disk_size` (int, optional): maximum number of results kept on disk. Defaults to 100000.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._memory = OrderedDict()
+        # last access of keys hit in memory, written to the disk tier in batches so its eviction sees them
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+            self._db = sqlite3.connect(path, check_same_thread = False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)")
+            self._db.commit()
+    
+    @staticmethod
+    def key(query, dialog_state, aux, num_results, neglect_filters, neglect_projections, use_direct_sentence_state) -> str:
+        """Digest of everything a stateless query result depends on."""
+        payload = json.dumps([query, dialog_state, aux, num_results, neglect_filters, neglect_projections, use_direct_sentence_state], sort_keys = True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+    
+    def get(self, key : str):
+        """Return a fresh copy of the cached result for `key`, or None on a miss."""
+        value = self.get_raw(key)
+        return None if value is None else json.loads(value)
+    
+    def get_raw(self, key : str):
+        """Return the cached result for `key` as a JSON document, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    if self._db is not None:
+                        self._touched[key] = now
+                        if len(self._touched) >= self.max_size:
+                            self.__flush_touched()
+                            self._db.commit()
+                    return value
+                del self._memory[key]
+                self.expirations += 1
+            
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, expires = row
+                    if expires is None or expires > now:
+                        self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self.__put_memory(key, value, expires)
+                        self.hits += 1
+                        return value
+                    self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.expirations += 1
+            
+            self.misses += 1
+            return None
+    
+    def put(self, key : str, result):
+        """Cache `result` under `key`."""
+        self.put_raw(key, json.dumps(result))
+    
+    def put_raw(self, key : str, value):
+        """Cache the result encoded as the JSON document `value` (str or bytes) under `key`."""
+        if isinstance(value, bytes):
+            value = value.decode()
+        now = time.time()
+        expires = None if self.ttl is None else now + self.ttl
+        with self._lock:
+            self.__put_memory(key, value, expires)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, value, expires, now))
+                self._touched.pop(key, None)
+                self.__flush_touched()
+                # evict the least recently used rows once the disk tier is full
+                self._db.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_disk_size,))
+                self._db.commit()
+    
+    def clear(self):
+        """Drop every cached result, in memory and on disk."""
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+    
+    def stats(self) -> dict:
+        """Hit/miss counters of this cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "size": len(self._memory),
+            }
+    
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self.__flush_touched()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+    
+    def __flush_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE results SET accessed = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+    
+    def __put_memory(self, key, value, expires):
+        self._memory[key] = (value, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last = False)
+            self.evictions += 1
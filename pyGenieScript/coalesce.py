@@ -0,0 +1,161 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Coalesce identical concurrent calls (single-flight): the first caller runs the call, callers arriving while it
+is in flight wait for it and get its result instead of running it again.
+"""
+
+import asyncio
+import collections
+import copy
+import threading
+
+from pyGenieScript.cache import QueryCache
+from pyGenieScript.transport import deadline_exceeded
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Coalescer:
+    # shared by the thread and asyncio variants
+    key = staticmethod(QueryCache.key)
+    
+    @property
+    def dedup_ratio(self) -> float:
+        """Fraction of calls that were answered by another caller's call."""
+        return self.stats["shared"] / self.stats["calls"] if self.stats["calls"] else 0.0
+    
+    def _share(self, result):
+        # every caller gets its own copy, so one mutating its result does not affect the others
+        return copy.deepcopy(result) if self.copy_results else result
+
+
+class SingleFlight(_Coalescer):
+    """
+    ### Description:
+    
+    Single-flight coalescing for threads, see `Genie` and `GeniePool`.
+    
+    One instance can be shared by several `Genie` instances, e.g. all workers of a pool, to coalesce across them.
+    Counts of calls, backend executions and shared results are kept in `stats`, and `dedup_ratio` is `shared / calls`.
+    
+    ### Args:
+    
+    `copy_results` (bool, optional): give callers that waited a deep copy of the result. Defaults to True.
+    """
+    def __init__(self, copy_results = True):
+        self.copy_results = copy_results
+        self.stats = collections.Counter()
+        self._calls = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key, fn, timeout = None):
+        """
+        Return `fn()`, or the result of the call with the same `key` already in flight.
+        
+        A waiting caller gives up after `timeout` seconds with `requests.exceptions.Timeout`, leaving the call running.
+        Errors of the call are raised in every caller.
+        """
+        with self._lock:
+            self.stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["executions"] += 1
+            else:
+                self.stats["shared"] += 1
+        
+        if leader:
+            try:
+                call.result = fn()
+                return call.result
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.event.set()
+        
+        if not call.event.wait(timeout):
+            raise deadline_exceeded("identical call still in flight after {} seconds".format(timeout))
+        if call.error is not None:
+            raise call.error
+        return self._share(call.result)
+
+
+class AsyncSingleFlight(_Coalescer):
+    """
+    ### Description:
+    
+    Single-flight coalescing for asyncio, see `pyGenieScript.async_geniescript.AsyncGenie`.
+    
+    The call runs in its own task, so cancelling the caller that started it does not cancel it for the others.
+    
+    ### Args:
+    
+    `copy_results` (bool, optional): give callers that waited a deep copy of the result. Defaults to True.
+    """
+    def __init__(self, copy_results = True):
+        self.copy_results = copy_results
+        self.stats = collections.Counter()
+        self._calls = {}
+    
+    async def do(self, key, coroutine_fn, timeout = None):
+        """
+        Await `coroutine_fn()`, or the call with the same `key` already in flight.
+        
+        A caller gives up after `timeout` seconds with `asyncio.TimeoutError`, leaving the call running for the others.
+        """
+        self.stats["calls"] += 1
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            self.stats["executions"] += 1
+            task = self._calls[key] = asyncio.ensure_future(coroutine_fn())
+            task.add_done_callback(lambda t: self.__done(key, t))
+        else:
+            self.stats["shared"] += 1
+        
+        result = await asyncio.wait_for(asyncio.shield(task), timeout)
+        return result if leader else self._share(result)
+    
+    def __done(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # retrieve the error, so it is not reported as unhandled when every caller gave up
+        if not task.cancelled():
+            task.exception()
@@ -28,21 +28,34 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import subprocess
-import requests
 import os
-from huggingface_hub import snapshot_download
-from pathlib import Path
-import shutil
 from glob import glob
 import time
 import logging
 import json
+import threading
+from pyGenieScript import manifest_store, model_store, server_registry
+from pyGenieScript import bundle as bundle_store
+from pyGenieScript.process import GenieProcess
+from pyGenieScript.result import QueryResult, loads
+from pyGenieScript.warmup import Warmup
+from pyGenieScript.transport import HTTPTransport, deadline_exceeded
 
 current_file_directory = os.path.dirname(os.path.abspath(__file__))
 
 class Genie:
     """A Genie instance."""
-    def __init__(self, check_genie_version = True):
+    def __init__(self,
+                 check_genie_version = True,
+                 pool_size = 10,
+                 timeout = None,
+                 url = None,
+                 cache = None,
+                 offline = False,
+                 metrics = None,
+                 retries = 2,
+                 single_flight = None,
+                 bundle = None):
         """
         Install `genie-toolkit` and prepare it for initialization.
         
@@ -51,28 +64,79 @@ class Genie:
         
         Unless `check_genie_version` is False, always check if installed version matches with specified version
         
+        All HTTP calls to the Genie server share one pooled keep-alive session.
+        
         ### Args:
         
         `check_genie_version` (bool, optional): where to check currently installed genie version and re-install if necessary. Default to True.
+        
+        `pool_size` (int, optional): maximum number of keep-alive connections to the Genie server. Defaults to 10.
+        
+        `timeout` (float or tuple, optional): default `(connect, read)` timeout in seconds for every HTTP call. Defaults to None (wait forever).
+        
+        `url` (str, optional): address of an already running contextual-genie server, e.g. `http://127.0.0.1:8080/`.
+        If given, `genie-toolkit` is neither installed nor checked and `initialize` does not need to be called. Defaults to None.
+        
+        `cache` (`pyGenieScript.cache.QueryCache`, optional): cache for results of queries that carry their own `dialog_state`. Defaults to None (no caching).
+        
+        `offline` (bool, optional): never access the network to download models or manifests, even with `force_update_model` or `force_update_manifest`;
+        use the local copies or caches. Defaults to False.
+        
+        `metrics` (`pyGenieScript.metrics.QueryMetrics`, optional): collect per-phase timings and counters of every `query`. Defaults to None (no instrumentation).
+        
+        `retries` (int, optional): how many times an idempotent call (a settings update, or a query carrying its own `dialog_state`)
+        is retried, with jittered backoff, after a connection error or a timeout. Counts are kept in `self.transport.stats`. Defaults to 2.
+        
+        `single_flight` (`pyGenieScript.coalesce.SingleFlight`, optional): coalesce identical concurrent queries carrying their own `dialog_state`
+        into one backend call whose result all callers receive. Defaults to None (no coalescing).
+        
+        `bundle` (str, optional): directory of an unpacked runtime bundle (see `pyGenieScript.bundle`). If given, `genie-toolkit`,
+        the manifests and the model are used from the bundle, nothing is installed or checked, and `offline` is implied. Defaults to None.
         """
         logging.basicConfig()
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG)
         
-        self.genie_dir = os.path.exists(os.path.join(current_file_directory, "node_modules", "genie-toolkit", "dist"))
-        
-        # install genie:
-        if (not self.genie_dir):
-            self.__install_genie()
+        self.transport = HTTPTransport(pool_size = pool_size, timeout = timeout, retries = retries)
+        self.cache = cache
+        self.offline = offline or bundle is not None
+        self.metrics = metrics
+        self.single_flight = single_flight
+        self.process = None
+        self.nlu_process = None
+        self.supervisor = None
+        self.warmup_report = None
+        self._shared_key = None
+        self._nlu_leases = set()
+        self.bundle = None
+        self.node_modules = os.path.join(current_file_directory, "node_modules")
+        
+        if bundle is not None:
+            self.bundle = bundle_store.load(bundle)
+            self.node_modules = os.path.join(self.bundle["path"], "node_modules")
+        
+        if url is not None:
+            self.url = url if url.endswith("/") else url + "/"
+        elif bundle is None:
+            self.genie_dir = os.path.exists(os.path.join(current_file_directory, "node_modules", "genie-toolkit", "dist"))
             
-        # check version, if necessary, and re-install
-        if (check_genie_version and self.__if_outdated_genie()):
-            self.__install_genie()
+            # install genie:
+            if (not self.genie_dir):
+                self.__install_genie()
+                
+            # check version, if necessary, and re-install
+            if (check_genie_version and self.__if_outdated_genie()):
+                self.__install_genie()
             
-        self.num_results = 1
-        self.neglect_filters = []
-        self.neglect_projections = []
-        self.use_direct_sentence_state = False
+        self._settings_cond = threading.Condition()
+        self._inflight = 0
+        self._switching = False
+        self._waiting_switches = 0
+        self._counter_lock = threading.Lock()
+        self.queries_served = 0
+        # bumped whenever the server's dialogue state is lost, i.e. the server is (re)started, attached to or cleaned
+        self.generation = 0
+        self.__reset_settings()
 
         
     def initialize(self,
@@ -80,7 +144,12 @@ class Genie:
                     thingpedia_dir : str = 'None',
                     log_file_name : str = 'log.log',
                     force_update_model = False,
-                    force_update_manifest = False) -> None:
+                    force_update_manifest = False,
+                    max_log_lines = 1000,
+                    forward_logs = False,
+                    startup_timeout = 300,
+                    warmup = None,
+                    share = False) -> None:
         """
         ### Description:
         
@@ -90,7 +159,8 @@ class Genie:
 
         ### Args:
         
-        `nlu_server_address` (str): path to nlu files or online models. Use "localhost" if server is initialized by `Genie().nlu_server()`.
+        `nlu_server_address` (str): path to nlu files or online models. Use "localhost" if server is initialized by `Genie().nlu_server()`,
+        or "localhost/<model>" if it is started by a `pyGenieScript.nlu_registry.NLURegistry`.
             
         `thingpedia_dir` (str, optional): path to thingpedia directory. Defaults to 'None', which will use the latest `wip/geniescript` branch of `thingpedia-common-devices`.
                                             
@@ -99,6 +169,27 @@ class Genie:
         `force_update_model` (bool, optional): force to update the model (if download from huggingface). Defaults to False.
             
         `force_update_manifest` (bool, optional): force to update the manifest (if downloaded from git). Defaults to False.
+        
+        `max_log_lines` (int, optional): number of most recent stdout lines of the server kept in `self.process.logs()`. Defaults to 1000.
+        
+        `forward_logs` (bool, optional): forward the server's stdout to Python logging. Defaults to False.
+        
+        `startup_timeout` (float, optional): seconds to wait for the server to answer HTTP requests. None waits forever. Defaults to 300.
+        
+        `warmup` (`pyGenieScript.warmup.Warmup` or bool, optional): before returning, send synthetic utterances until latency is steady,
+        then erase the dialogue state they built, so the first real query does not pay for lazy loading. True uses a default `Warmup`.
+        The time spent is reported in `self.warmup_report`. Defaults to None (no warm-up).
+        
+        `share` (bool, optional): attach to a healthy server already started with `share` for the same NLU server and manifest on this host
+        (see `pyGenieScript.server_registry`), or start one that other processes can attach to. The last user to `quit` shuts it down.
+        A shared server holds a single dialogue state and a single set of settings, so it suits queries carrying their own `dialog_state`
+        sent by processes using the same settings. A `pyGenieScript.supervisor.Supervisor` of the process that started it can restart it,
+        and the other users follow it to its new port. If every user exits without `quit`, the server is shut down by the next process
+        attaching to or releasing a shared server on the host. Defaults to False.
+        
+        ### Raises:
+        
+        `RuntimeError`: in case the server exits or is not ready within `startup_timeout`. The server is shut down and the message includes its last output.
         """
         
         actual_server = self.download_or_find_model(nlu_server_address, force_update=force_update_model)
@@ -107,21 +198,95 @@ class Genie:
         
         actual_manifest = self.download_or_find_manifests(thingpedia_dir, force_update=force_update_manifest)
         
-        # initialize genie server and retrieve the randomly assigned port number
+        if share:
+            self._attach_contextual_genie(actual_server, actual_manifest, log_file_name, max_log_lines, forward_logs, startup_timeout, warmup)
+            return
+        
+        self._start_contextual_genie(actual_server, actual_manifest, log_file_name, max_log_lines, forward_logs)
+        self._wait_contextual_genie(startup_timeout)
+        self._warm_up_contextual_genie(warmup)
+      
+    
+    def _attach_contextual_genie(self, actual_server, actual_manifest, log_file_name, max_log_lines, forward_logs, startup_timeout, warmup):
+        """Use the shared contextual-genie for an already resolved NLU server and manifest, starting it if needed, see `initialize`."""
+        key = server_registry.server_key(actual_server, actual_manifest)
+        
+        def start():
+            # the server outlives this process if others still use it, so it does not log to a pipe
+            log_path = os.path.join(server_registry.registry_dir(), key + ".log")
+            self._start_contextual_genie(actual_server, actual_manifest, log_file_name, max_log_lines, forward_logs, log_path)
+            self._wait_contextual_genie(startup_timeout)
+            self._warm_up_contextual_genie(warmup)
+            return self.process.port, self.process.pid
+        
+        port_number, started = server_registry.attach(key, start)
+        self._shared_key = key
+        if not started:
+            self.__use_shared_server(port_number)
+    
+    
+    def __use_shared_server(self, port_number):
+        self.url = "http://127.0.0.1:{}/".format(port_number)
+        self.queries_served = 0
+        self.__new_generation()
+        self.__reset_settings()
+        # other users may have changed the settings of the server, so they are sent again on first use
+        self._settings_stale = True
+    
+    
+    def _start_contextual_genie(self, actual_server, actual_manifest, log_file_name = 'log.log', max_log_lines = 1000, forward_logs = False, log_path = None):
+        """Spawn contextual-genie for an already resolved NLU server and manifest, without waiting for it."""
         command = ['node', 'genie.js', 'contextual-genie',  '--nlu-server', actual_server, '--thingpedia-dir', actual_manifest,  '--log-file-name', log_file_name]
         self.logger.info(command)
-        process = subprocess.Popen(
+        self.process = GenieProcess(
             command,
-            cwd=os.path.join(current_file_directory, "node_modules", "genie-toolkit", "dist", "tool"),
-            stdout=subprocess.PIPE)
-        port_number = self.__retrieve_port_number(process)
+            cwd=os.path.join(self.node_modules, "genie-toolkit", "dist", "tool"),
+            max_log_lines=max_log_lines,
+            forward_logs=forward_logs,
+            logger=self.logger,
+            log_path=log_path)
+    
+    
+    def _wait_contextual_genie(self, timeout = None):
+        """Wait until the spawned contextual-genie is ready and point this Genie at it, shutting it down on failure."""
+        try:
+            # the server prints its randomly assigned port number, then starts answering requests
+            port_number = self.process.wait_ready(timeout)
+        except RuntimeError:
+            self.process.terminate()
+            raise
         self.url = "http://127.0.0.1:{}/".format(port_number)
-      
+        self.queries_served = 0
+        self.__new_generation()
+        self.__reset_settings()
+        
+        
+    def _warm_up_contextual_genie(self, warmup):
+        """Warm up the spawned contextual-genie, see `initialize`, shutting it down on failure."""
+        if not warmup:
+            return
+        if warmup is True:
+            warmup = Warmup()
+        try:
+            # bypasses the cache and metrics, which are about real traffic
+            self.warmup_report = warmup.run(
+                lambda utterance, deadline: self.__query(utterance, 1, [], [], None, False, [], False, None, deadline),
+                "contextual-genie")
+            self.clean(clear_cache = False)
+        except Exception:
+            self.process.terminate()
+            raise
+        
         
     def nlu_server(self, model_dir : str,
                    manifest_dir = "None",
                    force_update_model = False,
-                   force_update_manifests = False):
+                   force_update_manifests = False,
+                   max_log_lines = 1000,
+                   forward_logs = True,
+                   block = True,
+                   startup_timeout = 300,
+                   warmup = None):
         """
         ### Description:
         
@@ -142,10 +307,27 @@ class Genie:
         `force_update_model` (bool, optional): force to update the model (if download from huggingface). Defaults to False.
         
         `force_update_manifests` (bool, optional): force to update the manifest (if downloaded from git). Defaults to False.
+        
+        `max_log_lines` (int, optional): number of most recent stdout lines of the server kept in `self.nlu_process.logs()`. Defaults to 1000.
+        
+        `forward_logs` (bool, optional): forward the server's stdout to Python logging. Defaults to True.
+        
+        `block` (bool, optional): keep running until the server exits. If False, return as soon as the server is ready. Defaults to True.
+        
+        `startup_timeout` (float, optional): seconds to wait for the server to answer HTTP requests. None waits forever. Defaults to 300.
+        
+        `warmup` (`pyGenieScript.warmup.Warmup` or bool, optional): parse synthetic utterances until latency is steady before
+        registering the server for "localhost", see `initialize`. Defaults to None (no warm-up).
 
         ### Raises:
         
         `ValueError`: in case if model is not a valid model path nor a valid online model name.
+        
+        `RuntimeError`: in case the server exits or is not ready within `startup_timeout`. The server is shut down and the message includes its last output.
+        
+        ### Returns:
+        
+        (`pyGenieScript.process.GenieProcess`): handle of the server process, also available as `self.nlu_process`.
         """
         if "http" in model_dir or "localhost" in model_dir:
             raise ValueError("nlu_server: model must point to an actual file, not a server")
@@ -156,23 +338,75 @@ class Genie:
             actual_model_dir = "file://" + actual_model_dir
         actual_manifest_dir = self.download_or_find_manifests(manifest_dir, force_update=force_update_manifests)
             
-        command = ['node', 'genie.js', 'server', '--nlu-model', actual_model_dir, '--thingpedia', actual_manifest_dir, '--random-port']
+        self._start_nlu_server(actual_model_dir, actual_manifest_dir, max_log_lines = max_log_lines, forward_logs = forward_logs)
+        self._wait_nlu_server(startup_timeout, warmup)
+        
+        # the rest of the stdout is drained (and forwarded) in the background
+        if block:
+            self.nlu_process.wait()
+        return self.nlu_process
+    
+    
+    def _start_nlu_server(self, actual_model_dir, actual_manifest_dir, port = None, max_log_lines = 1000, forward_logs = True):
+        """Spawn the NLU server for an already resolved model and manifest, without waiting for it. Uses a random port unless `port` is given."""
+        self.nlu_process = self._spawn_nlu_server(actual_model_dir, actual_manifest_dir, port, max_log_lines, forward_logs)
+        self._nlu_port = port
+    
+    
+    def _spawn_nlu_server(self, actual_model_dir, actual_manifest_dir, port = None, max_log_lines = 1000, forward_logs = True):
+        """Spawn an NLU server and return its process, without attaching it to this Genie."""
+        command = ['node', 'genie.js', 'server', '--nlu-model', actual_model_dir, '--thingpedia', actual_manifest_dir]
+        command += ['--random-port'] if port is None else ['--port', str(port)]
         self.logger.info(command)
-        self.logger.debug("the above command is running in {}".format(os.path.join(current_file_directory, "node_modules", "genie-toolkit", "dist", "tool")))
-        process = subprocess.Popen(
+        self.logger.debug("the above command is running in {}".format(os.path.join(self.node_modules, "genie-toolkit", "dist", "tool")))
+        return GenieProcess(
             command,
-            cwd=os.path.join(current_file_directory, "node_modules", "genie-toolkit", "dist", "tool"),
-            stdout=subprocess.PIPE)
-        
-        # retrieve random port returned by genie server
-        port_number = self.__retrieve_port_number(process)
+            cwd=os.path.join(self.node_modules, "genie-toolkit", "dist", "tool"),
+            max_log_lines=max_log_lines,
+            forward_logs=forward_logs,
+            logger=self.logger)
+    
+    
+    def _wait_nlu_server(self, timeout = None, warmup = None):
+        """Wait until the spawned NLU server is ready (and warmed up) and register its port for "localhost", shutting it down on failure."""
+        try:
+            port_number = self.nlu_process.wait_ready(timeout, port = self._nlu_port)
+            if warmup:
+                url = "http://127.0.0.1:{}".format(port_number)
+                self.warmup_report = (Warmup() if warmup is True else warmup).run(
+                    lambda utterance, deadline: self.parse(utterance, url, timeout = None if deadline is None else deadline - time.monotonic()),
+                    "nlu")
+        except Exception:
+            self.nlu_process.terminate()
+            raise
         with open(os.path.join(current_file_directory, '_local_post_binding.txt'), 'w') as fd:
             fd.write(str(port_number))
-        
-        # prints the rest of the stdout after port has been retrieved
-        self.__print_process(process)
-        
-        process.communicate()
+        return port_number
+    
+    
+    def _restart_contextual_genie(self, timeout = None):
+        """Replace the contextual-genie process by a fresh one and bring it back to this Genie's current settings."""
+        settings = (self.num_results, self.neglect_filters, self.neglect_projections, self.use_direct_sentence_state)
+        self.process.terminate()
+        self.process = self.process.respawn()
+        self._wait_contextual_genie(timeout)
+        if self._shared_key is not None:
+            # the restarted server has a new port, which other users of a shared server look up again
+            server_registry.update(self._shared_key, self.process.port, self.process.pid)
+        self.__sync_settings(*settings)
+        self.__release_settings()
+    
+    
+    def _restart_nlu_server(self, timeout = None):
+        """Replace the NLU server by a fresh one on the same port, so contextual-genie servers using it keep working."""
+        port = self.nlu_process.port
+        self.nlu_process.terminate()
+        command = [arg for arg in self.nlu_process.command if arg != '--random-port']
+        if port is not None and '--port' not in command:
+            command += ['--port', str(port)]
+        self.nlu_process = self.nlu_process.respawn(command)
+        self._nlu_port = port
+        self._wait_nlu_server(timeout)
    
     
     def query(
@@ -184,7 +418,9 @@ class Genie:
         dialog_state = None,
         use_existing_ds = False,
         aux = [],
-        use_direct_sentence_state = False
+        use_direct_sentence_state = False,
+        timeout = None,
+        fields = None
     ):
         """
         ### Description:
@@ -208,6 +444,19 @@ class Genie:
         `num_results` (int, optional): number of results Genie should return. In practice, choose between 1, 2, 3, or 10. Defaults to 1.
         
         `dialog_state` (str, optional): dialog state to be put to Genie as context. Defaults to None (use current dialog state in context).
+        
+        `timeout` (float, optional): seconds the whole call may take, settings updates and retries included.
+        Each HTTP request only waits for what is left of it. Defaults to None (only the per-request `timeout` of `Genie` applies).
+        
+        `fields` ([str], optional): return a `pyGenieScript.result.QueryResult` decoded on first access that keeps only these
+        fields of the object below, e.g. `["user_target", "ds"]`. Defaults to None (return the whole object as a dict).
+        
+        ### Raises:
+        
+        `requests.exceptions.Timeout`: in case the call did not complete within `timeout`.
+        
+        `ValueError`: in case `neglect_filters` or `neglect_projections` leave out names already neglected by the server,
+        which contextual-genie cannot stop neglecting until it restarts.
 
         ### Returns:
         
@@ -222,72 +471,353 @@ class Genie:
             'full_verbal': verbalization of full state, empty list if error ([str]).
         }
         ```
+        
+        If this Genie has a `cache`, results of queries that carry their own `dialog_state` are cached,
+        keyed on the query, `dialog_state`, `aux` and the settings above.
+        
+        If this Genie has a `single_flight`, identical queries carrying their own `dialog_state` that are sent while
+        one of them is in flight share its result.
+        
+        If this Genie has `metrics`, the time spent in each phase ("cache", "settings_sync", "request", "decode" and "total")
+        is recorded for every call.
+        """
+        
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if fields is not None:
+            fields = tuple(fields)
+        args = (query, num_results, neglect_filters, neglect_projections, dialog_state, use_existing_ds, aux, use_direct_sentence_state, fields, deadline)
+        if self.single_flight is not None and dialog_state is not None and not use_existing_ds:
+            key = self.single_flight.key(query, dialog_state, aux, num_results, neglect_filters, neglect_projections, use_direct_sentence_state), fields
+            return self.single_flight.do(key, lambda: self.__query_or_recover(*args), timeout = timeout)
+        return self.__query_or_recover(*args)
+    
+    
+    def __query_or_recover(self, query, num_results, neglect_filters, neglect_projections, dialog_state, use_existing_ds, aux, use_direct_sentence_state, fields, deadline):
+        args = (query, num_results, neglect_filters, neglect_projections, dialog_state, use_existing_ds, aux, use_direct_sentence_state, fields, deadline)
+        with self._counter_lock:
+            self.queries_served += 1
+        try:
+            return self.__measured_query(*args)
+        except OSError:
+            # a query carrying its own dialog state can be retried once a supervisor has restarted the server,
+            # or once the user supervising a shared server restarted it; other queries depend on the state the crashed server held
+            if dialog_state is None or use_existing_ds:
+                raise
+            if self.supervisor is None:
+                port_number = None if self._shared_key is None else server_registry.lookup(self._shared_key)
+                if port_number is None or self.url == "http://127.0.0.1:{}/".format(port_number):
+                    raise
+                self.__use_shared_server(port_number)
+            else:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if (remaining is not None and remaining <= 0) or not self.supervisor.recover(remaining):
+                    raise
+            self.logger.info("retrying query after the Genie server was restarted")
+            return self.__measured_query(*args)
+    
+    
+    def __measured_query(self, *args):
+        if self.metrics is None:
+            return self.__query(*args)
+        
+        timings = {}
+        start = time.perf_counter()
+        try:
+            endpoint, res = self.__query(*args, timings)
+        except Exception:
+            self.metrics.increment("errors")
+            raise
+        timings["total"] = time.perf_counter() - start
+        self.metrics.observe(endpoint, timings)
+        return res
+    
+    
+    def __query(self, query, num_results, neglect_filters, neglect_projections, dialog_state, use_existing_ds, aux, use_direct_sentence_state, fields = None, deadline = None, timings = None):
+        # without `timings`, return the response; with it, fill in the phase timings and return `(endpoint, response)`
+        if timings is not None:
+            start = time.perf_counter()
+        
+        # only stateless queries can be cached, since other queries depend on and update Genie's current state
+        cache_key = None
+        if self.cache is not None and dialog_state is not None and not use_existing_ds:
+            cache_key = self.cache.key(query, dialog_state, aux, num_results, neglect_filters, neglect_projections, use_direct_sentence_state)
+            if fields is None:
+                res = self.cache.get(cache_key)
+            else:
+                res = self.cache.get_raw(cache_key)
+                res = None if res is None else QueryResult(res, fields)
+            if res is not None:
+                if timings is not None:
+                    timings["cache"] = time.perf_counter() - start
+                    return "cache", res
+                return res
+        
+        updates = self.__sync_settings(num_results, neglect_filters, neglect_projections, use_direct_sentence_state, deadline)
+        try:
+            method, endpoint, params = self._query_request(query, dialog_state, use_existing_ds, aux)
+            if timings is not None:
+                sent = time.perf_counter()
+                timings["settings_sync"] = sent - start
+                if updates:
+                    self.metrics.increment("settings_updates", len(updates))
+            
+            if (method == "GET"):
+                r = self.transport.send(method, self.url + endpoint, params = params, deadline = deadline)
+            else:
+                # a query carrying the whole dialog state gives the same answer when repeated
+                r = self.transport.send(method, self.url + endpoint, json = params, deadline = deadline, idempotent = 'ds' in params)
+        finally:
+            self.__release_settings()
+        if timings is not None:
+            received = time.perf_counter()
+            timings["request"] = received - sent
+        if fields is None:
+            res = value = r.json()
+        elif cache_key is not None:
+            # whether the result is worth caching is only known once decoded
+            value = loads(r.content)
+            res = QueryResult.from_dict(value, fields)
+        else:
+            res = QueryResult(r.content, fields)
+        if timings is not None:
+            timings["decode"] = time.perf_counter() - received
+        
+        # an empty `user_target` means the query failed, which is not worth caching
+        if cache_key is not None and value.get("user_target"):
+            if fields is None:
+                self.cache.put(cache_key, res)
+            else:
+                self.cache.put_raw(cache_key, r.content)
+        
+        if timings is not None:
+            return endpoint, res
+        return res
+
+
+    def __sync_settings(self, num_results, neglect_filters, neglect_projections, use_direct_sentence_state, deadline = None):
+        # settings are global to the server: queries with the current settings run concurrently, while a query
+        # that changes them waits for those in flight to finish, and holds back new ones meanwhile so it is not starved.
+        # Every successful call must be followed by `__release_settings` once the query has been answered
+        with self._settings_cond:
+            waiting = False
+            try:
+                while True:
+                    differ = self._settings_differ(num_results, neglect_filters, neglect_projections, use_direct_sentence_state)
+                    if not self._switching:
+                        if not differ and (waiting or self._waiting_switches == 0):
+                            self._inflight += 1
+                            return []
+                        if differ and self._inflight == 0:
+                            self._switching = True
+                            break
+                    if differ and not waiting:
+                        waiting = True
+                        self._waiting_switches += 1
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise deadline_exceeded("deadline exceeded while waiting to change the settings of {}".format(self.url))
+                    self._settings_cond.wait(remaining)
+            finally:
+                if waiting:
+                    self._waiting_switches -= 1
+                    self._settings_cond.notify_all()
+        
+        applied = False
+        try:
+            updates = self._settings_requests(num_results, neglect_filters, neglect_projections, use_direct_sentence_state)
+            try:
+                # the updates are independent of each other, so they are sent concurrently in a single round trip
+                responses = self.transport.post_all([(self.url + endpoint, payload) for endpoint, payload, _ in updates],
+                                                    deadline = deadline, idempotent = True) if updates else []
+            except BaseException:
+                # some of the updates may have been applied, so all of them are sent again next time
+                self._settings_stale = True
+                raise
+            self._settings_synced(num_results, neglect_filters, neglect_projections, use_direct_sentence_state, updates, responses)
+            applied = True
+        finally:
+            with self._settings_cond:
+                self._switching = False
+                if applied:
+                    self._inflight += 1
+                self._settings_cond.notify_all()
+        return updates
+    
+    
+    def __release_settings(self):
+        with self._settings_cond:
+            self._inflight -= 1
+            self._settings_cond.notify_all()
+    
+    
+    def _settings_differ(self, num_results, neglect_filters, neglect_projections, use_direct_sentence_state) -> bool:
+        """Whether the given settings differ from the ones last applied on Genie, or those are unknown."""
+        return (self._settings_stale
+                or num_results != self.num_results
+                or neglect_filters != self.neglect_filters
+                or neglect_projections != self.neglect_projections
+                or use_direct_sentence_state != self.use_direct_sentence_state)
+    
+    
+    def _settings_requests(self, num_results, neglect_filters, neglect_projections, use_direct_sentence_state):
         """
+        Return the POSTs needed to apply the given settings, as a list of `(endpoint, payload, failure message)`.
+        Once they are sent, pass their responses to `_settings_synced`.
+        
+        Only the neglected filters/projections that are not already applied on the server are sent.
+        
+        Raises `ValueError` in case filters/projections neglected on the server would have to be removed, which contextual-genie cannot do.
+        """
+        requests = []
+        stale = self._settings_stale
         
         # only need to POST num_results to Genie if it differs from current one
-        if (num_results != self.num_results):
-            self.num_results = num_results
-            r = requests.post(url = self.url + "setNumResults", json = {
-                "numResults": "{}".format(num_results)
-            })
-            res = r.json()
+        if (stale or num_results != self.num_results):
+            requests.append(("setNumResults",
+                             {"numResults": "{}".format(num_results)},
+                             "Setting numResults = {} failed".format(num_results)))
+        
+        if (stale or neglect_filters != self.neglect_filters):
+            for i in self.__neglect_delta("neglectFilters", neglect_filters, self._applied_neglect_filters):
+                requests.append(("neglectFilters",
+                                 {"name": i},
+                                 "Setting neglectFilters = {} failed".format(neglect_filters)))
+        
+        if (stale or neglect_projections != self.neglect_projections):
+            for i in self.__neglect_delta("neglectProjections", neglect_projections, self._applied_neglect_projections):
+                requests.append(("neglectProjections",
+                                 {"name": i},
+                                 "Setting neglectProjections = {} failed".format(neglect_projections)))
+        
+        if (stale or use_direct_sentence_state != self.use_direct_sentence_state):
+            requests.append(("toggleDirectSentenceState",
+                             {"directSentenceState": use_direct_sentence_state},
+                             "Setting use_direct_sentence_state = {} failed".format(use_direct_sentence_state)))
+        
+        return requests
+    
+    
+    def _settings_synced(self, num_results, neglect_filters, neglect_projections, use_direct_sentence_state, updates, responses):
+        """
+        Record the given settings as current once every POST of `_settings_requests` succeeded.
+        Otherwise they are unknown, and all of them are sent again before the next query.
+        """
+        failed = False
+        for res, (_, _, msg) in zip(responses, updates):
             if "response" not in res or res["response"] != 200:
-                msg = "Setting numResults = {} failed".format(num_results)
                 self.logger.warning(msg)
+                failed = True
+        if failed:
+            self._settings_stale = True
+            return
+        
+        self.num_results = num_results
+        self.neglect_filters = neglect_filters
+        self.neglect_projections = neglect_projections
+        self.use_direct_sentence_state = use_direct_sentence_state
+        self._applied_neglect_filters.update(neglect_filters)
+        self._applied_neglect_projections.update(neglect_projections)
+        self._settings_stale = False
+    
+    
+    def _query_request(self, query, dialog_state, use_existing_ds, aux):
+        """Return the `(method, endpoint, params)` of the HTTP call that runs `query`."""
+        if (use_existing_ds):
+            return "GET", "query", {'q': query}
         
-        if (neglect_filters != self.neglect_filters):
-            self.neglect_filters = neglect_filters
-            for i in neglect_filters:
-                r = requests.post(url = self.url + "neglectFilters", json= {
-                    "name": i
-                })
-                res = r.json()
-                if "response" not in res or res["response"] != 200:
-                    msg = "Setting neglectFilters = {} failed".format(neglect_filters)
-                    self.logger.warning(msg)
-        
-        if (neglect_projections != self.neglect_projections):
-            self.neglect_projections = neglect_projections
-            for i in neglect_projections:
-                r = requests.post(url = self.url + "neglectProjections", json= {
-                    "name": i
-                })
-                res = r.json()
-                if "response" not in res or res["response"] != 200:
-                    msg = "Setting neglectProjections = {} failed".format(neglect_projections)
-                    self.logger.warning(msg)
-        
-        if (use_direct_sentence_state != self.use_direct_sentence_state):
-            self.use_direct_sentence_state = use_direct_sentence_state
-            r = requests.post(url = self.url + "toggleDirectSentenceState", json= {
-                    "directSentenceState": use_direct_sentence_state
-            })
-            res = r.json()
-            if "response" not in res or res["response"] != 200:
-                msg = "Setting use_direct_sentence_state = {} failed".format(use_direct_sentence_state)
-                self.logger.warning(msg)
+        if dialog_state is None:
+            return "POST", "queryContext", {'q': query, "aux": aux}
+        return "POST", "queryContext", {'q': query, 'ds': dialog_state, "aux": aux}
+
+
+    def parse(self,
+              utterance : str,
+              nlu_server = "localhost",
+              limit = None,
+              context = None,
+              entities = None,
+              locale = "en-US",
+              timeout = None):
+        """
+        ### Description:
         
-        if (use_existing_ds):
-            params = {'q': query}
-            r = requests.get(url = self.url + "query", params = params)
-            res = r.json()
-        else:
-            if dialog_state is None:
-                params = {'q': query, "aux": aux}
-            else:
-                params = {'q': query, 'ds': dialog_state, "aux": aux}
-            
-            r = requests.post(url = self.url + "queryContext", json = params)
-            res = r.json()
-            
-        return res
+        Parse `utterance` into ThingTalk with the NLU server alone, without running a dialogue turn:
+        no skill is called and nothing is verbalized, so this is much cheaper than `query` when only
+        `user_target` is needed.
 
+        ### Args:
+        
+        `utterance` (str): sentence in natural language.
+        
+        `nlu_server` (str, optional): address of the NLU server. Use "localhost" (or "localhost/<model>") for a server started by
+        `Genie().nlu_server()` (or a `pyGenieScript.nlu_registry.NLURegistry`), see `download_or_find_model`. Defaults to "localhost".
+        
+        `limit` (int, optional): maximum number of candidate parses. Defaults to None (the server's default).
+        
+        `context` (str, optional): dialog state (in ThingTalk) to parse `utterance` in, e.g. `ds` returned by `query`. Defaults to None.
+        
+        `entities` (dict, optional): entities referred to by `context`. Defaults to None.
+        
+        `locale` (str, optional): locale of `utterance`. Defaults to "en-US".
+        
+        `timeout` (float, optional): seconds the call may take, see `query`. Defaults to None.
+        
+        ### Raises:
+        
+        `ValueError`: in case `nlu_server` is not the address of a server.
 
+        ### Returns:
+        
+        ```
+        {
+            'user_target': ThingTalk of the best parse, empty string if error (str),
+            'candidates': candidate parses, best first ([{'code': ThingTalk (str), 'score': float}]),
+            'tokens': tokenized utterance ([str]),
+            'entities': entities found in the utterance (JSON),
+            'error': message of the server, only in case of error (str)
+        }
+        ```
+        """
+        return self.parse_batch([utterance], nlu_server, limit, context, entities, locale, timeout)[0]
+    
+    
+    def parse_batch(self,
+                    utterances,
+                    nlu_server = "localhost",
+                    limit = None,
+                    context = None,
+                    entities = None,
+                    locale = "en-US",
+                    timeout = None):
+        """
+        ### Description:
+        
+        Parse every sentence of `utterances`, see `parse` for the arguments, and return the parses in order.
+        
+        The NLU server parses one sentence per request, so the batch is sent as concurrent requests over the pooled
+        keep-alive connections (`pool_size` at most at once), letting the server batch inference across them.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        url = "{}/{}/query".format(self.__nlu_url(nlu_server), locale)
+        payload = {"store": "no"}
+        if limit is not None:
+            payload["limit"] = limit
+        if context is not None:
+            payload["context"] = context
+        if entities is not None:
+            payload["entities"] = entities
+        
+        responses = self.transport.post_all([(url, dict(payload, q = utterance)) for utterance in utterances],
+                                            deadline = deadline, idempotent = True)
+        return [self.__parse_result(res) for res in responses]
+    
+    
     def quit(self):
         """
         ### Description:
         
         Shut down this Genie engine.
+        A server shared with other processes (see `initialize`) keeps running until its last user quits.
 
         ### Returns:
         
@@ -298,16 +828,56 @@ class Genie:
         }
         ```
         """
-        r = requests.post(url = self.url + "quit")
-        return r.json()
+        if self.supervisor is not None:
+            # an intentional shutdown must not look like a crash
+            self.supervisor.stop()
+        if self._nlu_leases:
+            from pyGenieScript import nlu_registry
+            leases, self._nlu_leases = self._nlu_leases, set()
+            for model in sorted(leases):
+                nlu_registry.detach(model)
+        if self._shared_key is not None:
+            key, self._shared_key = self._shared_key, None
+            if not server_registry.release(key):
+                # other processes still use the shared server
+                return {'response': 200}
+        return self.transport.post(self.url + "quit")
 
 
-    def clean(self):
+    def resource_usage(self):
+        """
+        ### Description:
+        
+        Sample the CPU and memory used by the processes this Genie started, see `GenieProcess.sample`.
+        
+        ### Returns:
+        
+        ```
+        {
+            'contextual-genie': sample of the process started by `initialize`, if running (dict),
+            'nlu': sample of the process started by `nlu_server`, if running (dict),
+            'queries': number of queries sent since the contextual-genie process started (int)
+        }
+        ```
+        """
+        usage = {"queries": self.queries_served}
+        for name, process in (("contextual-genie", self.process), ("nlu", self.nlu_process)):
+            sample = process.sample() if process is not None else None
+            if sample is not None:
+                usage[name] = sample
+        return usage
+    
+    
+    def clean(self, clear_cache = True):
         """
         ### Description:
         
         Erase and flush the current contextual state of Genie.
         Genie keeps an internal formal conversational state. This method erases conversation history stored by Genie.
+        
+        ### Args:
+        
+        `clear_cache` (bool, optional): also drop every result in this Genie's `cache`, if any. Defaults to True.
 
         ### Returns:
         
@@ -318,11 +888,13 @@ class Genie:
         }
         ```
         """
-        r = requests.post(url = self.url + "clean")
-        return r.json()
+        if clear_cache and self.cache is not None:
+            self.cache.clear()
+        self.__new_generation()
+        return self.transport.post(self.url + "clean")
 
         
-    def download_or_find_model(self, model_name : str, force_update = False) -> str:
+    def download_or_find_model(self, model_name : str, force_update = False, link_mode = "auto") -> str:
         """
         ### Description:
         
@@ -330,14 +902,18 @@ class Genie:
         
         (1) if model_name is a valid nlu directory, return it directly
         
-        (2) if model_name corresponds to available models (e.g. yelp), download/find it
+        (2) if model_name corresponds to available models (e.g. yelp, see `pyGenieScript.model_store.KNOWN_MODELS`), download/find it
         
         (3) raise error otherwise
+        
+        Downloaded models are linked from the Hugging Face hub cache into `pyGenieScript/models` rather than copied
+        when the file system allows it, and an update only touches files whose content changed.
 
         ### Args:
         
         `model_name` (str): path to nlu model or model name.
         `force_update` (bool, optional): force to update the model (if download from huggingface). Defaults to False.
+        `link_mode` (str, optional): how files are materialized, see `pyGenieScript.model_store.link_or_copy`. Defaults to "auto".
 
         ### Raises:
             
@@ -348,7 +924,7 @@ class Genie:
         (str): path to model
         """
         if "localhost" in model_name:
-            return self.__retrieve_localhost()
+            return self.__retrieve_localhost(model_name)
         
         if "http" in model_name:
             return model_name
@@ -356,17 +932,26 @@ class Genie:
         if (os.path.exists(os.path.join(model_name, 'config.json'))):
             return model_name
         
+        if self.bundle is not None:
+            for bundled_name, relpath in self.bundle["models"].items():
+                if bundled_name in model_name.lower():
+                    return os.path.join(self.bundle["path"], relpath)
+        
         # in the future, we will have one model that accomplishes a lot of things
         # so this is only a temporary solution. No need to check for individual models in the future
-        if "yelp" in model_name.lower():
-            model_dest_dir = os.path.join(current_file_directory, "models", "yelp-tunein")
-            if not os.path.exists(model_dest_dir) or force_update:
-                Path(model_dest_dir).mkdir(parents=True, exist_ok=True)
-                model_dir = snapshot_download(repo_id="stanford-oval/yelp-tunein")
+        for known_name, repo_id in model_store.KNOWN_MODELS.items():
+            if known_name not in model_name.lower():
+                continue
+            model_dest_dir = os.path.join(current_file_directory, "models", repo_id.split("/")[-1])
+            # directories copied by earlier versions have no manifest but are complete
+            valid = model_store.is_materialized(model_dest_dir) or os.path.exists(os.path.join(model_dest_dir, 'config.json'))
+            if not valid or (force_update and not self.offline):
+                # imported here since huggingface_hub is slow to import and rarely needed
+                from huggingface_hub import snapshot_download
+                model_dir = snapshot_download(repo_id=repo_id, local_files_only=self.offline)
                 
-                file_names = os.listdir(model_dir)
-                for file_name in file_names:
-                    shutil.copy(os.path.join(model_dir, file_name), model_dest_dir, follow_symlinks=True)
+                changed = model_store.materialize(model_dir, model_dest_dir, mode=link_mode)
+                self.logger.info("materialized {} changed file(s) of {} into {}".format(len(changed), model_dir, model_dest_dir))
                     
             return model_dest_dir
 
@@ -382,6 +967,9 @@ class Genie:
         (1) if manifest_name is a valid directory, return it directly
         
         (2) otherwise, downlaod the latest `wip/geniescript` branch of `thingpedia-common-devices`
+        
+        Downloaded manifests are shallow-cloned and built once per source tree into a cache shared by every process
+        on the machine (see `pyGenieScript.manifest_store`), so an update only rebuilds when the sources changed.
 
         ### Args:
         
@@ -396,20 +984,74 @@ class Genie:
         if (os.path.exists(manifest_name)):
             return manifest_name
         
-        manifests_dest_dir = os.path.join(current_file_directory, "thingpedia-common-devices", "geniescript")
-        if not os.path.exists(manifests_dest_dir):
-            subprocess.call(["git clone https://github.com/stanford-oval/thingpedia-common-devices.git"], cwd=current_file_directory, shell=True)
-            subprocess.call(["git checkout wip/geniescript"], cwd=os.path.join(current_file_directory, "thingpedia-common-devices"), shell=True)
-            subprocess.call(["make geniescript_install_2"], cwd=os.path.join(current_file_directory, "thingpedia-common-devices"), shell=True)
-        elif force_update:
-            subprocess.call(["git checkout wip/geniescript"], cwd=os.path.join(current_file_directory, "thingpedia-common-devices"), shell=True)
-            subprocess.call(["git pull"], cwd=os.path.join(current_file_directory, "thingpedia-common-devices"), shell=True)
-            subprocess.call(["make geniescript_install_2"], cwd=os.path.join(current_file_directory, "thingpedia-common-devices"), shell=True)
-            
-        return manifests_dest_dir
+        if self.bundle is not None:
+            return os.path.join(self.bundle["path"], self.bundle["manifests"])
+        
+        # checkouts made by earlier versions are kept until an update is requested
+        legacy_manifests_dir = os.path.join(current_file_directory, "thingpedia-common-devices", "geniescript")
+        if os.path.exists(legacy_manifests_dir) and (not force_update or self.offline):
+            return legacy_manifests_dir
+        
+        return manifest_store.find_or_build(force_update=force_update, offline=self.offline)
+    
+    
+    def __new_generation(self):
+        with self._counter_lock:
+            self.generation += 1
     
     
-    def __retrieve_localhost(self):
+    def __reset_settings(self):
+        # settings of a freshly started contextual-genie server
+        self.num_results = 1
+        self.neglect_filters = []
+        self.neglect_projections = []
+        self.use_direct_sentence_state = False
+        self._applied_neglect_filters = set()
+        self._applied_neglect_projections = set()
+        self._settings_stale = False
+    
+    def __neglect_delta(self, endpoint, requested, applied):
+        # contextual-genie can only add names to its neglected filters/projections, so only new names are sent,
+        # and removed ones would stay neglected until the server restarts
+        removed = applied.difference(requested)
+        if removed:
+            raise ValueError("{}: cannot remove {} from a running Genie server, restart it (or use another one) to clear them".format(endpoint, sorted(removed)))
+        return [i for i in dict.fromkeys(requested) if i not in applied]
+        
+    def __nlu_url(self, nlu_server):
+        if "localhost" in nlu_server:
+            # resolved on every call, so parsing alone does not hold a lease on the server
+            return self.__retrieve_localhost(nlu_server, lease = False).rstrip("/")
+        if nlu_server.startswith("http"):
+            return nlu_server.rstrip("/")
+        raise ValueError("parse: nlu_server must be the address of a server, not " + nlu_server)
+    
+    def __parse_result(self, res):
+        if res.get("result") != "ok":
+            return {"user_target": "", "candidates": [], "tokens": [], "entities": {}, "error": res.get("error", "unknown error")}
+        candidates = [{"code": " ".join(c["code"]), "score": c.get("score")} for c in res.get("candidates", [])]
+        return {
+            "user_target": candidates[0]["code"] if candidates else "",
+            "candidates": candidates,
+            "tokens": res.get("tokens", []),
+            "entities": res.get("entities", {}),
+        }
+        
+    def __retrieve_localhost(self, model_name = "localhost", lease = True):
+        # "localhost/<model>" refers to a server started by a `pyGenieScript.nlu_registry.NLURegistry`
+        if "/" in model_name:
+            from pyGenieScript import nlu_registry
+            model = model_name.split("/", 1)[1]
+            if not lease or model in self._nlu_leases:
+                url = nlu_registry.lookup(model)
+            else:
+                # this Genie counts as a user of the server until `quit`, so the registry does not evict it
+                url = nlu_registry.attach(model)
+                if url is not None:
+                    self._nlu_leases.add(model)
+            if url is None:
+                raise ValueError("no running NLU server is registered for model: " + model)
+            return url
         try:
             with open(os.path.join(current_file_directory, '_local_post_binding.txt'), "r") as fd:
                 port_number = fd.read().strip()
@@ -432,41 +1074,57 @@ class Genie:
             genie_desired_ver : str = json.loads(fd.read())['dependencies']['genie-toolkit']
         genie_desired_ver_hash = genie_desired_ver.split("#")[-1]
         
-        try:
-            res = subprocess.check_output(['npm', 'ls', '--json'], cwd=current_file_directory)
-            genie_installed_ver : str = json.loads(res)['dependencies']['genie-toolkit']['resolved']
-            genie_installed_ver_hash = genie_installed_ver.split("#")[-1]
-            
-            if genie_desired_ver_hash == genie_installed_ver_hash:
-                return False
-        except Exception as e:
-            self.logger.debug("__if_outdated_genie produced error {}".format(e))
-        
-        if 'genie_installed_ver_hash' in locals():
-            print("Installed genie-toolkit version: {}".format(genie_installed_ver_hash))
-        else:
-            print("Installed genie-toolkit version: N/A")
+        genie_installed_ver_hash = self.__installed_genie_hash()
+        if genie_desired_ver_hash == genie_installed_ver_hash:
+            return False
         
+        print("Installed genie-toolkit version: {}".format(genie_installed_ver_hash or "N/A"))
         print("Specified genie-toolkit version: {}\nwill reinstall genie-toolkit".format(genie_desired_ver_hash))
         print("This is likely due to outdated local Genie version")
         print("You can disregard any npm errors above as long as the new installation is successful")
         return True
     
-    def __retrieve_port_number(self, process):
-        while True:
-            output = process.stdout.readline()
-            if output == '' and process.poll() is not None:
-                break
-            if output and "Server port number at" in output.strip().decode():
-                port_number = int(output.strip().decode().split(',')[-1].strip())
-                break
-            
-        return port_number
-    
-    def __print_process(self, process):
-        def subprocess_yield(process):            
-            for stdout_line in iter(process.stdout.readline, ""):
-                yield stdout_line 
+    # commit hash of the installed genie-toolkit, None if unknown
+    def __installed_genie_hash(self):
+        node_modules = os.path.join(current_file_directory, "node_modules")
+        genie_package = os.path.join(node_modules, "genie-toolkit", "package.json")
+        stamp_file = os.path.join(node_modules, ".pygeniescript-install-stamp")
+        try:
+            genie_package_mtime = os.path.getmtime(genie_package)
+        except OSError:
+            return None
+        
+        # the stamp is only trusted while genie-toolkit has not been reinstalled since it was written
+        try:
+            with open(stamp_file, "r") as fd:
+                stamp = json.load(fd)
+            if stamp["mtime"] == genie_package_mtime:
+                return stamp["hash"]
+        except Exception:
+            pass
+        
+        genie_installed_ver = None
+        try:
+            # npm >= 7 records resolved versions in a hidden lockfile
+            with open(os.path.join(node_modules, ".package-lock.json"), "r") as fd:
+                genie_installed_ver = json.load(fd)["packages"]["node_modules/genie-toolkit"]["resolved"]
+        except Exception:
+            try:
+                # npm 6 records them in the package metadata
+                with open(genie_package, "r") as fd:
+                    genie_installed_ver = json.load(fd)["_resolved"]
+            except Exception:
+                try:
+                    res = subprocess.check_output(['npm', 'ls', '--json'], cwd=current_file_directory)
+                    genie_installed_ver = json.loads(res)['dependencies']['genie-toolkit']['resolved']
+                except Exception as e:
+                    self.logger.debug("__installed_genie_hash produced error {}".format(e))
+                    return None
+        genie_installed_ver_hash = genie_installed_ver.split("#")[-1]
         
-        for msg in subprocess_yield(process):
-            print(msg)
\ No newline at end of file
+        try:
+            with open(stamp_file, "w") as fd:
+                json.dump({"hash": genie_installed_ver_hash, "mtime": genie_package_mtime}, fd)
+        except OSError as e:
+            self.logger.debug("could not write {}: {}".format(stamp_file, e))
+        return genie_installed_ver_hash
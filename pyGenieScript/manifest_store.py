@@ -0,0 +1,170 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A content-addressed cache of built Thingpedia manifests.
+
+Builds live under `<cache_dir>/manifests/builds/<tree hash>`, so commits that do not change the source tree
+reuse the same build, and `<cache_dir>/manifests/commits/<commit>` records which tree a commit has.
+Any process (or machine sharing `cache_dir`) that resolves the same commit reuses the build.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import uuid
+
+from pyGenieScript.locks import file_lock
+
+DEFAULT_REPO_URL = "https://github.com/stanford-oval/thingpedia-common-devices.git"
+DEFAULT_BRANCH = "wip/geniescript"
+BUILD_TARGET = "geniescript_install_2"
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_dir() -> str:
+    """`$PYGENIESCRIPT_CACHE_DIR`, or `~/.cache/pyGenieScript`."""
+    return os.environ.get("PYGENIESCRIPT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "pyGenieScript"))
+
+
+def _git(*args, cwd = None) -> str:
+    return subprocess.run(["git"] + list(args), cwd = cwd, check = True, stdout = subprocess.PIPE).stdout.decode().strip()
+
+
+def remote_commit(repo_url : str, branch : str) -> str:
+    """Commit at the head of `branch` in `repo_url`, without cloning."""
+    output = _git("ls-remote", repo_url, "refs/heads/" + branch)
+    if not output:
+        raise ValueError("branch {} not found in {}".format(branch, repo_url))
+    return output.split()[0]
+
+
+def find_or_build(subdir = "geniescript",
+                  repo_url = DEFAULT_REPO_URL,
+                  branch = DEFAULT_BRANCH,
+                  cache_dir = None,
+                  force_update = False,
+                  offline = False) -> str:
+    """
+    ### Description:
+    
+    Return `subdir` of a built checkout of `branch` of `repo_url`, building it only if no cached build has the same source tree.
+    
+    Without `force_update`, the build last used for this repository and branch is returned without any network access.
+    Otherwise the branch head is looked up with `git ls-remote`, shallow-cloned if its commit is unknown,
+    and `make geniescript_install_2` only runs if its source tree has never been built.
+    
+    ### Args:
+    
+    `subdir` (str, optional): directory of the checkout to return. Defaults to "geniescript".
+    
+    `repo_url` (str, optional): git repository of the manifests. Defaults to `thingpedia-common-devices` on GitHub.
+    
+    `branch` (str, optional): branch to build. Defaults to "wip/geniescript".
+    
+    `cache_dir` (str, optional): cache root, see `default_cache_dir`. Defaults to None.
+    
+    `force_update` (bool, optional): look up the latest commit of `branch`. Defaults to False.
+    
+    `offline` (bool, optional): never access the network; only the build last used is considered. Defaults to False.
+    
+    ### Raises:
+    
+    `subprocess.CalledProcessError`: in case a git or make command fails.
+    
+    `ValueError`: in case `offline` is set and nothing has been built yet.
+    
+    ### Returns:
+    
+    (str): path to the manifest directory.
+    """
+    root = os.path.join(cache_dir or default_cache_dir(), "manifests")
+    pointer = os.path.join(root, "heads", hashlib.sha256("{}#{}".format(repo_url, branch).encode()).hexdigest())
+    
+    with file_lock(os.path.join(root, "lock")):
+        build = _read(pointer)
+        if build is not None and _is_built(build) and (not force_update or offline):
+            return os.path.join(build, subdir)
+        if offline:
+            raise ValueError("no manifest build of {} {} is available offline".format(repo_url, branch))
+        
+        commit = remote_commit(repo_url, branch)
+        tree = _read(os.path.join(root, "commits", commit))
+        if tree is None or not _is_built(os.path.join(root, "builds", tree)):
+            # the branch may have moved since `ls-remote`, so the tree is recorded for the commit actually cloned
+            commit, tree = _build(root, repo_url, branch)
+            _write(os.path.join(root, "commits", commit), tree)
+        
+        build = os.path.join(root, "builds", tree)
+        _write(pointer, build)
+        return os.path.join(build, subdir)
+
+
+def _build(root, repo_url, branch):
+    clone = os.path.join(root, "builds", "clone-" + uuid.uuid4().hex)
+    _git("clone", "--quiet", "--depth", "1", "--branch", branch, repo_url, clone)
+    commit = _git("rev-parse", "HEAD", cwd = clone)
+    tree = _git("rev-parse", "HEAD^{tree}", cwd = clone)
+    build = os.path.join(root, "builds", tree)
+    if _is_built(build):
+        # the branch moved to a commit with an already built tree since `ls-remote`
+        shutil.rmtree(clone)
+        return commit, tree
+    
+    # the build runs at its final path, since build outputs may record absolute paths
+    if os.path.exists(build):
+        shutil.rmtree(build)
+    os.rename(clone, build)
+    logger.info("building manifests of tree %s in %s", tree, build)
+    subprocess.run(["make", BUILD_TARGET], cwd = build, check = True)
+    open(os.path.join(build, ".pygeniescript-built"), "w").close()
+    return commit, tree
+
+
+def _is_built(build):
+    return os.path.exists(os.path.join(build, ".pygeniescript-built"))
+
+
+def _read(path):
+    try:
+        with open(path, "r") as fd:
+            return fd.read().strip() or None
+    except OSError:
+        return None
+
+
+def _write(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp = "{}.tmp-{}".format(path, os.getpid())
+    with open(tmp, "w") as fd:
+        fd.write(value)
+    os.replace(tmp, path)
@@ -0,0 +1,143 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import bisect
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """A cumulative latency histogram with fixed buckets."""
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value : float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class QueryMetrics:
+    """Per-phase latency histograms, counters and hooks for `Genie.query`."""
+    def __init__(self, buckets = DEFAULT_BUCKETS, window = 1000):
+        """
+        ### Args:
+        
+        `buckets` ([float], optional): upper bounds of the histogram buckets in seconds. Defaults to `DEFAULT_BUCKETS`.
+        
+        `window` (int, optional): number of most recent queries used by `percentiles`. Defaults to 1000.
+        """
+        self.buckets = tuple(buckets)
+        self.histograms = collections.OrderedDict()
+        self.counters = collections.Counter()
+        self.hooks = []
+        self._recent = collections.deque(maxlen = window)
+        self._lock = threading.Lock()
+    
+    def add_hook(self, hook):
+        """Call `hook(endpoint, timings)` after every query, with the phase timings in seconds. Exceptions of a hook are logged and ignored."""
+        self.hooks.append(hook)
+    
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+    
+    def observe(self, endpoint : str, timings : dict):
+        """Record one query answered by `endpoint` ("queryContext", "query" or "cache") with its `{phase: seconds}` timings."""
+        with self._lock:
+            for phase, seconds in timings.items():
+                histogram = self.histograms.get(phase)
+                if histogram is None:
+                    histogram = self.histograms[phase] = Histogram(self.buckets)
+                histogram.observe(seconds)
+            self.counters["queries", endpoint] += 1
+            if "total" in timings:
+                self._recent.append(timings["total"])
+        for hook in self.hooks:
+            try:
+                hook(endpoint, timings)
+            except Exception:
+                # a broken hook must not fail the query it observes, nor keep the other hooks from running
+                logger.exception("metrics hook %r failed", hook)
+    
+    def increment(self, name : str, value = 1):
+        """Add `value` to the counter `name`, e.g. "errors" or "settings_updates"."""
+        with self._lock:
+            self.counters[name] += value
+    
+    def percentiles(self, quantiles = (0.5, 0.9, 0.99)) -> dict:
+        """`{quantile: seconds}` of the total latency over the most recent queries, empty if there were none."""
+        with self._lock:
+            recent = sorted(self._recent)
+        if not recent:
+            return {}
+        return {q: recent[min(len(recent) - 1, int(q * len(recent)))] for q in quantiles}
+    
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self._recent.clear()
+    
+    def to_prometheus(self, prefix = "pygeniescript") -> str:
+        """All histograms and counters in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            name = prefix + "_query_phase_seconds"
+            lines.append("# HELP {} Latency of each phase of Genie.query.".format(name))
+            lines.append("# TYPE {} histogram".format(name))
+            for phase, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append('{}_bucket{{phase="{}",le="{}"}} {}'.format(name, phase, le, cumulative))
+                lines.append('{}_sum{{phase="{}"}} {}'.format(name, phase, histogram.sum))
+                lines.append('{}_count{{phase="{}"}} {}'.format(name, phase, histogram.count))
+            
+            name = prefix + "_queries_total"
+            lines.append("# HELP {} Queries by the endpoint that answered them.".format(name))
+            lines.append("# TYPE {} counter".format(name))
+            for key, count in sorted(self.counters.items(), key = str):
+                if isinstance(key, tuple):
+                    lines.append('{}{{endpoint="{}"}} {}'.format(name, key[1], count))
+            
+            for key, count in sorted(self.counters.items(), key = str):
+                if not isinstance(key, tuple):
+                    lines.append("# TYPE {}_{}_total counter".format(prefix, key))
+                    lines.append("{}_{}_total {}".format(prefix, key, count))
+        return "\n".join(lines) + "\n"
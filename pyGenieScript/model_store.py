@@ -0,0 +1,190 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Materialize model files from the Hugging Face hub cache (or any source directory) into a models directory
+without copying them when the file system allows it.
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+MANIFEST_NAME = ".pygeniescript-model.json"
+
+# Hugging Face repositories of the models that can be referred to by name, more can be added at run time
+KNOWN_MODELS = {
+    "yelp": "stanford-oval/yelp-tunein",
+}
+
+# Linux ioctl that makes `dst` share `src`'s data blocks (copy-on-write), on btrfs, xfs and similar
+_FICLONE = 0x40049409
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path : str) -> str:
+    """
+    Content hash of `path`.
+    
+    Files in the Hugging Face hub cache are symlinks to blobs named after their content hash, which is used directly.
+    Other files are hashed with SHA-256.
+    """
+    real_path = os.path.realpath(path)
+    if os.path.islink(path) and os.path.basename(os.path.dirname(real_path)) == "blobs":
+        return os.path.basename(real_path)
+    
+    sha256 = hashlib.sha256()
+    with open(real_path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def link_or_copy(src : str, dst : str, mode = "auto") -> str:
+    """
+    Make `dst` have the content of `src`, replacing `dst` atomically if it exists.
+    
+    ### Args:
+    
+    `src` (str): source file. Symlinks are resolved.
+    
+    `dst` (str): destination file.
+    
+    `mode` (str, optional): one of "hardlink", "reflink", "symlink", "copy", or "auto" to try them in that order. Defaults to "auto".
+    
+    ### Returns:
+    
+    (str): the method that was used.
+    """
+    src = os.path.realpath(src)
+    methods = ["hardlink", "reflink", "symlink", "copy"] if mode == "auto" else [mode]
+    tmp = "{}.tmp-{}".format(dst, os.getpid())
+    for method in methods:
+        try:
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            if method == "hardlink":
+                os.link(src, tmp)
+            elif method == "reflink":
+                _reflink(src, tmp)
+            elif method == "symlink":
+                os.symlink(src, tmp)
+            elif method == "copy":
+                shutil.copy2(src, tmp)
+            else:
+                raise ValueError("unknown materialization mode: " + method)
+            os.replace(tmp, dst)
+            return method
+        except OSError as e:
+            if method == methods[-1]:
+                raise
+            logger.debug("%s %s -> %s failed: %s", method, src, dst, e)
+    
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as src_fd, open(dst, "wb") as dst_fd:
+        try:
+            fcntl.ioctl(dst_fd.fileno(), _FICLONE, src_fd.fileno())
+        except OSError:
+            dst_fd.close()
+            os.remove(dst)
+            raise
+
+
+def read_manifest(dest_dir : str) -> dict:
+    """The `{relative path: {"digest", "size"}}` manifest of a materialized directory, empty if there is none."""
+    try:
+        with open(os.path.join(dest_dir, MANIFEST_NAME), "r") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_materialized(dest_dir : str) -> bool:
+    """Whether every file recorded in `dest_dir`'s manifest is present with its recorded size."""
+    manifest = read_manifest(dest_dir)
+    if not manifest:
+        return False
+    for name, entry in manifest.items():
+        try:
+            if os.path.getsize(os.path.join(dest_dir, name)) != entry["size"]:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def materialize(src_dir : str, dest_dir : str, mode = "auto") -> dict:
+    """
+    ### Description:
+    
+    Make `dest_dir` mirror the files of `src_dir`, linking rather than copying them when possible (see `link_or_copy`).
+    
+    Only files whose content hash differs from the one recorded in `dest_dir`'s manifest are touched,
+    and files that disappeared from `src_dir` since the last call are removed.
+    
+    ### Returns:
+    
+    (dict): `{relative path: method}` for every file that was (re)materialized.
+    """
+    os.makedirs(dest_dir, exist_ok = True)
+    old_manifest = read_manifest(dest_dir)
+    manifest = {}
+    changed = {}
+    
+    for root, _, files in os.walk(src_dir):
+        for file_name in files:
+            src = os.path.join(root, file_name)
+            name = os.path.relpath(src, src_dir)
+            dst = os.path.join(dest_dir, name)
+            entry = {"digest": file_digest(src), "size": os.path.getsize(src)}
+            manifest[name] = entry
+            
+            if old_manifest.get(name) == entry and os.path.exists(dst) and os.path.getsize(dst) == entry["size"]:
+                continue
+            os.makedirs(os.path.dirname(dst), exist_ok = True)
+            changed[name] = link_or_copy(src, dst, mode)
+    
+    for name in set(old_manifest) - set(manifest):
+        try:
+            os.remove(os.path.join(dest_dir, name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+    
+    tmp = os.path.join(dest_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp, "w") as fd:
+        json.dump(manifest, fd, indent = 2, sort_keys = True)
+    os.replace(tmp, os.path.join(dest_dir, MANIFEST_NAME))
+    return changed
@@ -0,0 +1,321 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Serve several NLU models on one host: servers are started the first time their model is requested,
+and idle ones are shut down, least recently used first, when they use more memory than a budget.
+
+Running servers are recorded in a model→port file, so other processes can use them with
+`Genie().initialize("localhost/<model>", ...)`. Such processes are recorded as users of the server until
+they `quit` (or die), and a server with users is never evicted.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.locks import file_lock
+from pyGenieScript.process import pid_alive
+
+DEFAULT_REGISTRY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_nlu_registry.json")
+
+logger = logging.getLogger(__name__)
+
+
+def read_registry(path = None) -> dict:
+    """The model→server mapping recorded in `path`, as `{model: {"port", "pid", "model_dir", "users"}}`."""
+    try:
+        with open(path or DEFAULT_REGISTRY_PATH, "r") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def lookup(model : str, path = None):
+    """URL of the running NLU server registered for `model` in `path`, None if there is none."""
+    entry = read_registry(path).get(model)
+    if entry is None or not pid_alive(entry["pid"]):
+        return None
+    return "http://127.0.0.1:{}".format(entry["port"])
+
+
+def attach(model : str, path = None):
+    """Like `lookup`, and register this process as a user of the server, which keeps it from being evicted until `detach`."""
+    with _locked(path or DEFAULT_REGISTRY_PATH) as registry:
+        entry = registry.get(model)
+        if entry is None:
+            return None
+        entry["users"] = entry.get("users", []) + [os.getpid()]
+        return "http://127.0.0.1:{}".format(entry["port"])
+
+
+def detach(model : str, path = None):
+    """Unregister one use of the server for `model` by this process."""
+    with _locked(path or DEFAULT_REGISTRY_PATH) as registry:
+        users = registry.get(model, {}).get("users", [])
+        if os.getpid() in users:
+            users.remove(os.getpid())
+
+
+def _live_users(entry):
+    return [pid for pid in entry.get("users", []) if pid_alive(pid)]
+
+
+@contextlib.contextmanager
+def _locked(path):
+    # other processes may update the file concurrently, entries of servers that died and users that died are dropped on the way
+    with file_lock(path + ".lock"):
+        registry = {k: v for k, v in read_registry(path).items() if pid_alive(v["pid"])}
+        for entry in registry.values():
+            entry["users"] = _live_users(entry)
+        yield registry
+        tmp = "{}.tmp-{}".format(path, os.getpid())
+        with open(tmp, "w") as fd:
+            json.dump(registry, fd, indent = 2)
+        os.replace(tmp, path)
+
+
+def _update(path, model, entry):
+    with _locked(path) as registry:
+        if entry is None:
+            registry.pop(model, None)
+        else:
+            registry[model] = entry
+
+
+def _remove_unused(path, model) -> bool:
+    """Remove the entry of `model` unless other processes use its server, return whether it was removed."""
+    with _locked(path) as registry:
+        if registry.get(model, {}).get("users"):
+            return False
+        registry.pop(model, None)
+        return True
+
+
+class _Server:
+    def __init__(self, model):
+        self.model = model
+        self.process = None
+        self.users = 0
+        self.last_used = 0.0
+        self.start_lock = threading.Lock()
+    
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+
+class NLURegistry:
+    """
+    ### Description:
+    
+    NLU servers for several models, started on demand.
+    
+    ```
+    registry = NLURegistry(memory_budget = 16 * 2 ** 30)
+    genie = Genie()
+    with registry.use("yelp") as url:
+        genie.initialize(url, "None")
+        ...
+    registry.shutdown()
+    ```
+    
+    `url` returns the address of the server for a model, starting it if needed. A server is in use between
+    `acquire` and `release` (or within `use`), e.g. while contextual-genie servers point to it, or while another process
+    uses it through "localhost/<model>" (see `attach`), and is never evicted then.
+    
+    ### Args:
+    
+    `memory_budget` (int, optional): resident bytes all servers may use together. Once exceeded, servers not in use are shut down,
+    least recently used first. Defaults to None (no budget).
+    
+    `manifest_dir` (str, optional): path to thingpedia directory, see `Genie.nlu_server`. Defaults to 'None'.
+    
+    `path` (str, optional): file recording the model→port mapping. Defaults to `_nlu_registry.json` in the package directory.
+    
+    `genie` (`Genie`, optional): instance used to resolve models and start servers. Defaults to a new `Genie`.
+    
+    `startup_timeout` (float, optional): seconds a server has to become ready. Defaults to 300.
+    
+    `forward_logs` (bool, optional): forward the stdout of the servers to Python logging. Defaults to False.
+    """
+    def __init__(self,
+                 memory_budget = None,
+                 manifest_dir = "None",
+                 path = None,
+                 genie = None,
+                 startup_timeout = 300,
+                 forward_logs = False):
+        self.memory_budget = memory_budget
+        self.manifest_dir = manifest_dir
+        self.path = path or DEFAULT_REGISTRY_PATH
+        self.genie = genie or Genie()
+        self.startup_timeout = startup_timeout
+        self.forward_logs = forward_logs
+        self.stats = {"starts": 0, "evictions": 0}
+        self._servers = {}
+        self._lock = threading.Lock()
+        self._actual_manifest_dir = None
+    
+    
+    def url(self, model : str) -> str:
+        """
+        ### Description:
+        
+        Address of the NLU server for `model` (a path or a model name, see `Genie.download_or_find_model`),
+        starting it first if it is not running.
+        
+        ### Raises:
+        
+        `RuntimeError`: in case the server exits or is not ready within `startup_timeout`.
+        """
+        return self.__get(model, pin = False)
+    
+    
+    def acquire(self, model : str) -> str:
+        """Like `url`, and keep the server from being evicted until `release` is called as many times."""
+        return self.__get(model, pin = True)
+    
+    
+    def release(self, model : str):
+        with self._lock:
+            server = self._servers.get(model)
+            if server is not None and server.users > 0:
+                server.users -= 1
+        self.__evict()
+    
+    
+    @contextlib.contextmanager
+    def use(self, model : str):
+        """Hold the server for `model` between `acquire` and `release` for the duration of the block, yielding its address."""
+        url = self.acquire(model)
+        try:
+            yield url
+        finally:
+            self.release(model)
+    
+    
+    def servers(self) -> dict:
+        """The running servers, as `{model: {"port", "pid", "users", "idle"}}` with `idle` in seconds."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {"port": s.process.port, "pid": s.process.pid, "users": s.users, "idle": now - s.last_used}
+                for model, s in self._servers.items() if s.running
+            }
+    
+    
+    def shutdown(self):
+        """Shut down every server and remove them from the model→port file."""
+        with self._lock:
+            servers = list(self._servers.values())
+            self._servers.clear()
+        for server in servers:
+            self.__stop(server)
+    
+    
+    def __get(self, model, pin):
+        with self._lock:
+            server = self._servers.get(model)
+            if server is None:
+                server = self._servers[model] = _Server(model)
+            # counted as a user while starting so that it is not evicted meanwhile
+            server.users += 1
+        try:
+            with server.start_lock:
+                if not server.running:
+                    self.__start(server)
+            with self._lock:
+                server.last_used = time.monotonic()
+            url = "http://127.0.0.1:{}".format(server.process.port)
+        except BaseException:
+            with self._lock:
+                server.users -= 1
+            raise
+        if not pin:
+            with self._lock:
+                server.users -= 1
+        self.__evict(keep = server)
+        return url
+    
+    
+    def __start(self, server):
+        model_dir = self.genie.download_or_find_model(server.model)
+        if not model_dir.startswith("file://"):
+            model_dir = "file://" + model_dir
+        if self._actual_manifest_dir is None:
+            self._actual_manifest_dir = self.genie.download_or_find_manifests(self.manifest_dir)
+        
+        process = self.genie._spawn_nlu_server(model_dir, self._actual_manifest_dir, forward_logs = self.forward_logs)
+        try:
+            process.wait_ready(self.startup_timeout)
+        except RuntimeError:
+            process.terminate()
+            raise
+        server.process = process
+        self.stats["starts"] += 1
+        _update(self.path, server.model, {"port": process.port, "pid": process.pid, "model_dir": model_dir, "users": []})
+        logger.info("started NLU server for %s on port %d", server.model, process.port)
+    
+    
+    def __stop(self, server):
+        if server.process is not None:
+            server.process.terminate()
+        _update(self.path, server.model, None)
+    
+    
+    def __evict(self, keep = None):
+        if self.memory_budget is None:
+            return
+        while True:
+            with self._lock:
+                running = [s for s in self._servers.values() if s.running]
+                total = 0
+                for s in running:
+                    sample = s.process.last_sample
+                    # samples are cheap, but reuse a recent one when many servers are looked up at once
+                    if sample is None or time.monotonic() - sample["time"] > 1:
+                        sample = s.process.sample()
+                    total += sample["rss"] if sample is not None else 0
+                if total <= self.memory_budget:
+                    return
+                idle = sorted((s for s in running if s.users == 0 and s is not keep), key = lambda s: s.last_used)
+                # servers used by other processes are skipped, checking and unregistering at once so none can attach meanwhile
+                victim = next((s for s in idle if _remove_unused(self.path, s.model)), None)
+                if victim is None:
+                    return
+                del self._servers[victim.model]
+                self.stats["evictions"] += 1
+            logger.info("evicting NLU server for %s, servers use %d MiB of a %d MiB budget",
+                        victim.model, total // 2 ** 20, self.memory_budget // 2 ** 20)
+            victim.process.terminate()
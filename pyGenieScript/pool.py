@@ -0,0 +1,445 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.process import free_port
+from pyGenieScript.transport import deadline_exceeded
+
+
+def _settings_key(num_results, neglect_filters, neglect_projections, use_direct_sentence_state):
+    return (num_results, tuple(neglect_filters), tuple(neglect_projections), use_direct_sentence_state)
+
+
+class _Worker:
+    """Routing state of one contextual-genie process in a `GeniePool`."""
+    def __init__(self, genie : Genie):
+        self.genie = genie
+        self.outstanding = 0
+        self.conversation = None
+        self.draining = False
+        self.settings = _settings_key(genie.num_results, genie.neglect_filters, genie.neglect_projections, genie.use_direct_sentence_state)
+
+
+class GeniePool:
+    """A pool of contextual-genie processes that spreads queries across them."""
+    def __init__(self,
+                 num_workers = None,
+                 check_genie_version = True,
+                 pool_size = 10,
+                 timeout = None,
+                 urls = None,
+                 genies = None,
+                 recycle = None,
+                 hedge_after = None,
+                 single_flight = None,
+                 bundle = None):
+        """
+        Prepare `num_workers` Genie instances, see `Genie`.
+        
+        Each worker is a separate contextual-genie process with its own dialogue state and settings, so a pool
+        answers up to `num_workers` queries in parallel.
+        
+        ### Args:
+        
+        `num_workers` (int, optional): number of contextual-genie processes. Defaults to the number of CPUs.
+        
+        `check_genie_version` (bool, optional): see `Genie`. Default to True.
+        
+        `pool_size` (int, optional): maximum number of keep-alive connections to each worker. Defaults to 10.
+        
+        `timeout` (float or tuple, optional): default timeout in seconds of each HTTP call. Defaults to None (wait forever).
+        
+        `urls` ([str], optional): addresses of already running contextual-genie servers to use as workers,
+        in which case `num_workers` is ignored and `initialize` does not need to be called. Defaults to None.
+        
+        `genies` ([`Genie`], optional): already initialized Genie instances to use as workers, e.g. from `pyGenieScript.stack.start_stack`. Defaults to None.
+        
+        `recycle` (`pyGenieScript.resources.RecyclePolicy`, optional): when to replace a worker's contextual-genie process by a fresh one.
+        A worker due for recycling takes no new queries or conversations, and is restarted once its outstanding queries are answered
+        and its conversation ended, so no query is dropped. Defaults to None (never recycle).
+        
+        `hedge_after` (float, optional): seconds after which a query carrying its own `dialog_state` that has not been answered yet
+        is also sent to a second idle worker; the first answer is returned. A good value is around the 95th percentile of the query
+        latency (see `pyGenieScript.metrics.QueryMetrics`), which hedges about 5% of queries. Defaults to None (no hedging).
+        
+        Counts of queries, hedged queries and hedges that answered first are kept in `stats`.
+        
+        `single_flight` (`pyGenieScript.coalesce.SingleFlight`, optional): coalesce identical concurrent queries carrying their own `dialog_state`
+        before they take a worker, see `Genie`. Defaults to None (no coalescing).
+        
+        `bundle` (str, optional): directory of an unpacked runtime bundle every worker runs from, see `Genie`. Defaults to None.
+        """
+        if genies is not None:
+            genies = list(genies)
+        elif urls is not None:
+            genies = [Genie(pool_size = pool_size, timeout = timeout, url = url) for url in urls]
+        else:
+            num_workers = num_workers or os.cpu_count() or 1
+            # only the first instance needs to install or check genie-toolkit
+            genies = [Genie(check_genie_version = check_genie_version, pool_size = pool_size, timeout = timeout, bundle = bundle)]
+            genies += [Genie(check_genie_version = False, pool_size = pool_size, timeout = timeout, bundle = bundle) for _ in range(num_workers - 1)]
+        
+        self.workers = [_Worker(genie) for genie in genies]
+        self.logger = genies[0].logger
+        self.recycle = recycle
+        self.recycles = 0
+        self.hedge_after = hedge_after
+        self.single_flight = single_flight
+        self.stats = collections.Counter()
+        self._executor = None
+        self.nlu_process = None
+        self._conversations = {}
+        self._cond = threading.Condition()
+    
+    
+    def initialize(self,
+                   nlu_server_address : str,
+                   thingpedia_dir : str = 'None',
+                   log_file_name : str = 'log.log',
+                   force_update_model = False,
+                   force_update_manifest = False,
+                   startup_timeout = 300,
+                   warmup = None) -> None:
+        """
+        ### Description:
+        
+        Start every worker in parallel, see `Genie.initialize` for arguments.
+        
+        The model and manifest are resolved (and downloaded, if needed) once and shared by all workers.
+        With several workers and a local model, a single NLU server is started for the pool (and shut down by `quit`)
+        and every worker uses it, so the model is loaded once. With `warmup`, workers are warmed up once it is ready.
+        Worker `i` logs to `log_file_name` suffixed with `-i`.
+        
+        If any worker or the NLU server fails to start, the processes already started are shut down and the error is raised.
+        """
+        genie = self.workers[0].genie
+        actual_server = genie.download_or_find_model(nlu_server_address, force_update = force_update_model)
+        actual_manifest = genie.download_or_find_manifests(thingpedia_dir, force_update = force_update_manifest)
+        root, ext = os.path.splitext(log_file_name)
+        
+        port = None
+        if len(self.workers) > 1 and not actual_server.startswith("http"):
+            port = free_port()
+            if (not actual_server.startswith("file://")):
+                actual_server = "file://" + actual_server
+            self.nlu_process = genie._spawn_nlu_server(actual_server, actual_manifest, port = port)
+            actual_server = "http://127.0.0.1:{}".format(port)
+        
+        def start(i):
+            # warming up needs the NLU server, which may not be ready yet
+            self.workers[i].genie.initialize(actual_server, actual_manifest, log_file_name = "{}-{}{}".format(root, i, ext),
+                                             startup_timeout = startup_timeout, warmup = warmup if port is None else None)
+        
+        with ThreadPoolExecutor(max_workers = len(self.workers) + 1) as executor:
+            futures = [executor.submit(start, i) for i in range(len(self.workers))]
+            if port is not None:
+                nlu_future = executor.submit(self.nlu_process.wait_ready, startup_timeout, port)
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if port is not None and nlu_future.exception() is not None:
+            errors.append(nlu_future.exception())
+        
+        if not errors and port is not None and warmup:
+            with ThreadPoolExecutor(max_workers = len(self.workers)) as executor:
+                warmups = [executor.submit(worker.genie._warm_up_contextual_genie, warmup) for worker in self.workers]
+            errors = [f.exception() for f in warmups if f.exception() is not None]
+        
+        if errors:
+            for worker, future in zip(self.workers, futures):
+                if future.exception() is None:
+                    try:
+                        worker.genie.quit()
+                    except OSError:
+                        # shut down already, by a failed warm-up
+                        pass
+            self.__stop_nlu_server()
+            raise errors[0]
+    
+    
+    def query(
+        self,
+        query : str,
+        num_results = 1,
+        neglect_filters = [],
+        neglect_projections = [],
+        dialog_state = None,
+        use_existing_ds = False,
+        aux = [],
+        use_direct_sentence_state = False,
+        conversation_id = None,
+        timeout = None,
+        fields = None
+    ):
+        """
+        ### Description:
+        
+        Query a worker, see `Genie.query` for the other arguments and the returned JSON object.
+        
+        With a `conversation_id`, the query goes to the worker holding that conversation. A new conversation takes
+        a free worker (one without a conversation and without outstanding queries) and keeps it until `end_conversation`.
+        
+        Without a `conversation_id`, the query must carry its own `dialog_state`. It goes to the worker without a
+        conversation that has the fewest outstanding queries, preferring workers whose settings already match.
+        
+        In both cases the call waits while no suitable worker is available.
+        
+        With `hedge_after`, a query without a `conversation_id` may also be sent to a second worker, see `GeniePool`.
+        
+        ### Args:
+        
+        `conversation_id` (hashable, optional): identifier of a stateful conversation. Defaults to None.
+        
+        `timeout` (float, optional): seconds the whole call may take, waiting for a worker included. Defaults to None.
+        
+        ### Raises:
+        
+        `ValueError`: in case neither `conversation_id` nor `dialog_state` is given.
+        
+        `requests.exceptions.Timeout`: in case the call did not complete within `timeout`.
+        """
+        if conversation_id is None and dialog_state is None:
+            raise ValueError("GeniePool.query: a query needs either a conversation_id or a dialog_state")
+        
+        deadline = None if timeout is None else time.monotonic() + timeout
+        settings = _settings_key(num_results, neglect_filters, neglect_projections, use_direct_sentence_state)
+        kwargs = {
+            "num_results": num_results,
+            "neglect_filters": neglect_filters,
+            "neglect_projections": neglect_projections,
+            "dialog_state": dialog_state,
+            "use_existing_ds": use_existing_ds,
+            "aux": aux,
+            "use_direct_sentence_state": use_direct_sentence_state,
+            "fields": fields,
+        }
+        if self.single_flight is not None and conversation_id is None and not use_existing_ds:
+            key = self.single_flight.key(query, dialog_state, aux, num_results, neglect_filters, neglect_projections, use_direct_sentence_state)
+            key = key, None if fields is None else tuple(fields)
+            return self.single_flight.do(key, lambda: self.__query(query, settings, deadline, conversation_id, kwargs), timeout = timeout)
+        return self.__query(query, settings, deadline, conversation_id, kwargs)
+    
+    
+    def end_conversation(self, conversation_id):
+        """
+        ### Description:
+        
+        Erase the state of a conversation and free its worker for other conversations.
+        Does nothing if the conversation is unknown.
+        """
+        with self._cond:
+            worker = self._conversations.pop(conversation_id, None)
+            if worker is None:
+                return
+            worker.outstanding += 1
+        try:
+            worker.genie.clean()
+        finally:
+            with self._cond:
+                worker.conversation = None
+            self.__release(worker)
+    
+    
+    def clean(self):
+        """
+        ### Description:
+        
+        Erase the state of every worker and forget every conversation.
+        """
+        with self._cond:
+            self._conversations.clear()
+            for worker in self.workers:
+                worker.conversation = None
+        results = [worker.genie.clean() for worker in self.workers]
+        for worker in self.workers:
+            self.__try_recycle(worker)
+        return results
+    
+    
+    def quit(self):
+        """
+        ### Description:
+        
+        Shut down every worker, and the NLU server started by `initialize`, if any.
+        """
+        res = [worker.genie.quit() for worker in self.workers]
+        self.__stop_nlu_server()
+        return res
+    
+    
+    def __stop_nlu_server(self):
+        if self.nlu_process is not None:
+            self.nlu_process.terminate()
+            self.nlu_process = None
+    
+    
+    def __query(self, query, settings, deadline, conversation_id, kwargs):
+        self.__count("queries")
+        worker = self.__acquire(conversation_id, settings, deadline)
+        if self.hedge_after is not None and conversation_id is None and not kwargs["use_existing_ds"]:
+            return self.__hedged_query(worker, settings, deadline, query, kwargs)
+        return self.__run(worker, deadline, query, kwargs)
+    
+    
+    def __run(self, worker, deadline, query, kwargs):
+        try:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            return worker.genie.query(query, timeout = timeout, **kwargs)
+        finally:
+            self.__release(worker)
+            self.__check_recycle(worker)
+    
+    
+    def __hedged_query(self, worker, settings, deadline, query, kwargs):
+        with self._cond:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers = 2 * len(self.workers), thread_name_prefix = "genie-hedge")
+        pending = {self._executor.submit(self.__run, worker, deadline, query, kwargs)}
+        hedge = None
+        
+        delay = self.hedge_after if deadline is None else min(self.hedge_after, deadline - time.monotonic())
+        done, pending = wait(pending, timeout = max(0, delay))
+        if not done:
+            with self._cond:
+                # a hedge only helps on a worker that is not busy, preferably one that needs no settings switch
+                idle = [w for w in self.workers if w is not worker and w.conversation is None and not w.draining and w.outstanding == 0]
+                second = min(idle, key = lambda w: w.settings != settings) if idle else None
+                if second is not None:
+                    second.outstanding += 1
+                    second.settings = settings
+            if second is not None:
+                self.__count("hedges")
+                hedge = self._executor.submit(self.__run, second, deadline, query, kwargs)
+                pending.add(hedge)
+        
+        # the first successful answer wins, the other request finishes in the background
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.__count("hedge_wins")
+                    return future.result()
+                error = error or future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+    
+    
+    def __acquire(self, conversation_id, settings, deadline = None):
+        with self._cond:
+            while True:
+                worker = self.__pick(conversation_id, settings)
+                if worker is not None:
+                    worker.outstanding += 1
+                    worker.settings = settings
+                    return worker
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise deadline_exceeded("no Genie worker became available within the deadline")
+                self._cond.wait(remaining)
+    
+    
+    def __pick(self, conversation_id, settings):
+        # a worker can only switch settings once its outstanding queries are answered
+        def usable(worker):
+            return worker.settings == settings or worker.outstanding == 0
+        
+        if conversation_id is not None:
+            worker = self._conversations.get(conversation_id)
+            if worker is None:
+                free = [w for w in self.workers if w.conversation is None and w.outstanding == 0 and not w.draining]
+                if not free:
+                    return None
+                worker = free[0]
+                worker.conversation = conversation_id
+                self._conversations[conversation_id] = worker
+            return worker if usable(worker) else None
+        
+        candidates = [w for w in self.workers if w.conversation is None and not w.draining and usable(w)]
+        if not candidates:
+            return None
+        return min(candidates, key = lambda w: (w.settings != settings, w.outstanding))
+    
+    
+    def __release(self, worker):
+        with self._cond:
+            worker.outstanding -= 1
+            self._cond.notify_all()
+        if worker.draining:
+            self.__try_recycle(worker)
+    
+    
+    def __count(self, name):
+        with self._cond:
+            self.stats[name] += 1
+    
+    
+    def __check_recycle(self, worker):
+        if self.recycle is None or worker.draining:
+            return
+        reason = self.recycle.reason(worker.genie)
+        if reason is None:
+            return
+        with self._cond:
+            if worker.draining:
+                return
+            worker.draining = True
+        self.logger.info("recycling worker {} after it {}".format(self.workers.index(worker), reason))
+        self.__try_recycle(worker)
+    
+    
+    def __try_recycle(self, worker):
+        # claim the idle worker by counting the restart as an outstanding query
+        with self._cond:
+            if not worker.draining or worker.outstanding or worker.conversation is not None:
+                return
+            worker.outstanding += 1
+        threading.Thread(target = self.__recycle, args = (worker,), daemon = True).start()
+    
+    
+    def __recycle(self, worker):
+        try:
+            worker.genie._restart_contextual_genie()
+        except Exception:
+            self.logger.exception("recycling worker {} failed".format(self.workers.index(worker)))
+        else:
+            self.recycles += 1
+        finally:
+            with self._cond:
+                worker.draining = False
+                worker.outstanding -= 1
+                self._cond.notify_all()
@@ -0,0 +1,344 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import http.client
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+
+
+def free_port() -> int:
+    """A TCP port on 127.0.0.1 that is currently free, for servers whose port must be known before they start."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def probe(port : int, timeout = 1) -> bool:
+    """Whether a server answers `GET /` on 127.0.0.1:`port` within `timeout` seconds."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout = timeout)
+    try:
+        connection.request("GET", "/")
+        connection.getresponse().read()
+        return True
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        connection.close()
+
+
+def pid_alive(pid : int) -> bool:
+    """Whether a process with this pid exists on the host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class GenieProcess:
+    """A spawned genie-toolkit process whose stdout is drained in the background."""
+    def __init__(self,
+                 command,
+                 cwd = None,
+                 name = None,
+                 max_log_lines = 1000,
+                 forward_logs = False,
+                 logger = None,
+                 log_path = None):
+        """
+        Start `command` and a daemon thread that keeps reading its stdout, so the child never blocks
+        on a full pipe no matter how much it logs.
+        
+        ### Args:
+        
+        `command` ([str]): command to run.
+        
+        `cwd` (str, optional): working directory of the command. Defaults to None.
+        
+        `name` (str, optional): name used in forwarded log lines. Defaults to the command's third word (e.g. `contextual-genie`).
+        
+        `max_log_lines` (int, optional): number of most recent stdout lines kept in `logs()`. Defaults to 1000.
+        
+        `forward_logs` (bool, optional): also forward every stdout line to Python logging at INFO level. Defaults to False.
+        
+        `logger` (`logging.Logger`, optional): logger used when `forward_logs` is True. Defaults to this module's logger.
+        
+        `log_path` (str, optional): write stdout to this file, which is followed instead of a pipe, and start the command in its own session,
+        so it keeps running when this Python process exits (e.g. for servers shared with other processes). Output of earlier processes
+        in the file is trimmed to its last `max_log_lines` lines first. Defaults to None.
+        """
+        self.command = command
+        self.cwd = cwd
+        self.name = name or (command[2] if len(command) > 2 else command[0])
+        self.max_log_lines = max_log_lines
+        self.log_path = log_path
+        self.forward_logs = forward_logs
+        self.logger = logger or logging.getLogger(__name__)
+        self.port = None
+        self.last_sample = None
+        self._lines = collections.deque(maxlen = max_log_lines)
+        self._port_event = threading.Event()
+        self._eof = threading.Event()
+        
+        if log_path is None:
+            self.process = subprocess.Popen(command, cwd = cwd, stdout = subprocess.PIPE)
+            lines = iter(self.process.stdout.readline, b"")
+        else:
+            _trim_log(log_path, max_log_lines)
+            with open(log_path, "ab") as log:
+                offset = log.tell()
+                self.process = subprocess.Popen(command, cwd = cwd, stdout = log, stderr = subprocess.STDOUT, start_new_session = True)
+            lines = self.__follow(log_path, offset)
+        self._drainer = threading.Thread(target = self.__drain, args = (lines,), name = "drain-{}".format(self.name), daemon = True)
+        self._drainer.start()
+    
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+    
+    def respawn(self, command = None):
+        """Start a new process with the same command (or `command`) and options. This process is left untouched."""
+        return GenieProcess(command or self.command,
+                            cwd = self.cwd,
+                            name = self.name,
+                            max_log_lines = self.max_log_lines,
+                            forward_logs = self.forward_logs,
+                            logger = self.logger,
+                            log_path = self.log_path)
+    
+    def wait_for_port(self, timeout = None) -> int:
+        """
+        Wait until the process prints its port number and return it.
+        
+        ### Raises:
+        
+        `RuntimeError`: in case the process exits, or `timeout` seconds pass, before a port is printed.
+        The message includes the most recent log lines.
+        """
+        self._port_event.wait(timeout)
+        if self.port is None:
+            reason = "exited with code {}".format(self.process.poll()) if self._eof.is_set() else "did not print a port within {} seconds".format(timeout)
+            raise RuntimeError("{} {}, last output:\n{}".format(self.name, reason, "\n".join(self.logs())))
+        return self.port
+    
+    def wait_ready(self, timeout = None, port = None, interval = 0.1) -> int:
+        """
+        Wait until the process answers HTTP requests and return its port.
+        
+        The port is the one printed by the process, unless `port` is given. The process is ready as soon as
+        `GET /` on that port gets any HTTP response.
+        
+        ### Raises:
+        
+        `RuntimeError`: in case the process exits, or `timeout` seconds pass, before it is ready.
+        The message includes the most recent log lines.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if port is None:
+            port = self.wait_for_port(timeout)
+        
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError("{} exited with code {} before it was ready, last output:\n{}".format(
+                    self.name, self.process.poll(), "\n".join(self.logs())))
+            if self.probe(port):
+                self.port = port
+                return port
+            if deadline is not None and time.monotonic() >= deadline:
+                raise RuntimeError("{} was not ready within {} seconds, last output:\n{}".format(
+                    self.name, timeout, "\n".join(self.logs())))
+            time.sleep(interval)
+    
+    def logs(self):
+        """The most recent stdout lines, oldest first."""
+        return list(self._lines)
+    
+    def poll(self):
+        return self.process.poll()
+    
+    def wait(self, timeout = None):
+        return self.process.wait(timeout)
+    
+    def terminate(self, timeout = 10):
+        """Terminate the process, killing it if it does not exit within `timeout` seconds."""
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+    
+    def sample(self):
+        """
+        Sample the resource usage of the process and its descendants (e.g. a genienlp server started by it).
+        
+        Return `None` once the process exited, otherwise:
+        
+        ```
+        {
+            'pid': pid of the process (int),
+            'rss': resident memory in bytes (int),
+            'cpu_time': user and system CPU seconds used so far (float),
+            'cpu_percent': CPU used since the previous sample, in percent of one core, None for the first sample (float),
+            'time': `time.monotonic()` of the sample (float)
+        }
+        ```
+        
+        Uses `psutil` if it is installed, and `/proc` otherwise.
+        """
+        if self.process.poll() is not None:
+            return None
+        now = time.monotonic()
+        try:
+            cpu_time, rss = _tree_usage(self.process.pid)
+        except (OSError, ValueError):
+            # the process exited while being sampled
+            return None
+        cpu_percent = None
+        if self.last_sample is not None and now > self.last_sample["time"]:
+            cpu_percent = 100 * (cpu_time - self.last_sample["cpu_time"]) / (now - self.last_sample["time"])
+        self.last_sample = {"pid": self.process.pid, "rss": rss, "cpu_time": cpu_time, "cpu_percent": cpu_percent, "time": now}
+        return self.last_sample
+    
+    def probe(self, port = None, timeout = 1) -> bool:
+        """Whether the process answers `GET /` on `port` (defaults to its own port) within `timeout` seconds."""
+        port = port or self.port
+        if port is None:
+            return False
+        return probe(port, timeout)
+    
+    def __follow(self, path, offset):
+        # lines appended to `path` by the process, until it exits
+        with open(path, "rb") as fd:
+            fd.seek(offset)
+            while True:
+                raw = fd.readline()
+                if raw.endswith(b"\n"):
+                    yield raw
+                elif self.process.poll() is not None:
+                    if raw:
+                        yield raw
+                    return
+                else:
+                    fd.seek(-len(raw), 1)
+                    time.sleep(0.05)
+    
+    def __drain(self, lines):
+        for raw in lines:
+            line = raw.decode(errors = "replace").rstrip()
+            self._lines.append(line)
+            if self.port is None and "Server port number at" in line:
+                self.port = int(line.split(',')[-1].strip())
+                self._port_event.set()
+            if self.forward_logs:
+                self.logger.info("[%s] %s", self.name, line)
+        if self.process.stdout is not None:
+            self.process.stdout.close()
+        self._eof.set()
+        self._port_event.set()
+
+
+def _trim_log(path, max_lines):
+    """Keep only the last `max_lines` lines of the log file at `path`, if it exists."""
+    try:
+        with open(path, "rb") as fd:
+            lines = collections.deque(fd, maxlen = max_lines + 1)
+    except FileNotFoundError:
+        return
+    if len(lines) <= max_lines:
+        return
+    lines.popleft()
+    tmp = "{}.tmp-{}".format(path, os.getpid())
+    with open(tmp, "wb") as fd:
+        fd.writelines(lines)
+    os.replace(tmp, path)
+
+
+def _tree_usage(pid):
+    """CPU seconds and resident bytes of `pid` and its descendants."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            cpu_time = rss = 0
+            for process in [root] + root.children(recursive = True):
+                times = process.cpu_times()
+                cpu_time += times.user + times.system
+                rss += process.memory_info().rss
+            return cpu_time, rss
+        except psutil.Error as e:
+            raise OSError(str(e))
+    
+    cpu_time = rss = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            process_cpu, process_rss = _proc_usage(current)
+        except (OSError, ValueError):
+            if current == pid:
+                raise
+            # a descendant that exited in the meantime
+            continue
+        cpu_time += process_cpu
+        rss += process_rss
+        pending += _proc_children(current)
+    return cpu_time, rss
+
+
+def _proc_usage(pid):
+    with open("/proc/{}/stat".format(pid)) as fd:
+        # the command name may contain spaces, fields are counted from the closing parenthesis
+        fields = fd.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    with open("/proc/{}/statm".format(pid)) as fd:
+        pages = int(fd.read().split()[1])
+    return (int(fields[11]) + int(fields[12])) / ticks, pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _proc_children(pid):
+    children = []
+    try:
+        for tid in os.listdir("/proc/{}/task".format(pid)):
+            with open("/proc/{}/task/{}/children".format(pid, tid)) as fd:
+                children += [int(child) for child in fd.read().split()]
+    except OSError:
+        pass
+    return children
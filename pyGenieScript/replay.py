@@ -0,0 +1,244 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Replay logged dialogues through Genie in bulk.
+
+Input is JSONL with one dialogue per line, either a list of turns or `{"id": ..., "turns": [...]}`.
+A turn is an utterance or a dict of `Genie.query` keyword arguments (`{"query": ..., "num_results": ...}`).
+
+Turns of a dialogue run in order on one contextual-genie backend, and dialogues run in parallel across backends.
+Each finished dialogue is appended to the output JSONL as `{"line": ..., "id": ..., "turns": [{"query": ..., "response": ...}]}`
+(or with an `"error"`), so results stream out in completion order. A blank input line is recorded as an empty dialogue,
+and a line that is not valid JSON as `{"line": ..., "invalid": ...}`. The output doubles as the checkpoint: replaying into
+an existing output skips the dialogues it already holds, except by default those that failed, which are recorded again.
+
+Input is read lazily with a bounded number of dialogues in flight, so memory use does not grow with the input.
+
+Run `python -m pyGenieScript.replay --help` (or `genie-replay --help`) for the command line.
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pyGenieScript.pool import GeniePool
+from pyGenieScript.result import QueryResult
+
+logger = logging.getLogger(__name__)
+
+
+class _Progress:
+    """Line numbers already in an output file, kept as a watermark plus the few finished out of order past it."""
+    def __init__(self):
+        self.watermark = -1
+        self.ahead = set()
+    
+    def add(self, line):
+        self.ahead.add(line)
+        while self.watermark + 1 in self.ahead:
+            self.watermark += 1
+            self.ahead.remove(self.watermark)
+    
+    def __contains__(self, line):
+        return line <= self.watermark or line in self.ahead
+
+
+def _load_progress(output_path, retry_failed = True):
+    progress = _Progress()
+    if not os.path.exists(output_path):
+        return progress
+    
+    with open(output_path, "rb+") as fd:
+        valid_end = 0
+        for raw in iter(fd.readline, b""):
+            if not raw.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(raw)
+                # a dialogue that failed, e.g. while a backend was down, is replayed again
+                if not (retry_failed and "error" in record):
+                    progress.add(record["line"])
+            except (ValueError, KeyError):
+                break
+            valid_end = fd.tell()
+        # drop a record cut short by an interrupted run
+        fd.truncate(valid_end)
+    return progress
+
+
+def _turns(dialogue):
+    turns = dialogue["turns"] if isinstance(dialogue, dict) else dialogue
+    return [{"query": turn} if isinstance(turn, str) else dict(turn) for turn in turns]
+
+
+def replay(input_path : str,
+           output_path : str,
+           pool : GeniePool,
+           max_in_flight = None,
+           resume = True,
+           retry_failed = True,
+           **query_kwargs) -> dict:
+    """
+    ### Description:
+    
+    Replay every dialogue of `input_path` through `pool` into `output_path`, see the module documentation for the formats.
+    
+    ### Args:
+    
+    `input_path` (str): JSONL file of dialogues.
+    
+    `output_path` (str): JSONL file the results are appended to.
+    
+    `pool` (`GeniePool`): backends to replay on. Each dialogue holds one worker for its duration.
+    
+    `max_in_flight` (int, optional): maximum number of dialogues read but not yet written. Defaults to twice the number of workers.
+    
+    `resume` (bool, optional): skip dialogues already in `output_path`. If False, `output_path` is overwritten. Defaults to True.
+    
+    `retry_failed` (bool, optional): when resuming, replay again the dialogues recorded with an `"error"`; their new record is appended
+    after the old one. Lines that are not valid JSON are never retried. Defaults to True.
+    
+    `query_kwargs`: default `Genie.query` keyword arguments of every turn, e.g. `num_results`.
+    
+    ### Returns:
+    
+    (dict): counts of `replayed`, `skipped` and `failed` dialogues.
+    """
+    max_in_flight = max_in_flight or 2 * len(pool.workers)
+    if resume:
+        progress = _load_progress(output_path, retry_failed)
+    else:
+        progress = _Progress()
+        open(output_path, "w").close()
+    
+    stats = {"replayed": 0, "skipped": 0, "failed": 0}
+    slots = threading.BoundedSemaphore(max_in_flight)
+    write_lock = threading.Lock()
+    
+    def run(line, dialogue, out):
+        record = {"line": line, "id": dialogue.get("id") if isinstance(dialogue, dict) else None}
+        conversation_id = ("replay", line)
+        try:
+            results = []
+            for turn in _turns(dialogue):
+                kwargs = dict(query_kwargs)
+                kwargs.update(turn)
+                response = pool.query(conversation_id = conversation_id, **kwargs)
+                if isinstance(response, QueryResult):
+                    response = response.to_dict()
+                results.append({"query": turn["query"], "response": response})
+            record["turns"] = results
+        except Exception as e:
+            logger.warning("dialogue on line %d failed: %s", line, e)
+            record["error"] = repr(e)
+        finally:
+            try:
+                pool.end_conversation(conversation_id)
+            except Exception as e:
+                logger.warning("could not end dialogue on line %d: %s", line, e)
+        
+        write(record, out)
+    
+    def write(record, out):
+        with write_lock:
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            stats["failed" if "error" in record or "invalid" in record else "replayed"] += 1
+    
+    errors = []
+    
+    def done(future):
+        slots.release()
+        if future.exception() is not None:
+            errors.append(future.exception())
+    
+    with open(input_path, "r") as inp, open(output_path, "a") as out, \
+         ThreadPoolExecutor(max_workers = len(pool.workers)) as executor:
+        for line, raw in enumerate(inp):
+            if line in progress:
+                stats["skipped"] += 1
+                continue
+            if errors:
+                break
+            if not raw.strip():
+                # a blank line is an empty dialogue, recorded so that resuming can move past it
+                write({"line": line, "id": None, "turns": []}, out)
+                continue
+            try:
+                dialogue = json.loads(raw)
+            except ValueError as e:
+                logger.warning("line %d is not valid JSON: %s", line, e)
+                write({"line": line, "id": None, "invalid": repr(e)}, out)
+                continue
+            slots.acquire()
+            executor.submit(run, line, dialogue, out).add_done_callback(done)
+    
+    # e.g. the output could not be written
+    if errors:
+        raise errors[0]
+    return stats
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help = "JSONL file of dialogues")
+    parser.add_argument("output", help = "JSONL file the results are appended to")
+    parser.add_argument("--url", action = "append", default = [], help = "address of a running contextual-genie server, repeatable")
+    parser.add_argument("--workers", type = int, default = None, help = "number of contextual-genie servers to start when no --url is given")
+    parser.add_argument("--nlu-server", default = "localhost", help = "see Genie.initialize (default: localhost)")
+    parser.add_argument("--thingpedia-dir", default = "None", help = "see Genie.initialize")
+    parser.add_argument("--max-in-flight", type = int, default = None)
+    parser.add_argument("--num-results", type = int, default = 1)
+    parser.add_argument("--no-resume", action = "store_true", help = "overwrite the output instead of resuming")
+    parser.add_argument("--no-retry-failed", action = "store_true", help = "when resuming, skip dialogues that failed")
+    args = parser.parse_args(argv)
+    
+    if args.url:
+        pool = GeniePool(urls = args.url)
+    else:
+        pool = GeniePool(num_workers = args.workers)
+        pool.initialize(args.nlu_server, args.thingpedia_dir)
+    try:
+        stats = replay(args.input, args.output, pool,
+                       max_in_flight = args.max_in_flight,
+                       resume = not args.no_resume,
+                       retry_failed = not args.no_retry_failed,
+                       num_results = args.num_results)
+    finally:
+        if not args.url:
+            pool.quit()
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import threading
+import time
+
+
+class ResourceMonitor:
+    """
+    ### Description:
+    
+    Periodically sample the CPU and memory used by the processes of one or more `Genie` instances,
+    see `Genie.resource_usage`.
+    
+    ```
+    monitor = ResourceMonitor([worker.genie for worker in pool.workers], interval = 5).start()
+    ...
+    print(monitor.latest(pool.workers[0].genie)["contextual-genie"]["rss"])
+    ```
+    
+    ### Args:
+    
+    `genies` (`Genie` or [`Genie`]): instances to sample.
+    
+    `interval` (float, optional): seconds between two samples. Defaults to 5.0.
+    
+    `window` (int, optional): number of samples kept per instance in `history`. Defaults to 120.
+    """
+    def __init__(self, genies, interval = 5.0, window = 120):
+        self.genies = list(genies) if isinstance(genies, (list, tuple)) else [genies]
+        self.interval = interval
+        self.history = {id(genie): collections.deque(maxlen = window) for genie in self.genies}
+        self._stopping = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Start sampling in a daemon thread and return this monitor."""
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target = self.__run, name = "genie-resources", daemon = True)
+            self._thread.start()
+        return self
+    
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+    
+    def sample(self):
+        """Sample every instance now, return the samples in the order of `genies`."""
+        samples = []
+        for genie in self.genies:
+            usage = genie.resource_usage()
+            self.history[id(genie)].append(usage)
+            samples.append(usage)
+        return samples
+    
+    def latest(self, genie):
+        """The most recent sample of `genie`, None before the first one."""
+        history = self.history[id(genie)]
+        return history[-1] if history else None
+    
+    def __run(self):
+        while not self._stopping.is_set():
+            self.sample()
+            self._stopping.wait(self.interval)
+
+
+class RecyclePolicy:
+    """
+    ### Description:
+    
+    When a contextual-genie process should be replaced by a fresh one, see `GeniePool`.
+    
+    The resident memory counts the process and its descendants, e.g. a genienlp server it started for a local model.
+    
+    ### Args:
+    
+    `max_rss` (int, optional): recycle once the process uses more than this many resident bytes. Defaults to None (no limit).
+    
+    `max_queries` (int, optional): recycle once the process answered this many queries. Defaults to None (no limit).
+    
+    `sample_interval` (float, optional): seconds a memory sample is reused before sampling again. Defaults to 5.0.
+    """
+    def __init__(self, max_rss = None, max_queries = None, sample_interval = 5.0):
+        self.max_rss = max_rss
+        self.max_queries = max_queries
+        self.sample_interval = sample_interval
+    
+    def reason(self, genie):
+        """Why `genie` should be recycled, None if it should not or cannot be (it was not started by `initialize`)."""
+        process = genie.process
+        if process is None:
+            return None
+        if self.max_queries is not None and genie.queries_served >= self.max_queries:
+            return "answered {} queries".format(genie.queries_served)
+        if self.max_rss is not None:
+            sample = process.last_sample
+            if sample is None or time.monotonic() - sample["time"] >= self.sample_interval:
+                sample = process.sample()
+            if sample is not None and sample["rss"] > self.max_rss:
+                return "uses {} MiB of memory".format(sample["rss"] // 2 ** 20)
+        return None
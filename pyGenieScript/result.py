@@ -0,0 +1,130 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import functools
+import json
+
+
+def loads(data):
+    """Decode the JSON document `data` (bytes or str), with `orjson` when it is installed."""
+    return _decoder()(data)
+
+
+@functools.lru_cache(maxsize = None)
+def _decoder():
+    # imported on first use rather than with the package, since importing orjson takes a few milliseconds
+    try:
+        import orjson
+    except ImportError:
+        return json.loads
+    return orjson.loads
+
+
+class QueryResult:
+    """
+    ### Description:
+    
+    A `Genie.query` response decoded on first access, returned when `query` is called with `fields`.
+    
+    Only the requested `fields` are kept once decoded, and the raw response is dropped then, so results of
+    `num_results=10` queries whose `results` are not needed take little memory. Fields are read as attributes
+    (`res.user_target`) or, like the dict returned otherwise, as items (`res["user_target"]`).
+    
+    JSON cannot be decoded one field at a time, so the first access decodes the whole response once,
+    with `orjson` when it is installed.
+    
+    ### Args:
+    
+    `raw` (bytes or str): the JSON response.
+    
+    `fields` ([str], optional): fields to keep, among `QueryResult.FIELDS`. Defaults to None (all of them).
+    
+    ### Raises:
+    
+    `ValueError`: in case a field is unknown.
+    """
+    FIELDS = ("response", "results", "user_target", "ds", "aux", "delta_verbal", "full_verbal")
+    __slots__ = ("_raw", "_fields") + FIELDS
+    
+    def __init__(self, raw, fields = None):
+        fields = QueryResult.FIELDS if fields is None else tuple(fields)
+        unknown = [f for f in fields if f not in QueryResult.FIELDS]
+        if unknown:
+            raise ValueError("QueryResult: unknown fields {}, choose among {}".format(unknown, QueryResult.FIELDS))
+        self._raw = raw
+        self._fields = fields
+    
+    @classmethod
+    def from_dict(cls, value : dict, fields = None):
+        """A result holding the already decoded `value`."""
+        result = cls(None, fields)
+        result.__fill(value)
+        return result
+    
+    @property
+    def fields(self):
+        return self._fields
+    
+    def __getattr__(self, name):
+        # only called for slots not set yet
+        if name not in QueryResult.FIELDS:
+            raise AttributeError(name)
+        if name not in self._fields:
+            raise AttributeError("QueryResult: field '{}' was not requested, see `fields`".format(name))
+        self.__fill(loads(self._raw))
+        return object.__getattribute__(self, name)
+    
+    def __getitem__(self, name):
+        if name not in QueryResult.FIELDS:
+            raise KeyError(name)
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+    
+    def __contains__(self, name):
+        return name in self._fields
+    
+    def get(self, name, default = None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+    
+    def to_dict(self) -> dict:
+        """The requested fields as a dict, in the format `query` returns without `fields`."""
+        return {f: getattr(self, f) for f in self._fields}
+    
+    def __repr__(self):
+        return "QueryResult({})".format(self.to_dict())
+    
+    def __fill(self, value):
+        for f in self._fields:
+            setattr(self, f, value.get(f))
+        self._raw = None
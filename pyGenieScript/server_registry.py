@@ -0,0 +1,171 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+A host-local registry of running contextual-genie servers, so processes that would start identical servers
+(same NLU server and manifest) share one instead, see `Genie.initialize(share = True)`.
+
+Each server is recorded in `<cache_dir>/servers/<host>/<key>.json` with its port, pid and the pids of the
+processes using it. Entries are only used after a health check, users that died are dropped, and the last
+user shuts the server down. A server whose users all died without releasing it is shut down by the next
+`attach` or `release` on the host. Each entry is updated under its own file lock.
+"""
+
+import hashlib
+import json
+import os
+import signal
+import socket
+
+from pyGenieScript import manifest_store
+from pyGenieScript.locks import file_lock
+from pyGenieScript.process import pid_alive, probe
+
+
+def registry_dir(cache_dir = None) -> str:
+    """Directory of the entries of this host, under `cache_dir` (defaults to `manifest_store.default_cache_dir()`)."""
+    return os.path.join(cache_dir or manifest_store.default_cache_dir(), "servers", socket.gethostname())
+
+
+def server_key(nlu_server : str, manifest_dir : str) -> str:
+    """Key of the servers started for an NLU server address and a manifest directory."""
+    manifest_dir = os.path.realpath(manifest_dir)
+    return hashlib.sha256(json.dumps([nlu_server, manifest_dir]).encode()).hexdigest()[:16]
+
+
+def attach(key : str, start, cache_dir = None, probe_timeout = 5):
+    """
+    ### Description:
+    
+    Register this process as a user of the healthy server recorded under `key`, or start one with `start()`,
+    which must return its `(port, pid)` once it is ready.
+    
+    Processes attaching to the same `key` at once wait for each other, so a single server is started.
+    
+    ### Returns:
+    
+    (int, bool): port of the server, and whether it was started by this call.
+    """
+    _reap(cache_dir, key)
+    path = os.path.join(registry_dir(cache_dir), key + ".json")
+    with file_lock(path + ".lock"):
+        entry = _read(path)
+        if entry is not None and pid_alive(entry["pid"]) and probe(entry["port"], probe_timeout):
+            entry["users"] = [pid for pid in entry["users"] if pid_alive(pid)] + [os.getpid()]
+            _write(path, entry)
+            return entry["port"], False
+        
+        port, pid = start()
+        _write(path, {"port": port, "pid": pid, "users": [os.getpid()]})
+        return port, True
+
+
+def update(key : str, port : int, pid : int, cache_dir = None):
+    """Record that the server under `key` was replaced by the one with `port` and `pid`, e.g. after a restart."""
+    path = os.path.join(registry_dir(cache_dir), key + ".json")
+    with file_lock(path + ".lock"):
+        entry = _read(path) or {"users": [os.getpid()]}
+        entry["port"], entry["pid"] = port, pid
+        _write(path, entry)
+
+
+def lookup(key : str, cache_dir = None, probe_timeout = 5):
+    """Port of the healthy server recorded under `key`, None if there is none."""
+    entry = _read(os.path.join(registry_dir(cache_dir), key + ".json"))
+    if entry is None or not pid_alive(entry["pid"]) or not probe(entry["port"], probe_timeout):
+        return None
+    return entry["port"]
+
+
+def release(key : str, cache_dir = None) -> bool:
+    """Unregister one use of the server under `key` by this process, return whether no user is left, so it should be shut down."""
+    _reap(cache_dir, key)
+    path = os.path.join(registry_dir(cache_dir), key + ".json")
+    with file_lock(path + ".lock"):
+        entry = _read(path)
+        if entry is None:
+            return True
+        users = [pid for pid in entry["users"] if pid_alive(pid)]
+        if os.getpid() in users:
+            users.remove(os.getpid())
+        if users:
+            entry["users"] = users
+            _write(path, entry)
+            return False
+        os.remove(path)
+        return True
+
+
+def servers(cache_dir = None) -> dict:
+    """The entries of this host, as `{key: {"port", "pid", "users"}}`."""
+    directory = registry_dir(cache_dir)
+    if not os.path.isdir(directory):
+        return {}
+    entries = {}
+    for name in os.listdir(directory):
+        if name.endswith(".json"):
+            entry = _read(os.path.join(directory, name))
+            if entry is not None:
+                entries[name[:-len(".json")]] = entry
+    return entries
+
+
+def _reap(cache_dir, skip, probe_timeout = 1):
+    # servers of other keys whose users all died without releasing them would otherwise run forever
+    for key, entry in servers(cache_dir).items():
+        if key == skip or any(pid_alive(pid) for pid in entry.get("users", [])):
+            continue
+        path = os.path.join(registry_dir(cache_dir), key + ".json")
+        with file_lock(path + ".lock"):
+            entry = _read(path)
+            if entry is None or any(pid_alive(pid) for pid in entry["users"]):
+                continue
+            # the pid may have been reused by an unrelated process since the server died,
+            # so it is only signalled if the server still answers on its port
+            if pid_alive(entry["pid"]) and probe(entry["port"], probe_timeout):
+                try:
+                    os.kill(entry["pid"], signal.SIGTERM)
+                except OSError:
+                    pass
+            os.remove(path)
+
+
+def _read(path):
+    try:
+        with open(path, "r") as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, entry):
+    tmp = "{}.tmp-{}".format(path, os.getpid())
+    with open(tmp, "w") as fd:
+        json.dump(entry, fd)
+    os.replace(tmp, path)
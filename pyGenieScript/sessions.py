@@ -0,0 +1,178 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import collections
+import threading
+
+from pyGenieScript.geniescript import Genie
+
+
+class _Backend:
+    def __init__(self, genie : Genie):
+        self.genie = genie
+        self.lock = threading.Lock()
+        # session whose latest dialogue state is the backend's current state,
+        # as long as the backend's `Genie.generation` is still the one recorded with it
+        self.owner = None
+        self.generation = None
+
+
+class _Session:
+    __slots__ = ("id", "ds", "aux", "backend")
+    
+    def __init__(self, session_id):
+        self.id = session_id
+        self.ds = None
+        self.aux = []
+        self.backend = None
+    
+    def size(self):
+        return len(self.ds or "") + sum(len(str(a)) for a in self.aux)
+
+
+class SessionManager:
+    """Conversations addressed by compact session handles, sending the full dialogue state only when a backend lost it."""
+    def __init__(self, genies, max_sessions = 10000, max_state_bytes = None):
+        """
+        Track the dialogue state of each conversation on the client.
+        
+        A contextual-genie backend keeps the state of the last turn it ran. While that turn belongs to the
+        conversation being continued, only the new utterance is sent (`Genie.query(use_existing_ds = True)`);
+        otherwise the conversation's full `dialog_state` and `aux` are sent with `queryContext`.
+        Each backend runs one turn at a time, and a conversation returns to its last backend when that is free.
+        
+        ### Args:
+        
+        `genies` (`Genie` or [`Genie`]): initialized backends.
+        
+        `max_sessions` (int, optional): maximum number of conversations kept; the least recently used are forgotten first. Defaults to 10000.
+        
+        `max_state_bytes` (int, optional): maximum total size of the kept dialogue states, also enforced by forgetting the least recently used. Defaults to None (no limit).
+        """
+        if isinstance(genies, Genie):
+            genies = [genies]
+        self.backends = [_Backend(genie) for genie in genies]
+        self.max_sessions = max_sessions
+        self.max_state_bytes = max_state_bytes
+        self.stats = collections.Counter()
+        self._sessions = collections.OrderedDict()
+        self._state_bytes = 0
+        self._lock = threading.Lock()
+    
+    def query(self, session_id, query : str, dialog_state = None, aux = None, **kwargs):
+        """
+        ### Description:
+        
+        Run one turn of conversation `session_id`, see `Genie.query` for `kwargs` and the returned JSON object.
+        
+        A conversation that is unknown (new, ended or forgotten) starts from `dialog_state`/`aux` if given,
+        or from an empty state otherwise. Passing `dialog_state` for a known conversation replaces its state.
+        
+        When `fields` is passed, "ds" and "aux" are always added to it, since they are kept as the state of the conversation.
+        """
+        if kwargs.get("fields") is not None:
+            kwargs["fields"] = tuple(kwargs["fields"]) + tuple(name for name in ("ds", "aux") if name not in kwargs["fields"])
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                session = _Session(session_id)
+            else:
+                self._state_bytes -= session.size()
+            if dialog_state is not None:
+                session.ds = dialog_state
+                session.aux = aux or []
+            # reserve the session while its turn runs so concurrent eviction cannot drop it
+            self._sessions[session_id] = session
+            self._state_bytes += session.size()
+        
+        backend = self.__acquire(session)
+        try:
+            genie = backend.genie
+            # a restarted, recycled or cleaned backend lost the state it held
+            holds_state = backend.owner is session and backend.generation == genie.generation
+            if holds_state and dialog_state is None:
+                self.stats["handle"] += 1
+                generation = genie.generation
+                res = genie.query(query, use_existing_ds = True, **kwargs)
+            elif session.ds is None:
+                # a new conversation starts from an empty state
+                self.stats["new"] += 1
+                backend.owner = None
+                genie.clean(clear_cache = False)
+                generation = genie.generation
+                res = genie.query(query, use_existing_ds = True, **kwargs)
+            else:
+                self.stats["full_state"] += 1
+                generation = genie.generation
+                res = genie.query(query, dialog_state = session.ds, aux = session.aux, **kwargs)
+            backend.owner = session
+            backend.generation = generation
+        except Exception:
+            backend.owner = None
+            raise
+        finally:
+            backend.lock.release()
+        
+        with self._lock:
+            if self._sessions.get(session_id) is session:
+                self._state_bytes -= session.size()
+                session.ds = res.get("ds", session.ds)
+                session.aux = res.get("aux", session.aux)
+                session.backend = backend
+                self._state_bytes += session.size()
+                self.__evict()
+        return res
+    
+    def end(self, session_id):
+        """Forget conversation `session_id`."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._state_bytes -= session.size()
+    
+    def __len__(self):
+        return len(self._sessions)
+    
+    def __acquire(self, session):
+        # prefer the backend that still holds the conversation's state, then any free backend
+        preferred = session.backend
+        if preferred is not None and preferred.lock.acquire(blocking = False):
+            return preferred
+        for backend in sorted(self.backends, key = lambda b: b.owner is not None):
+            if backend.lock.acquire(blocking = False):
+                return backend
+        backend = preferred or self.backends[hash(session.id) % len(self.backends)]
+        backend.lock.acquire()
+        return backend
+    
+    def __evict(self):
+        while len(self._sessions) > self.max_sessions or (self.max_state_bytes is not None and self._state_bytes > self.max_state_bytes and len(self._sessions) > 1):
+            _, session = self._sessions.popitem(last = False)
+            self._state_bytes -= session.size()
+            self.stats["evicted"] += 1
@@ -0,0 +1,142 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.pool import GeniePool
+from pyGenieScript.process import free_port
+
+
+class GenieStack:
+    """An NLU server and the contextual-genie workers using it, all started by `start_stack`."""
+    def __init__(self, nlu : Genie, genies):
+        self.nlu = nlu
+        self.genies = genies
+    
+    @property
+    def nlu_url(self) -> str:
+        return "http://127.0.0.1:{}".format(self.nlu.nlu_process.port)
+    
+    def pool(self, **kwargs) -> GeniePool:
+        """A `GeniePool` routing queries across the workers of this stack. `kwargs` are passed to `GeniePool`."""
+        return GeniePool(genies = self.genies, **kwargs)
+    
+    def shutdown(self):
+        """Shut down every worker, then the NLU server."""
+        for genie in self.genies:
+            if genie.process is not None:
+                genie.process.terminate()
+        if self.nlu.nlu_process is not None:
+            self.nlu.nlu_process.terminate()
+
+
+def start_stack(model_dir : str,
+                thingpedia_dir : str = 'None',
+                num_workers = 1,
+                log_file_name : str = 'log.log',
+                check_genie_version = True,
+                force_update_model = False,
+                force_update_manifest = False,
+                startup_timeout = 300,
+                **kwargs) -> GenieStack:
+    """
+    ### Description:
+    
+    Start an NLU server and `num_workers` contextual-genie workers at the same time, and wait until all of them
+    answer HTTP requests, so the whole stack is up in about the start-up time of its slowest process.
+    
+    The NLU server gets a free port chosen up front, which is passed to the workers and registered for "localhost".
+    
+    ### Args:
+    
+    `model_dir` (str): path to nlu files or online models, see `Genie.nlu_server`.
+    
+    `thingpedia_dir` (str, optional): path to thingpedia directory, see `Genie.initialize`. Defaults to 'None'.
+    
+    `num_workers` (int, optional): number of contextual-genie workers. Defaults to 1.
+    
+    `log_file_name` (str, optional): log of genie under `~/.cache/genie-toolkit/`, suffixed with `-i` for worker `i`. Defaults to 'log.log'.
+    
+    `check_genie_version` (bool, optional): see `Genie`. Default to True.
+    
+    `force_update_model` (bool, optional): force to update the model (if download from huggingface). Defaults to False.
+    
+    `force_update_manifest` (bool, optional): force to update the manifest (if downloaded from git). Defaults to False.
+    
+    `startup_timeout` (float, optional): seconds to wait for every process to be ready. None waits forever. Defaults to 300.
+    
+    `kwargs`: passed to every worker's `Genie`, e.g. `pool_size` or `timeout`.
+    
+    ### Raises:
+    
+    `RuntimeError`: as soon as any process exits or is not ready in time. Every process of the stack is shut down
+    and the message includes the failing process's last output.
+    
+    Any error while creating or starting a worker also shuts down the processes started so far before it is raised.
+    
+    ### Returns:
+    
+    (`GenieStack`): the ready NLU server and workers.
+    """
+    nlu = Genie(check_genie_version = check_genie_version)
+    actual_model_dir = nlu.download_or_find_model(model_dir, force_update = force_update_model)
+    if (not actual_model_dir.startswith("file://")):
+        actual_model_dir = "file://" + actual_model_dir
+    actual_manifest = nlu.download_or_find_manifests(thingpedia_dir, force_update = force_update_manifest)
+    
+    port = free_port()
+    nlu._start_nlu_server(actual_model_dir, actual_manifest, port = port)
+    
+    root, ext = os.path.splitext(log_file_name)
+    genies = []
+    stack = GenieStack(nlu, genies)
+    try:
+        for i in range(num_workers):
+            genie = Genie(check_genie_version = False, **kwargs)
+            genies.append(genie)
+            genie._start_contextual_genie("http://127.0.0.1:{}".format(port), actual_manifest, "{}-{}{}".format(root, i, ext))
+    except Exception:
+        # the NLU server and the workers started so far would otherwise outlive the failed call
+        stack.shutdown()
+        raise
+    
+    with ThreadPoolExecutor(max_workers = num_workers + 1) as executor:
+        futures = [executor.submit(nlu._wait_nlu_server, startup_timeout)]
+        futures += [executor.submit(genie._wait_contextual_genie, startup_timeout) for genie in genies]
+        done, _ = wait(futures, return_when = FIRST_EXCEPTION)
+        failed = [f for f in done if f.exception() is not None]
+        if failed:
+            # stopping every process makes the remaining waits return right away
+            stack.shutdown()
+    
+    if failed:
+        raise failed[0].exception()
+    return stack
@@ -0,0 +1,215 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Supervisor:
+    """
+    ### Description:
+    
+    Watch the contextual-genie and NLU server processes started by a `Genie` and restart them when they crash
+    (the process exited) or are wedged (it stops answering health checks).
+    
+    Restarted contextual-genie servers get the settings of the `Genie` back, and a restarted NLU server keeps its port,
+    so contextual-genie servers using it keep working. Restarts that fail are retried with exponential backoff.
+    
+    While a supervisor is started, `Genie.query` retries a query that failed on a connection error once after the
+    server was restarted, when the query carries its own `dialog_state` (so does not depend on the state that was lost).
+    
+    ```
+    genie = Genie()
+    genie.initialize("localhost", "yelp")
+    supervisor = Supervisor(genie).start()
+    ...
+    print(supervisor.stats)
+    ```
+    
+    ### Args:
+    
+    `genie` (Genie): a Genie whose `process` and/or `nlu_process` were started by `initialize` or `nlu_server`.
+    
+    `interval` (float, optional): seconds between two health checks. Defaults to 1.0.
+    
+    `probe_timeout` (float, optional): seconds a health check waits for an answer. Defaults to 5.0.
+    
+    `failures_before_restart` (int, optional): consecutive failed health checks after which a running process is considered wedged. Defaults to 3.
+    
+    `startup_timeout` (float, optional): seconds a restarted process has to become ready. Defaults to 300.
+    
+    `max_backoff` (float, optional): longest wait, in seconds, between two failed restarts. Defaults to 60.
+    """
+    def __init__(self, genie,
+                 interval = 1.0,
+                 probe_timeout = 5.0,
+                 failures_before_restart = 3,
+                 startup_timeout = 300,
+                 max_backoff = 60):
+        self.genie = genie
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.failures_before_restart = failures_before_restart
+        self.startup_timeout = startup_timeout
+        self.max_backoff = max_backoff
+        
+        self.components = {
+            "contextual-genie": ("process", genie._restart_contextual_genie),
+            "nlu": ("nlu_process", genie._restart_nlu_server),
+        }
+        self.stats = {name: {"restarts": 0, "failed_restarts": 0, "downtime": 0.0} for name in self.components}
+        self._failures = {name: 0 for name in self.components}
+        self._down_since = {}
+        self._next_attempt = {}
+        self._backoff = {}
+        
+        self._cond = threading.Condition()
+        self._passes = 0
+        self._checking = False
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Start watching in a daemon thread and return this supervisor."""
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target = self.__run, name = "genie-supervisor", daemon = True)
+            self._thread.start()
+            self.genie.supervisor = self
+        return self
+    
+    def stop(self):
+        """Stop watching. Processes are left running."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        if self.genie.supervisor is self:
+            self.genie.supervisor = None
+    
+    def check_now(self):
+        """Run the next health check right away instead of after `interval`."""
+        self._wake.set()
+    
+    def healthy(self) -> bool:
+        """Whether every watched process passed its last health check."""
+        with self._cond:
+            return not self._down_since
+    
+    def wait_until_healthy(self, timeout = None) -> bool:
+        """Wait until every watched process is healthy, return False if it did not happen within `timeout` seconds."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._down_since or self._thread is None, timeout) and not self._down_since
+    
+    def recover(self, timeout = None) -> bool:
+        """
+        Check the processes now and wait until they are healthy again, restarting them if needed.
+        
+        Return False if they are not healthy within `timeout` seconds (defaults to `startup_timeout`).
+        """
+        if timeout is None:
+            timeout = self.startup_timeout
+        with self._cond:
+            # wait for a health check that started after the caller saw the failure
+            target = self._passes + (2 if self._checking else 1)
+            self._wake.set()
+            return self._cond.wait_for(
+                lambda: self._thread is None or (self._passes >= target and not self._down_since), timeout
+            ) and self._thread is not None
+    
+    def __run(self):
+        while not self._stopping.is_set():
+            with self._cond:
+                self._checking = True
+            for name in self.components:
+                if self._stopping.is_set():
+                    break
+                try:
+                    self.__check(name)
+                except Exception:
+                    logger.exception("supervising %s failed", name)
+            with self._cond:
+                self._checking = False
+                self._passes += 1
+                self._cond.notify_all()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+        with self._cond:
+            self._cond.notify_all()
+    
+    def __check(self, name):
+        attr, restart = self.components[name]
+        process = getattr(self.genie, attr)
+        if process is None:
+            return
+        
+        code = process.poll()
+        if code is None and process.probe(timeout = self.probe_timeout):
+            self._failures[name] = 0
+            return
+        if code is None:
+            self._failures[name] += 1
+            if self._failures[name] < self.failures_before_restart:
+                return
+            reason = "did not answer {} health checks".format(self._failures[name])
+        else:
+            reason = "exited with code {}".format(code)
+        
+        now = time.monotonic()
+        with self._cond:
+            if name not in self._down_since:
+                logger.warning("%s %s, restarting it", name, reason)
+                self._down_since[name] = now
+        if now < self._next_attempt.get(name, 0):
+            return
+        
+        try:
+            restart(self.startup_timeout)
+        except Exception as e:
+            self.stats[name]["failed_restarts"] += 1
+            self._backoff[name] = min(self.max_backoff, self._backoff.get(name, self.interval / 2) * 2)
+            self._next_attempt[name] = time.monotonic() + self._backoff[name]
+            logger.warning("restarting %s failed, next attempt in %.1fs: %s", name, self._backoff[name], e)
+            return
+        
+        self._failures[name] = 0
+        self._backoff.pop(name, None)
+        self._next_attempt.pop(name, None)
+        with self._cond:
+            self.stats[name]["restarts"] += 1
+            self.stats[name]["downtime"] += time.monotonic() - self._down_since.pop(name)
+            self._cond.notify_all()
+        logger.info("%s restarted", name)
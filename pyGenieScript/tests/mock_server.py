@@ -0,0 +1,238 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""A local stand-in for the contextual-genie HTTP server, used by tests and benchmarks."""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from pyGenieScript.process import GenieProcess
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        self._dispatch(parsed.path.strip("/"), params)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        payload = json.loads(body) if body else {}
+        self._dispatch(urlparse(self.path).path.strip("/"), payload)
+
+    def _dispatch(self, endpoint, payload):
+        genie = self.server.genie
+        if genie.record_calls:
+            with self.server.lock:
+                self.server.calls.append((endpoint, payload))
+        if endpoint in ("query", "queryContext"):
+            delay = genie.latency
+            res = genie.query_response(endpoint, payload)
+        elif endpoint.endswith("/query"):
+            # `<locale>/query` of the NLU server
+            delay = genie.latency
+            res = genie.parse_response(payload)
+        else:
+            delay = genie.control_latency
+            res = genie.control_response(endpoint, payload)
+        if delay:
+            time.sleep(delay)
+        data = json.dumps(res).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockGenieServer:
+    """
+    Serve the contextual-genie endpoints (`queryContext`, `query`, `setNumResults`, `neglectFilters`,
+    `neglectProjections`, `toggleDirectSentenceState`, `clean`, `quit`) and the `<locale>/query` endpoint
+    of the NLU server on a random local port.
+
+    Every call is recorded in `calls` as `(endpoint, payload)` unless `record_calls` is False,
+    and `connections` counts accepted TCP connections.
+    """
+    def __init__(self, latency = 0.0, control_latency = 0.0, payload_size = 0, record_calls = True, port = 0):
+        """
+        ### Args:
+
+        `latency` (float, optional): seconds each `query`/`queryContext` call takes, standing in for parsing and skill execution. Defaults to 0.
+
+        `control_latency` (float, optional): seconds every other call takes. Defaults to 0.
+
+        `payload_size` (int, optional): bytes of padding in each result, standing in for large skill payloads. Defaults to 0.
+
+        `record_calls` (bool, optional): record every call in `calls`. Defaults to True.
+
+        `port` (int, optional): port to listen on. Defaults to 0 (any free port).
+        """
+        self.latency = latency
+        self.control_latency = control_latency
+        self.payload_size = payload_size
+        self.record_calls = record_calls
+        self.num_results = 1
+        self.neglect_filters = []
+        self.neglect_projections = []
+        self.direct_sentence_state = False
+        self.ds = ""
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.lock = threading.Lock()
+        self.httpd.calls = []
+        self.httpd.connections = 0
+        self.httpd.genie = self
+        self.url = "http://127.0.0.1:{}/".format(self.httpd.server_address[1])
+        self.thread = None
+
+    @property
+    def calls(self):
+        return self.httpd.calls
+
+    @property
+    def connections(self):
+        return self.httpd.connections
+
+    def query_response(self, endpoint, payload):
+        ds = self.ds
+        if endpoint == "queryContext" and "ds" in payload:
+            ds = self.ds = payload["ds"]
+        results = [{"name": "mock restaurant {}".format(i), "description": "x" * self.payload_size} for i in range(self.num_results)]
+        return {
+            "response": ["I found a restaurant for \"{}\".".format(payload.get("q", ""))],
+            "results": results,
+            "user_target": "$dialogue @org.thingpedia.dialogue.transaction.execute;",
+            "ds": ds,
+            "aux": payload.get("aux", []),
+            "delta_verbal": [],
+            "full_verbal": [],
+        }
+
+    def parse_response(self, payload):
+        tokens = payload["q"].split()
+        return {
+            "result": "ok",
+            "tokens": tokens,
+            "entities": {},
+            "candidates": [
+                {"code": ["@com.yelp", ".", "restaurant", "(", ")", ";"], "score": 1.0},
+                {"code": ["$dialogue", "@org.thingpedia.dialogue.transaction", ".", "greet", ";"], "score": 0.5},
+            ][:int(payload.get("limit") or 2)],
+        }
+
+    def control_response(self, endpoint, payload):
+        if endpoint == "setNumResults":
+            self.num_results = int(payload["numResults"])
+        elif endpoint == "neglectFilters":
+            self.neglect_filters.append(payload["name"])
+        elif endpoint == "neglectProjections":
+            self.neglect_projections.append(payload["name"])
+        elif endpoint == "toggleDirectSentenceState":
+            self.direct_sentence_state = payload["directSentenceState"]
+        elif endpoint == "clean":
+            self.ds = ""
+        return {"response": 200}
+
+    def start(self):
+        self.thread = threading.Thread(target = self.httpd.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def mock_process(port = None, **kwargs):
+    """Run a mock server in a child process, announcing its port like a genie server. `kwargs` are passed to `GenieProcess`."""
+    command = [sys.executable, "-m", "pyGenieScript.tests.mock_server"]
+    if port is not None:
+        command += ["--port", str(port)]
+    return GenieProcess(command, cwd = ROOT, **kwargs)
+
+
+def spawn_contextual_genie(genie, timeout = 10):
+    """Run a mock server in a child process as the contextual-genie of `genie`, so it can crash and be restarted."""
+    genie.process = mock_process()
+    genie._wait_contextual_genie(timeout)
+    return genie.process
+
+
+def fake_start_contextual_genie(genie):
+    """Make `genie` spawn a mock server in place of contextual-genie, without waiting for it."""
+    def start(actual_server, actual_manifest, log_file_name = 'log.log', max_log_lines = 1000, forward_logs = False, log_path = None):
+        genie.process = mock_process(max_log_lines = max_log_lines, log_path = log_path)
+    genie._start_contextual_genie = start
+
+
+def fake_spawn_nlu_server(genie, spawned = None):
+    """Make `genie` spawn a mock server in place of an NLU server, recording the model of every spawn in `spawned`."""
+    def spawn(actual_model_dir, actual_manifest_dir, port = None, max_log_lines = 1000, forward_logs = True):
+        if spawned is not None:
+            spawned.append(actual_model_dir)
+        return mock_process(port, max_log_lines = max_log_lines)
+    genie._spawn_nlu_server = spawn
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Run a mock genie server until killed.")
+    parser.add_argument("--port", type = int, default = 0)
+    server = MockGenieServer(record_calls = False, port = parser.parse_args().port)
+    # announce the port the way contextual-genie does
+    print("Server port number at, {}".format(server.httpd.server_address[1]), flush = True)
+    server.httpd.serve_forever()
@@ -0,0 +1,83 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import asyncio
+
+import pytest
+
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+aiohttp = pytest.importorskip("aiohttp")
+
+from pyGenieScript.async_geniescript import AsyncGenie
+
+def test_query_many():
+    async def run(url):
+        async with AsyncGenie(url = url, max_concurrency = 4) as genie:
+            queries = [{"query": "restaurant {}".format(i), "dialog_state": "ds {}".format(i)} for i in range(20)]
+            responses = await genie.query_many(queries, num_results = 3)
+            switched = await genie.query("one more", num_results = 1)
+            return responses, switched
+
+    with MockGenieServer() as server:
+        responses, switched = asyncio.run(run(server.url))
+        assert([r["ds"] for r in responses] == ["ds {}".format(i) for i in range(20)])
+        assert(len(switched["results"]) >= 1)
+        endpoints = [c[0] for c in server.calls]
+        assert(endpoints.count("setNumResults") == 2)
+        # the second setNumResults is only sent once every earlier query has been answered
+        assert(endpoints.index("setNumResults", 1) == 21)
+
+def test_switch_mid_stream():
+    async def run(url):
+        async with AsyncGenie(url = url, max_concurrency = 8) as genie:
+            queries = [{"query": "restaurant {}".format(i), "dialog_state": "ds {}".format(i)} for i in range(300)]
+            stream = asyncio.ensure_future(genie.query_many(queries))
+            await asyncio.sleep(0.05)
+            switched = await genie.query("one more", num_results = 2, dialog_state = "ds")
+            return switched, stream.done(), await stream
+
+    with MockGenieServer(latency = 0.005) as server:
+        switched, stream_done, responses = asyncio.run(run(server.url))
+        assert(len(switched["results"]) == 2 and not stream_done)
+        assert(all(len(r["results"]) == 1 for r in responses))
+        endpoints = [c[0] for c in server.calls]
+        # the switch waits for the queries in flight, not for the whole stream
+        assert(endpoints.index("setNumResults") < 100)
+
+def test_failed_query_cancels_the_others():
+    async def run(url):
+        async with AsyncGenie(url = url, max_concurrency = 4) as genie:
+            queries = [{"query": "restaurant {}".format(i), "dialog_state": "ds {}".format(i)} for i in range(3)]
+            queries.append({"query": "restaurant", "no_such_option": True})
+            with pytest.raises(TypeError):
+                await genie.query_many(queries + queries)
+            return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    with MockGenieServer(latency = 1.0) as server:
+        assert(asyncio.run(run(server.url)) == [])
@@ -0,0 +1,105 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+
+import pytest
+
+from pyGenieScript import bundle
+from pyGenieScript.geniescript import Genie
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, "w") as fd:
+        fd.write(content)
+
+def fake_runtime(root):
+    write(os.path.join(root, "node_modules", "genie-toolkit", "dist", "tool", "genie.js"), "// genie")
+    os.makedirs(os.path.join(root, "node_modules", ".bin"))
+    os.symlink("../genie-toolkit/dist/tool/genie.js", os.path.join(root, "node_modules", ".bin", "genie"))
+    os.symlink("genie-toolkit", os.path.join(root, "node_modules", "genie-alias"))
+    # a package linked from outside, as by `npm link` or workspaces
+    write(os.path.join(root, "workspace", "linked", "index.js"), "// linked")
+    os.symlink(os.path.join("..", "workspace", "linked"), os.path.join(root, "node_modules", "linked"))
+    write(os.path.join(root, "manifests", "com.yelp", "manifest.tt"), "class @com.yelp {}")
+    # model files in the hub cache are symlinks to blobs
+    write(os.path.join(root, "blobs", "config"), "{}")
+    os.makedirs(os.path.join(root, "my-model"))
+    os.symlink(os.path.join(root, "blobs", "config"), os.path.join(root, "my-model", "config.json"))
+    
+    genie = Genie(url = "http://127.0.0.1:1/")
+    genie.node_modules = os.path.join(root, "node_modules")
+    return genie
+
+def test_pack_unpack(tmp_path):
+    genie = fake_runtime(str(tmp_path / "src"))
+    archive = str(tmp_path / "runtime.tar.gz")
+    metadata = bundle.pack(archive, model_name = str(tmp_path / "src" / "my-model"),
+                           manifest_dir = str(tmp_path / "src" / "manifests"), genie = genie)
+    assert(metadata["models"] == {"my-model": "models/my-model"})
+    assert(os.path.exists(archive + ".sha256"))
+    
+    dest = str(tmp_path / "runtime")
+    bundle.unpack(archive, dest)
+    assert(bundle.verify(dest) == [])
+    assert(os.path.islink(os.path.join(dest, "node_modules", ".bin", "genie")))
+    assert(os.path.islink(os.path.join(dest, "node_modules", "genie-alias")))
+    assert(os.path.isfile(os.path.join(dest, "node_modules", "linked", "index.js")))
+    assert(not os.path.islink(os.path.join(dest, "node_modules", "linked")))
+    assert(not os.path.islink(os.path.join(dest, "models", "my-model", "config.json")))
+    
+    # unpacking again replaces the bundle
+    bundle.unpack(archive, dest)
+    write(os.path.join(dest, "manifests", "com.yelp", "manifest.tt"), "tampered")
+    assert(bundle.verify(dest) == ["manifests/com.yelp/manifest.tt"])
+    
+    with pytest.raises(FileExistsError):
+        bundle.unpack(archive, str(tmp_path / "src"))
+    
+    with open(archive, "ab") as fd:
+        fd.write(b"garbage")
+    with pytest.raises(ValueError):
+        bundle.unpack(archive, str(tmp_path / "other"))
+
+def test_genie_from_bundle(tmp_path):
+    genie = fake_runtime(str(tmp_path / "src"))
+    archive = str(tmp_path / "runtime.tar")
+    bundle.pack(archive, model_name = str(tmp_path / "src" / "my-model"),
+                manifest_dir = str(tmp_path / "src" / "manifests"), genie = genie, compression = "none")
+    dest = str(tmp_path / "runtime")
+    bundle.unpack(archive, dest)
+    
+    # neither installs nor checks genie-toolkit
+    genie = Genie(bundle = dest)
+    assert(genie.offline)
+    assert(genie.node_modules == os.path.join(dest, "node_modules"))
+    assert(genie.download_or_find_model("my-model") == os.path.join(dest, "models", "my-model"))
+    assert(genie.download_or_find_manifests("None") == os.path.join(dest, "manifests"))
+    
+    with pytest.raises(ValueError):
+        Genie(bundle = str(tmp_path / "src"))
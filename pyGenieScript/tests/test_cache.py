@@ -0,0 +1,76 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import time
+
+from pyGenieScript.cache import QueryCache
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+def test_query_cache():
+    with MockGenieServer() as server:
+        genie = Genie(url = server.url, cache = QueryCache(max_size = 2))
+        for _ in range(3):
+            genie.query("show me a chinese restaurant", dialog_state = "ds")
+        genie.query("show me a chinese restaurant", dialog_state = "ds", num_results = 3)
+        genie.query("show me a chinese restaurant")
+        genie.query("show me a chinese restaurant")
+        assert([c[0] for c in server.calls].count("queryContext") == 4)
+        assert(genie.cache.stats()["hits"] == 2)
+        
+        genie.clean()
+        genie.query("show me a chinese restaurant", dialog_state = "ds")
+        assert([c[0] for c in server.calls].count("queryContext") == 5)
+
+def test_query_cache_expiry_and_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = QueryCache(max_size = 1, ttl = 1, path = path)
+    cache.put("a", {"user_target": "a"})
+    cache.put("b", {"user_target": "b"})
+    assert(cache.get("a") == {"user_target": "a"})
+    cache.close()
+    
+    cache = QueryCache(path = path)
+    assert(cache.get("b") == {"user_target": "b"})
+    time.sleep(1.2)
+    assert(QueryCache(ttl = 1, path = path).get("a") is None)
+
+def test_memory_hits_keep_disk_rows(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = QueryCache(path = path, max_disk_size = 2)
+    for key in ("a", "b"):
+        cache.put(key, {"key": key})
+        time.sleep(0.01)
+    # only hit in memory, which must still count for the disk tier's eviction
+    assert(cache.get("a") == {"key": "a"})
+    time.sleep(0.01)
+    cache.put("c", {"key": "c"})
+    cache.close()
+    
+    disk = QueryCache(path = path)
+    assert(disk.get("a") is not None and disk.get("c") is not None and disk.get("b") is None)
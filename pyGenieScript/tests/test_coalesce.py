@@ -0,0 +1,65 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import asyncio
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pyGenieScript.coalesce import AsyncSingleFlight, SingleFlight
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+def test_threads_share_one_call():
+    with MockGenieServer(latency = 0.3) as server:
+        genie = Genie(url = server.url, single_flight = SingleFlight())
+        with ThreadPoolExecutor(max_workers = 8) as executor:
+            results = list(executor.map(lambda i: genie.query("show me a restaurant", dialog_state = "ds"), range(8)))
+        assert([c[0] for c in server.calls].count("queryContext") == 1)
+        assert(all(r == results[0] for r in results) and results[0] is not results[1])
+        assert(genie.single_flight.dedup_ratio == 7 / 8)
+        
+        # queries on the current dialog state are never shared
+        genie.query("show me a restaurant")
+        assert(genie.single_flight.stats["calls"] == 8)
+
+@pytest.mark.skipif(importlib.util.find_spec("aiohttp") is None, reason = "requires aiohttp")
+def test_asyncio_shares_one_call():
+    from pyGenieScript.async_geniescript import AsyncGenie
+    
+    async def run(url):
+        async with AsyncGenie(url = url, single_flight = AsyncSingleFlight()) as genie:
+            results = await asyncio.gather(*[genie.query("show me a restaurant", dialog_state = "ds") for _ in range(8)])
+            return results, genie.single_flight
+    
+    with MockGenieServer(latency = 0.3) as server:
+        results, single_flight = asyncio.run(run(server.url))
+        assert([c[0] for c in server.calls].count("queryContext") == 1)
+        assert(all(r == results[0] for r in results))
+        assert(single_flight.stats["executions"] == 1 and single_flight.dedup_ratio == 7 / 8)
@@ -0,0 +1,99 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+import subprocess
+
+import pytest
+
+from pyGenieScript import manifest_store
+
+def git(*args, cwd):
+    subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args), cwd = cwd, check = True, stdout = subprocess.DEVNULL)
+
+def make_repo(tmp_path, builds_log):
+    work, bare = str(tmp_path / "work"), str(tmp_path / "devices.git")
+    os.makedirs(os.path.join(work, "geniescript"))
+    with open(os.path.join(work, "Makefile"), "w") as fd:
+        fd.write("geniescript_install_2:\n\techo built >> {}\n\tcp -r geniescript geniescript-built\n".format(builds_log))
+    with open(os.path.join(work, "geniescript", "manifest.tt"), "w") as fd:
+        fd.write("class @com.yelp {}\n")
+    git("init", "--quiet", "-b", "wip/geniescript", cwd = work)
+    git("add", ".", cwd = work)
+    git("commit", "--quiet", "-m", "initial", cwd = work)
+    git("clone", "--quiet", "--bare", work, bare, cwd = str(tmp_path))
+    git("remote", "add", "origin", bare, cwd = work)
+    return work, bare
+
+def test_find_or_build(tmp_path):
+    builds_log = str(tmp_path / "builds.log")
+    work, bare = make_repo(tmp_path, builds_log)
+    cache = str(tmp_path / "cache")
+    def builds():
+        with open(builds_log) as fd:
+            return len(fd.readlines())
+    
+    first = manifest_store.find_or_build(repo_url = bare, cache_dir = cache)
+    assert(os.path.exists(os.path.join(first, "manifest.tt")))
+    assert(manifest_store.find_or_build(repo_url = bare, cache_dir = cache, offline = True) == first)
+    
+    # a new commit with the same source tree reuses the build
+    git("commit", "--quiet", "--allow-empty", "-m", "empty", cwd = work)
+    git("push", "--quiet", "origin", "wip/geniescript", cwd = work)
+    assert(manifest_store.find_or_build(repo_url = bare, cache_dir = cache, force_update = True) == first)
+    assert(builds() == 1)
+    
+    with open(os.path.join(work, "geniescript", "manifest.tt"), "a") as fd:
+        fd.write("class @com.tunein {}\n")
+    git("commit", "--quiet", "-am", "tunein", cwd = work)
+    git("push", "--quiet", "origin", "wip/geniescript", cwd = work)
+    assert(manifest_store.find_or_build(repo_url = bare, cache_dir = cache) == first)
+    second = manifest_store.find_or_build(repo_url = bare, cache_dir = cache, force_update = True)
+    assert(second != first and builds() == 2)
+
+def test_offline_without_build(tmp_path):
+    with pytest.raises(ValueError):
+        manifest_store.find_or_build(repo_url = str(tmp_path), cache_dir = str(tmp_path / "cache"), offline = True)
+
+def test_branch_moved_during_update(tmp_path, monkeypatch):
+    work, bare = make_repo(tmp_path, str(tmp_path / "builds.log"))
+    cache = str(tmp_path / "cache")
+    old = manifest_store.remote_commit(bare, "wip/geniescript")
+    with open(os.path.join(work, "geniescript", "manifest.tt"), "a") as fd:
+        fd.write("class @com.tunein {}\n")
+    git("commit", "--quiet", "-am", "tunein", cwd = work)
+    git("push", "--quiet", "origin", "wip/geniescript", cwd = work)
+    new = manifest_store.remote_commit(bare, "wip/geniescript")
+    
+    # the branch moves between `ls-remote` and the clone
+    monkeypatch.setattr(manifest_store, "remote_commit", lambda repo_url, branch: old)
+    build = manifest_store.find_or_build(repo_url = bare, cache_dir = cache)
+    commits = os.path.join(cache, "manifests", "commits")
+    assert(os.listdir(commits) == [new])
+    with open(os.path.join(build, "manifest.tt")) as fd:
+        assert("tunein" in fd.read())
@@ -0,0 +1,64 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from pyGenieScript.cache import QueryCache
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.metrics import QueryMetrics
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+def test_query_metrics():
+    observed = []
+    metrics = QueryMetrics()
+    metrics.add_hook(lambda endpoint, timings: observed.append(endpoint))
+    with MockGenieServer() as server:
+        genie = Genie(url = server.url, metrics = metrics, cache = QueryCache())
+        genie.query("show me a chinese restaurant", num_results = 3, neglect_filters = ["price"])
+        genie.query("show me a chinese restaurant", neglect_filters = ["price"], dialog_state = "ds")
+        genie.query("show me a chinese restaurant", neglect_filters = ["price"], dialog_state = "ds")
+    
+    assert(observed == ["queryContext", "queryContext", "cache"])
+    assert(metrics.histograms["total"].count == 3)
+    assert(metrics.histograms["request"].count == 2)
+    assert(set(metrics.percentiles()) == {0.5, 0.9, 0.99})
+    
+    text = metrics.to_prometheus()
+    assert('pygeniescript_query_phase_seconds_count{phase="total"} 3' in text)
+    assert('pygeniescript_queries_total{endpoint="cache"} 1' in text)
+    # num_results and the filter, then back to num_results = 1
+    assert("pygeniescript_settings_updates_total 3" in text)
+
+def test_failing_hook(caplog):
+    observed = []
+    metrics = QueryMetrics()
+    metrics.add_hook(lambda endpoint, timings: 1 / 0)
+    metrics.add_hook(lambda endpoint, timings: observed.append(endpoint))
+    with MockGenieServer() as server:
+        genie = Genie(url = server.url, metrics = metrics)
+        assert(genie.query("show me a chinese restaurant", dialog_state = "ds")["results"])
+    assert(observed == ["queryContext"])
+    assert("metrics hook" in caplog.text and "ZeroDivisionError" in caplog.text)
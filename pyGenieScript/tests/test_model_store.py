@@ -0,0 +1,67 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import hashlib
+import os
+
+from pyGenieScript import model_store
+
+def fake_hub_snapshot(hub_dir, files):
+    # the hub cache layout: snapshot files are symlinks to blobs named after their content hash
+    snapshot = os.path.join(hub_dir, "snapshots", "main")
+    os.makedirs(os.path.join(hub_dir, "blobs"), exist_ok = True)
+    os.makedirs(snapshot, exist_ok = True)
+    for name in os.listdir(snapshot):
+        os.remove(os.path.join(snapshot, name))
+    for name, content in files.items():
+        blob = os.path.join(hub_dir, "blobs", hashlib.sha256(content).hexdigest())
+        with open(blob, "wb") as fd:
+            fd.write(content)
+        os.symlink(blob, os.path.join(snapshot, name))
+    return snapshot
+
+def test_materialize(tmp_path):
+    hub, dest = str(tmp_path / "hub"), str(tmp_path / "models")
+    snapshot = fake_hub_snapshot(hub, {"config.json": b"{}", "best.pth": b"weights"})
+    
+    assert(model_store.materialize(snapshot, dest) == {"config.json": "hardlink", "best.pth": "hardlink"})
+    assert(model_store.is_materialized(dest))
+    assert(os.stat(os.path.join(dest, "best.pth")).st_nlink == 2)
+    assert(model_store.materialize(snapshot, dest) == {})
+    
+    snapshot = fake_hub_snapshot(hub, {"config.json": b"{}", "best.pth": b"new weights"})
+    assert(list(model_store.materialize(snapshot, dest)) == ["best.pth"])
+    with open(os.path.join(dest, "best.pth"), "rb") as fd:
+        assert(fd.read() == b"new weights")
+    
+    snapshot = fake_hub_snapshot(hub, {"config.json": b"{}"})
+    model_store.materialize(snapshot, dest, mode = "copy")
+    assert(not os.path.exists(os.path.join(dest, "best.pth")))
+    
+    os.remove(os.path.join(dest, "config.json"))
+    assert(not model_store.is_materialized(dest))
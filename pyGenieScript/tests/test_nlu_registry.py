@@ -0,0 +1,110 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+
+from pyGenieScript import nlu_registry
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.tests.mock_server import fake_spawn_nlu_server
+
+def make_registry(tmp_path, **kwargs):
+    genie = Genie(url = "http://127.0.0.1:1/")
+    spawned = []
+    fake_spawn_nlu_server(genie, spawned)
+    for model in ("a", "b", "c"):
+        os.makedirs(str(tmp_path / model))
+        (tmp_path / model / "config.json").write_text("{}")
+    registry = nlu_registry.NLURegistry(manifest_dir = str(tmp_path), path = str(tmp_path / "registry.json"), genie = genie, **kwargs)
+    return registry, spawned
+
+def test_lazy_start(tmp_path):
+    registry, spawned = make_registry(tmp_path)
+    try:
+        model = str(tmp_path / "a")
+        url = registry.url(model)
+        assert(registry.url(model) == url and len(spawned) == 1)
+        assert(nlu_registry.lookup(model, path = registry.path) == url)
+    finally:
+        registry.shutdown()
+    assert(nlu_registry.read_registry(registry.path) == {})
+
+def test_lru_eviction(tmp_path):
+    registry, _ = make_registry(tmp_path)
+    a, b, c = (str(tmp_path / model) for model in ("a", "b", "c"))
+    try:
+        registry.url(a)
+        # room for about one and a half servers
+        registry.memory_budget = registry._servers[a].process.sample()["rss"] * 3 // 2
+        with registry.use(b):
+            assert(set(registry.servers()) == {b})
+            registry.url(c)
+            # b is in use, so the budget is exceeded rather than evicting it
+            assert(set(registry.servers()) == {b, c})
+        registry.url(a)
+        assert(set(registry.servers()) == {a})
+        assert(nlu_registry.lookup(b, path = registry.path) is None)
+        assert(registry.stats == {"starts": 4, "evictions": 3})
+    finally:
+        registry.shutdown()
+
+def test_no_eviction_while_used_by_other_processes(tmp_path):
+    registry, _ = make_registry(tmp_path)
+    a, b, c = (str(tmp_path / model) for model in ("a", "b", "c"))
+    try:
+        url = registry.url(a)
+        registry.memory_budget = registry._servers[a].process.sample()["rss"] * 3 // 2
+        # as done by `Genie().initialize("localhost/<model>")` in another process
+        assert(nlu_registry.attach(a, path = registry.path) == url)
+        registry.url(b)
+        assert(set(registry.servers()) == {a, b})
+        
+        nlu_registry.detach(a, path = registry.path)
+        registry.url(c)
+        assert(set(registry.servers()) == {c})
+        assert(nlu_registry.read_registry(registry.path)[c]["users"] == [])
+    finally:
+        registry.shutdown()
+
+def test_localhost_model_leased_once(tmp_path, monkeypatch):
+    registry, _ = make_registry(tmp_path)
+    monkeypatch.setattr(nlu_registry, "DEFAULT_REGISTRY_PATH", registry.path)
+    monkeypatch.chdir(str(tmp_path))
+    a = "a"
+    try:
+        url = registry.url(a)
+        genie = Genie(url = "http://127.0.0.1:1/")
+        for _ in range(5):
+            assert(genie.parse("show me a restaurant", "localhost/" + a)["user_target"])
+        assert(nlu_registry.read_registry(registry.path)[a]["users"] == [])
+        
+        for _ in range(2):
+            assert(genie.download_or_find_model("localhost/" + a) == url)
+        assert(genie._nlu_leases == {a})
+        assert(nlu_registry.read_registry(registry.path)[a]["users"] == [os.getpid()])
+    finally:
+        registry.shutdown()
@@ -0,0 +1,90 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.pool import GeniePool
+from pyGenieScript.process import GenieProcess
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+def test_pool_routing():
+    with MockGenieServer() as a, MockGenieServer() as b:
+        pool = GeniePool(urls = [a.url, b.url])
+        
+        # a conversation is pinned to one worker until it ends
+        pool.query("show me a chinese restaurant", conversation_id = "alice")
+        pool.query("the cheapest one", conversation_id = "alice")
+        assert(sorted([len(a.calls), len(b.calls)]) == [0, 2])
+        
+        # stateless queries avoid the worker holding a conversation
+        busy, idle = (a, b) if a.calls else (b, a)
+        with ThreadPoolExecutor(max_workers = 4) as executor:
+            list(executor.map(lambda i: pool.query("restaurant {}".format(i), dialog_state = "ds"), range(8)))
+        assert(len(busy.calls) == 2 and len(idle.calls) == 8)
+        
+        pool.end_conversation("alice")
+        assert(busy.calls[-1][0] == "clean")
+        pool.query("show me a thai restaurant", conversation_id = "bob")
+        pool.query("show me a greek restaurant", conversation_id = "carol")
+        assert(pool.workers[0].conversation != pool.workers[1].conversation)
+
+def test_hedging():
+    with MockGenieServer(latency = 1.0) as slow, MockGenieServer() as fast:
+        pool = GeniePool(urls = [slow.url, fast.url], hedge_after = 0.05)
+        start = time.monotonic()
+        pool.query("show me a restaurant", dialog_state = "ds")
+        assert(time.monotonic() - start < 0.5)
+        assert(pool.stats["hedges"] == 1 and pool.stats["hedge_wins"] == 1)
+
+def test_workers_share_nlu_server(tmp_path):
+    os.makedirs(str(tmp_path / "model"))
+    (tmp_path / "model" / "config.json").write_text("{}")
+    with MockGenieServer() as a, MockGenieServer() as b:
+        pool = GeniePool(genies = [Genie(url = a.url), Genie(url = b.url)])
+        spawned, started = [], []
+        
+        def spawn(model, manifest, port = None):
+            # any HTTP server stands in for the NLU server
+            spawned.append(model)
+            return GenieProcess([sys.executable, "-m", "http.server", str(port), "--bind", "127.0.0.1"], cwd = str(tmp_path))
+        
+        pool.workers[0].genie._spawn_nlu_server = spawn
+        for worker in pool.workers:
+            worker.genie.initialize = lambda server, manifest, **kwargs: started.append(server)
+        
+        pool.initialize(str(tmp_path / "model"), str(tmp_path))
+        assert(spawned == ["file://" + str(tmp_path / "model")])
+        assert(started == ["http://127.0.0.1:{}".format(pool.nlu_process.port)] * 2)
+        
+        process = pool.nlu_process
+        pool.quit()
+        assert(process.poll() is not None and pool.nlu_process is None)
@@ -0,0 +1,79 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import sys
+
+import pytest
+
+from pyGenieScript.process import GenieProcess
+
+def test_drain_keeps_recent_logs():
+    # far more output than an OS pipe buffer holds, written after the port is printed
+    script = "print('Server port number at, 4321', flush=True)\nfor i in range(100000): print('line', i)"
+    process = GenieProcess([sys.executable, "-c", script], max_log_lines = 10)
+    assert(process.wait_for_port(timeout = 10) == 4321)
+    assert(process.wait(timeout = 30) == 0)
+    process._drainer.join(timeout = 10)
+    assert(process.logs() == ["line {}".format(i) for i in range(99990, 100000)])
+
+def test_exit_before_port():
+    process = GenieProcess([sys.executable, "-c", "print('Error: cannot load model'); raise SystemExit(3)"])
+    with pytest.raises(RuntimeError, match = "cannot load model"):
+        process.wait_for_port(timeout = 10)
+
+def test_wait_ready():
+    script = "\n".join([
+        "import http.server, time",
+        "server = http.server.HTTPServer(('127.0.0.1', 0), http.server.BaseHTTPRequestHandler)",
+        "print('Server port number at, {}'.format(server.server_address[1]), flush=True)",
+        "time.sleep(0.5)",
+        "server.serve_forever()",
+    ])
+    process = GenieProcess([sys.executable, "-c", script])
+    try:
+        assert(process.wait_ready(timeout = 10) == process.port)
+    finally:
+        process.terminate()
+
+def test_wait_ready_timeout():
+    process = GenieProcess([sys.executable, "-c", "import time; print('loading model', flush=True); time.sleep(30)"])
+    try:
+        with pytest.raises(RuntimeError, match = "loading model"):
+            process.wait_ready(timeout = 0.5)
+    finally:
+        process.terminate()
+
+def test_log_file_trimmed_on_start(tmp_path):
+    log = tmp_path / "log"
+    script = "for i in range(20): print('line', i)"
+    for _ in range(3):
+        process = GenieProcess([sys.executable, "-c", script], max_log_lines = 30, log_path = str(log))
+        assert(process.wait(timeout = 10) == 0)
+    # the output of earlier runs is trimmed before each start, the last run is kept whole
+    lines = log.read_text().splitlines()
+    assert(len(lines) == 50 and lines[-20:] == ["line {}".format(i) for i in range(20)])
@@ -0,0 +1,96 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import json
+
+from pyGenieScript.pool import GeniePool
+from pyGenieScript.process import free_port
+from pyGenieScript.replay import replay, _load_progress
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+def test_replay_and_resume(tmp_path):
+    input_path, output_path = str(tmp_path / "dialogues.jsonl"), str(tmp_path / "results.jsonl")
+    with open(input_path, "w") as fd:
+        for i in range(10):
+            fd.write(json.dumps({"id": "d{}".format(i), "turns": ["hello {}".format(i), {"query": "bye {}".format(i), "num_results": 2}]}) + "\n")
+    
+    # an interrupted run left two dialogues and half a record behind
+    with open(output_path, "w") as fd:
+        fd.write(json.dumps({"line": 0, "id": "d0", "turns": []}) + "\n")
+        fd.write(json.dumps({"line": 3, "id": "d3", "turns": []}) + "\n")
+        fd.write('{"line": 4, "id": "d4", "tu')
+    
+    with MockGenieServer() as a, MockGenieServer() as b:
+        stats = replay(input_path, output_path, GeniePool(urls = [a.url, b.url]))
+        assert(stats == {"replayed": 8, "skipped": 2, "failed": 0})
+        assert(a.calls and b.calls)
+    
+    with open(output_path) as fd:
+        records = [json.loads(line) for line in fd]
+    assert(sorted(r["line"] for r in records) == list(range(10)))
+    for record in records[2:]:
+        i = record["line"]
+        assert([t["query"] for t in record["turns"]] == ["hello {}".format(i), "bye {}".format(i)])
+        assert(len(record["turns"][1]["response"]["results"]) == 2)
+
+def test_replay_blank_lines_and_fields(tmp_path):
+    input_path, output_path = str(tmp_path / "dialogues.jsonl"), str(tmp_path / "results.jsonl")
+    with open(input_path, "w") as fd:
+        fd.write("\n")
+        for i in range(5):
+            fd.write(json.dumps(["hello {}".format(i)]) + "\n")
+    
+    with MockGenieServer() as server:
+        stats = replay(input_path, output_path, GeniePool(urls = [server.url]), fields = ["user_target"])
+        assert(stats == {"replayed": 6, "skipped": 0, "failed": 0})
+    
+    with open(output_path) as fd:
+        records = sorted((json.loads(line) for line in fd), key = lambda r: r["line"])
+    assert(records[0]["turns"] == [])
+    assert(records[1]["turns"][0]["response"] == {"user_target": "$dialogue @org.thingpedia.dialogue.transaction.execute;"})
+    
+    # the blank line does not hold the checkpoint back
+    progress = _load_progress(output_path)
+    assert(progress.watermark == 5 and not progress.ahead)
+
+def test_replay_invalid_lines_and_retry(tmp_path):
+    input_path, output_path = str(tmp_path / "dialogues.jsonl"), str(tmp_path / "results.jsonl")
+    with open(input_path, "w") as fd:
+        fd.write('["hello"]\n{"turns": \n["bye"]\n')
+    
+    # the backend is down during the first run
+    stats = replay(input_path, output_path, GeniePool(urls = ["http://127.0.0.1:{}/".format(free_port())]))
+    assert(stats == {"replayed": 0, "skipped": 0, "failed": 3})
+    
+    with MockGenieServer() as server:
+        stats = replay(input_path, output_path, GeniePool(urls = [server.url]))
+        assert(stats == {"replayed": 2, "skipped": 1, "failed": 0})
+    with open(output_path) as fd:
+        records = [json.loads(line) for line in fd]
+    assert(sorted(r["line"] for r in records if "turns" in r) == [0, 2])
+    assert([r["line"] for r in records if "invalid" in r] == [1])
@@ -0,0 +1,62 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from concurrent.futures import ThreadPoolExecutor
+
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.pool import GeniePool
+from pyGenieScript.resources import RecyclePolicy
+from pyGenieScript.tests.mock_server import spawn_contextual_genie
+
+def test_resource_usage():
+    genie = Genie(url = "http://127.0.0.1:1/")
+    spawn_contextual_genie(genie)
+    try:
+        genie.query("hello", dialog_state = "state")
+        usage = genie.resource_usage()
+        assert(usage["queries"] == 1)
+        assert(usage["contextual-genie"]["pid"] == genie.process.pid and usage["contextual-genie"]["rss"] > 0)
+        assert("nlu" not in usage)
+    finally:
+        genie.process.terminate()
+
+def test_recycle_without_dropping_queries():
+    genie = Genie(url = "http://127.0.0.1:1/")
+    first = spawn_contextual_genie(genie)
+    pool = GeniePool(genies = [genie], recycle = RecyclePolicy(max_queries = 5))
+    try:
+        with ThreadPoolExecutor(max_workers = 4) as executor:
+            results = list(executor.map(lambda i: pool.query("query {}".format(i), num_results = 2, dialog_state = "state"), range(20)))
+        assert(all(len(res["results"]) == 2 for res in results))
+        # a restart triggered by the last queries may still be running
+        with pool._cond:
+            pool._cond.wait_for(lambda: not pool.workers[0].draining, timeout = 10)
+        assert(pool.recycles >= 1)
+        assert(first.poll() is not None and genie.process.poll() is None)
+    finally:
+        genie.process.terminate()
@@ -0,0 +1,57 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import pytest
+
+from pyGenieScript.cache import QueryCache
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.result import QueryResult
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+def test_lazy_fields():
+    res = QueryResult(b'{"user_target": "@com.yelp . restaurant ( ) ;", "ds": "ds", "results": [{"name": "a"}]}', fields = ["user_target", "ds"])
+    assert(res._raw is not None)
+    assert(res.user_target == "@com.yelp . restaurant ( ) ;" and res["ds"] == "ds")
+    # decoded once, keeping only the requested fields
+    assert(res._raw is None and res.to_dict() == {"user_target": "@com.yelp . restaurant ( ) ;", "ds": "ds"})
+    with pytest.raises(AttributeError):
+        res.results
+    assert(res.get("results") is None and "results" not in res)
+    with pytest.raises(ValueError):
+        QueryResult(b"{}", fields = ["user-target"])
+
+def test_query_fields():
+    with MockGenieServer(payload_size = 1000) as server:
+        genie = Genie(url = server.url, cache = QueryCache())
+        full = genie.query("show me a restaurant", num_results = 3, dialog_state = "ds")
+        res = genie.query("show me a restaurant", num_results = 3, dialog_state = "ds", fields = ["user_target", "ds"])
+        assert(isinstance(res, QueryResult) and res.to_dict() == {"user_target": full["user_target"], "ds": full["ds"]})
+        # a query with fields is cached as well, and can be served as a dict
+        res = genie.query("show me another restaurant", dialog_state = "ds", fields = ["results"])
+        assert(genie.query("show me another restaurant", dialog_state = "ds")["results"] == res.results)
+        assert(genie.cache.stats()["hits"] == 2)
@@ -0,0 +1,138 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+import subprocess
+import sys
+import time
+
+from pyGenieScript import server_registry
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.process import free_port, probe
+from pyGenieScript.tests.mock_server import ROOT, fake_start_contextual_genie, mock_process
+
+def test_share_and_release(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYGENIESCRIPT_CACHE_DIR", str(tmp_path))
+    first, second = Genie(url = "http://127.0.0.1:1/"), Genie(url = "http://127.0.0.1:1/")
+    for genie in (first, second):
+        fake_start_contextual_genie(genie)
+        genie._attach_contextual_genie("http://127.0.0.1:8400", str(tmp_path), "log.log", 1000, False, 10, None)
+    process = first.process
+    try:
+        assert(second.process is None and second.url == first.url)
+        key = server_registry.server_key("http://127.0.0.1:8400", str(tmp_path))
+        assert(server_registry.servers()[key]["users"] == [os.getpid(), os.getpid()])
+        # the server answers in its own log file
+        assert(second.query("show me a restaurant", num_results = 2, dialog_state = "ds")["results"])
+        
+        first.quit()
+        assert(second.query("show me a restaurant", dialog_state = "ds")["results"])
+        second.quit()
+        assert(server_registry.servers() == {})
+    finally:
+        process.terminate()
+
+def test_dead_entries_are_replaced(tmp_path):
+    started = []
+    def start():
+        process = mock_process(log_path = str(tmp_path / "log"))
+        process.wait_ready(timeout = 10)
+        started.append(process)
+        return process.port, process.pid
+    
+    port, fresh = server_registry.attach("key", start, cache_dir = str(tmp_path))
+    try:
+        # a user that exited is dropped from the entry
+        code = "from pyGenieScript import server_registry; print(server_registry.attach('key', None, cache_dir = {!r}))".format(str(tmp_path))
+        assert(subprocess.check_output([sys.executable, "-c", code], cwd = ROOT).decode().strip() == str((port, False)))
+        assert(fresh and server_registry.release("key", cache_dir = str(tmp_path)))
+        started[0].terminate()
+        
+        # a server that died is replaced
+        server_registry.attach("key", start, cache_dir = str(tmp_path))
+        started[1].terminate()
+        server_registry.attach("key", start, cache_dir = str(tmp_path))
+        assert(len(started) == 3 and started[2].poll() is None)
+    finally:
+        for process in started:
+            process.terminate()
+
+def test_restart_moves_users(tmp_path, monkeypatch):
+    monkeypatch.setenv("PYGENIESCRIPT_CACHE_DIR", str(tmp_path))
+    first, second = Genie(url = "http://127.0.0.1:1/"), Genie(url = "http://127.0.0.1:1/")
+    for genie in (first, second):
+        fake_start_contextual_genie(genie)
+        genie._attach_contextual_genie("http://127.0.0.1:8400", str(tmp_path), "log.log", 1000, False, 10, None)
+    try:
+        old_url = first.url
+        first._restart_contextual_genie(10)
+        key = server_registry.server_key("http://127.0.0.1:8400", str(tmp_path))
+        assert(server_registry.servers()[key]["port"] == first.process.port and first.url != old_url)
+        # the other user follows the server to its new port
+        assert(second.query("show me a restaurant", dialog_state = "ds")["results"])
+        assert(second.url == first.url)
+    finally:
+        first.process.terminate()
+
+def test_abandoned_servers_are_shut_down(tmp_path):
+    # a user that exits without releasing leaves its server behind
+    code = """
+from pyGenieScript import server_registry
+from pyGenieScript.tests.mock_server import mock_process
+def start():
+    process = mock_process(log_path = {log!r})
+    process.wait_ready(timeout = 10)
+    return process.port, process.pid
+print(server_registry.attach("abandoned", start, cache_dir = {cache!r})[0])
+""".format(log = str(tmp_path / "log"), cache = str(tmp_path))
+    port = int(subprocess.check_output([sys.executable, "-c", code], cwd = ROOT).decode().strip())
+    assert(probe(port, 1))
+    
+    server_registry.attach("key", lambda: (1, os.getpid()), cache_dir = str(tmp_path))
+    assert(list(server_registry.servers(str(tmp_path))) == ["key"])
+    deadline = time.monotonic() + 10
+    while probe(port, 1) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert(not probe(port, 1))
+
+def test_reaping_spares_reused_pids(tmp_path):
+    # the server of an abandoned entry died and its pid now belongs to an unrelated process
+    unrelated = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    try:
+        server_registry.update("abandoned", free_port(), unrelated.pid, cache_dir = str(tmp_path))
+        path = os.path.join(server_registry.registry_dir(str(tmp_path)), "abandoned.json")
+        entry = server_registry._read(path)
+        entry["users"] = []
+        server_registry._write(path, entry)
+        
+        server_registry.attach("key", lambda: (1, os.getpid()), cache_dir = str(tmp_path))
+        assert(list(server_registry.servers(str(tmp_path))) == ["key"])
+        assert(unrelated.poll() is None)
+    finally:
+        unrelated.kill()
+        unrelated.wait()
@@ -0,0 +1,71 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.sessions import SessionManager
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+def test_session_handles():
+    with MockGenieServer() as server:
+        sessions = SessionManager(Genie(url = server.url), max_sessions = 2)
+        sessions.query("alice", "hello", dialog_state = "alice state")
+        sessions.query("alice", "more")
+        sessions.query("bob", "hello", dialog_state = "bob state")
+        # the backend now holds bob's state, so alice's full state is sent again
+        assert(sessions.query("alice", "more")["ds"] == "alice state")
+        sessions.query("alice", "even more")
+        
+        endpoints = [c[0] for c in server.calls if c[0] in ("query", "queryContext")]
+        assert(endpoints == ["queryContext", "query", "queryContext", "queryContext", "query"])
+        assert(sessions.stats["handle"] == 2 and sessions.stats["full_state"] == 3)
+        
+        sessions.query("carol", "hello")
+        assert(server.calls[-2][0] == "clean")
+        assert(len(sessions) == 2 and sessions.stats["evicted"] == 1)
+
+def test_session_after_backend_lost_state():
+    with MockGenieServer() as server:
+        genie = Genie(url = server.url)
+        sessions = SessionManager(genie)
+        sessions.query("alice", "hello", dialog_state = "alice state")
+        genie.clean()
+        # the backend no longer holds alice's state, so it is sent in full
+        assert(sessions.query("alice", "more")["ds"] == "alice state")
+        assert(server.calls[-1][0] == "queryContext" and server.calls[-1][1]["ds"] == "alice state")
+        assert(sessions.stats["full_state"] == 2 and sessions.stats["handle"] == 0)
+
+def test_session_state_kept_with_fields():
+    with MockGenieServer() as server:
+        sessions = SessionManager(Genie(url = server.url))
+        sessions.query("alice", "hello", fields = ["user_target"])
+        sessions.query("bob", "hello", dialog_state = "bob state", fields = ["user_target"])
+        # alice's state was kept even though it was not asked for, so it is sent back rather than starting over
+        res = sessions.query("alice", "more", fields = ["user_target"])
+        assert(res["user_target"] and res["ds"] == "")
+        assert(server.calls[-1][0] == "queryContext" and server.calls[-1][1]["ds"] == "")
+        assert(sessions.stats["new"] == 1 and sessions.stats["full_state"] == 2)
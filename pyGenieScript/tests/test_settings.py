@@ -0,0 +1,70 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+def test_settings_delta():
+    with MockGenieServer() as server:
+        genie = Genie(url = server.url)
+        genie.query("show me a restaurant", neglect_filters = ["price", "rating"])
+        genie.query("show me a restaurant", neglect_filters = ["price", "rating", "cuisine"], num_results = 3, use_direct_sentence_state = True)
+        genie.query("show me a restaurant", neglect_filters = ["price", "rating", "cuisine"], num_results = 3, use_direct_sentence_state = True)
+        # neglected filters cannot be removed from a running server
+        with pytest.raises(ValueError):
+            genie.query("show me a restaurant", neglect_filters = ["price"], num_results = 3, use_direct_sentence_state = True)
+        filters = [c[1]["name"] for c in server.calls if c[0] == "neglectFilters"]
+        assert(sorted(filters) == ["cuisine", "price", "rating"])
+        assert([c[0] for c in server.calls].count("setNumResults") == 1)
+        assert([c[0] for c in server.calls].count("toggleDirectSentenceState") == 1)
+        assert(server.calls[-1][0] == "queryContext")
+
+def test_settings_resent_after_failed_update():
+    with MockGenieServer() as server:
+        genie = Genie(url = server.url)
+        with pytest.raises(requests.exceptions.Timeout):
+            genie.query("show me a restaurant", num_results = 3, dialog_state = "ds", timeout = 1e-9)
+        assert(len(genie.query("show me a restaurant", num_results = 3, dialog_state = "ds")["results"]) == 3)
+
+def test_concurrent_mixed_settings():
+    with MockGenieServer(latency = 0.005) as server:
+        genie = Genie(url = server.url)
+        
+        def run(i):
+            num_results = i % 3 + 1
+            return num_results, len(genie.query("show me a restaurant", num_results = num_results, dialog_state = "null")["results"])
+        
+        with ThreadPoolExecutor(8) as executor:
+            counts = list(executor.map(run, range(200)))
+        assert(all(expected == got for expected, got in counts))
+        assert(genie._inflight == 0)
@@ -0,0 +1,82 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+
+import pytest
+
+from pyGenieScript import geniescript, stack
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.tests.mock_server import fake_spawn_nlu_server, mock_process
+
+@pytest.fixture
+def model(tmp_path, monkeypatch):
+    os.makedirs(str(tmp_path / "model"))
+    (tmp_path / "model" / "config.json").write_text("{}")
+    # keeps the "localhost" binding of the installed package untouched, with genie-toolkit looking installed
+    os.makedirs(str(tmp_path / "node_modules" / "genie-toolkit" / "dist"))
+    monkeypatch.setattr(geniescript, "current_file_directory", str(tmp_path))
+    # mock servers stand in for the NLU server and contextual-genie
+    monkeypatch.setattr(Genie, "_spawn_nlu_server", lambda self, model, manifest, port = None, max_log_lines = 1000, forward_logs = True: mock_process(port))
+    def start(self, actual_server, actual_manifest, log_file_name = 'log.log', max_log_lines = 1000, forward_logs = False, log_path = None):
+        self.process = mock_process()
+    monkeypatch.setattr(Genie, "_start_contextual_genie", start)
+    return str(tmp_path / "model")
+
+def test_start_stack(model, tmp_path):
+    genie_stack = stack.start_stack(model, str(tmp_path), num_workers = 2, check_genie_version = False, startup_timeout = 10)
+    try:
+        assert((tmp_path / "_local_post_binding.txt").read_text() == str(genie_stack.nlu.nlu_process.port))
+        pool = genie_stack.pool()
+        assert(len({worker.genie.url for worker in pool.workers}) == 2)
+        assert(pool.query("show me a restaurant", dialog_state = "ds")["results"])
+    finally:
+        genie_stack.shutdown()
+    assert(genie_stack.nlu.nlu_process.poll() is not None)
+    assert(all(genie.process.poll() is not None for genie in genie_stack.genies))
+
+def test_failed_worker_stops_nlu_server(model, tmp_path, monkeypatch):
+    processes = []
+    def spawn(self, model, manifest, port = None, max_log_lines = 1000, forward_logs = True):
+        processes.append(mock_process(port))
+        return processes[-1]
+    monkeypatch.setattr(Genie, "_spawn_nlu_server", spawn)
+    with pytest.raises(TypeError):
+        stack.start_stack(model, str(tmp_path), check_genie_version = False, no_such_option = True)
+    assert(len(processes) == 1 and processes[0].poll() is not None)
+
+def test_nlu_server_without_blocking(model, tmp_path):
+    genie = Genie(url = "http://127.0.0.1:1/")
+    fake_spawn_nlu_server(genie)
+    process = genie.nlu_server(model, str(tmp_path), block = False, startup_timeout = 10)
+    try:
+        assert(process is genie.nlu_process and process.poll() is None)
+        assert((tmp_path / "_local_post_binding.txt").read_text() == str(process.port))
+        assert(genie.parse("show me a restaurant", "http://127.0.0.1:{}".format(process.port))["user_target"])
+    finally:
+        process.terminate()
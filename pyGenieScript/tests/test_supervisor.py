@@ -0,0 +1,51 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import os
+import signal
+
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.supervisor import Supervisor
+from pyGenieScript.tests.mock_server import spawn_contextual_genie
+
+def test_restart_after_crash():
+    genie = Genie(url = "http://127.0.0.1:1/")
+    spawn_contextual_genie(genie)
+    supervisor = Supervisor(genie, interval = 30, startup_timeout = 10).start()
+    try:
+        assert(len(genie.query("hello", num_results = 2, dialog_state = "state")["results"]) == 2)
+        os.kill(genie.process.pid, signal.SIGKILL)
+        genie.process.wait()
+        
+        # the failed query wakes the supervisor up and is retried on the restarted server, which got the settings back
+        assert(len(genie.query("hello", num_results = 2, dialog_state = "state")["results"]) == 2)
+        assert(supervisor.stats["contextual-genie"]["restarts"] == 1)
+        assert(supervisor.healthy())
+    finally:
+        supervisor.stop()
+        genie.process.terminate()
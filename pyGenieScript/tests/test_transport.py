@@ -0,0 +1,65 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import time
+
+import pytest
+import requests
+
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.process import free_port
+from pyGenieScript.tests.mock_server import MockGenieServer
+
+def test_query_reuses_connection():
+    with MockGenieServer() as server:
+        genie = Genie(url = server.url)
+        for _ in range(5):
+            response = genie.query("show me a chinese restaurant", num_results = 3)
+            assert(len(response['results']) >= 1)
+        genie.clean()
+        genie.quit()
+        assert(server.connections == 1)
+        assert([c[0] for c in server.calls].count("queryContext") == 5)
+
+def test_deadline():
+    with MockGenieServer(latency = 1.0) as server:
+        genie = Genie(url = server.url)
+        start = time.monotonic()
+        with pytest.raises(requests.exceptions.Timeout):
+            genie.query("show me a restaurant", dialog_state = "ds", timeout = 0.2)
+        assert(time.monotonic() - start < 0.8)
+
+def test_retries_only_idempotent_calls():
+    genie = Genie(url = "http://127.0.0.1:{}/".format(free_port()), retries = 3)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        genie.query("show me a restaurant", dialog_state = "ds")
+    assert(genie.transport.stats["retries"] == 3)
+    # a query on the current dialog state changes it, so it is not retried
+    with pytest.raises(requests.exceptions.ConnectionError):
+        genie.query("show me a restaurant")
+    assert(genie.transport.stats["retries"] == 3)
@@ -0,0 +1,53 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import time
+
+from pyGenieScript.geniescript import Genie
+from pyGenieScript.tests.mock_server import MockGenieServer
+from pyGenieScript.warmup import Warmup
+
+def test_warmup_until_steady():
+    # each utterance gets faster until the backend is warm
+    delays = [0.04, 0.02, 0.01, 0.01, 0.01, 0.01]
+    sent = []
+    def send(utterance, deadline):
+        sent.append(utterance)
+        time.sleep(delays[(len(sent) - 1) // 2])
+    
+    report = Warmup(utterances = ["a", "b"], max_rounds = 6, tolerance = 0.3).run(send)
+    assert(report["steady"] and len(report["rounds"]) == 4 and len(sent) == 8)
+    assert(report["seconds"] >= sum(report["rounds"]))
+
+def test_contextual_genie_warmup():
+    with MockGenieServer() as server:
+        genie = Genie(url = server.url)
+        genie._warm_up_contextual_genie(Warmup(utterances = ["hello", "show me a restaurant"], min_rounds = 3, max_rounds = 3))
+        endpoints = [c[0] for c in server.calls]
+        assert(endpoints == ["queryContext"] * 6 + ["clean"])
+        assert(len(genie.warmup_report["rounds"]) == 3)
@@ -0,0 +1,171 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import random
+import threading
+import time
+
+
+class HTTPTransport:
+    """A pooled, keep-alive HTTP transport shared by every call to a Genie server."""
+    def __init__(self, pool_size = 10, timeout = None, retries = 0, backoff = 0.05, max_backoff = 1.0):
+        """
+        Create a `requests.Session` whose connection pool is reused across calls,
+        so consecutive queries do not pay for a new TCP connection each time.
+
+        ### Args:
+
+        `pool_size` (int, optional): maximum number of keep-alive connections kept per host. Defaults to 10.
+
+        `timeout` (float or tuple, optional): default `(connect, read)` timeout in seconds applied to every call,
+        overridable per call. Defaults to None (wait forever).
+        
+        `retries` (int, optional): how many times an idempotent call is retried after a connection error or a timeout. Defaults to 0.
+        
+        `backoff` (float, optional): seconds before the first retry. Each retry waits a random time up to twice as long as the
+        previous one (full jitter), so clients that failed together do not retry together. Defaults to 0.05.
+        
+        `max_backoff` (float, optional): longest wait in seconds before a retry. Defaults to 1.0.
+        
+        Counts of requests sent, retries and calls that ran out of time are kept in `stats`.
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = collections.Counter()
+        self._stats_lock = threading.Lock()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The underlying `requests.Session`, created (and `requests` imported) on first use to keep start-up fast."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = self.pool_size)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def send(self, method : str, url : str, params = None, json = None, timeout = None, deadline = None, idempotent = False):
+        """
+        Send a `method` request to `url` and return the undecoded `requests.Response`.
+        
+        With a `deadline` (a `time.monotonic()` value), the request and its retries never wait past it,
+        and `requests.exceptions.Timeout` is raised once it has passed. Only `idempotent` calls are retried.
+        """
+        import requests
+        attempt = 0
+        while True:
+            hop_timeout = self.__hop_timeout(timeout, deadline, url)
+            self.__count("requests")
+            try:
+                return self.session.request(method, url = url, params = params, json = json, timeout = hop_timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not idempotent or attempt >= self.retries:
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                self.__count("retries")
+                time.sleep(delay)
+
+    def get(self, url : str, params = None, timeout = None, deadline = None, idempotent = False):
+        """GET `url` and return the decoded JSON response."""
+        return self.send("GET", url, params = params, timeout = timeout, deadline = deadline, idempotent = idempotent).json()
+
+    def post(self, url : str, json = None, timeout = None, deadline = None, idempotent = False):
+        """POST `json` to `url` and return the decoded JSON response."""
+        return self.send("POST", url, json = json, timeout = timeout, deadline = deadline, idempotent = idempotent).json()
+
+    def post_all(self, calls, timeout = None, deadline = None, idempotent = False):
+        """
+        POST every `(url, json)` in `calls` concurrently and return the decoded JSON responses in order,
+        so independent calls cost a single round trip.
+        """
+        if len(calls) == 1:
+            url, json = calls[0]
+            return [self.post(url, json = json, timeout = timeout, deadline = deadline, idempotent = idempotent)]
+        
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers = self.pool_size)
+        futures = [self._executor.submit(self.post, url, json, timeout, deadline, idempotent) for url, json in calls]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Close every pooled connection."""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait = False)
+                self._executor = None
+
+    def __timeout(self, timeout):
+        return self.timeout if timeout is None else timeout
+
+    def __hop_timeout(self, timeout, deadline, url):
+        # a single request may not outlive the deadline of the whole call
+        timeout = self.__timeout(timeout)
+        if deadline is None:
+            return timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self.__count("deadline_exceeded")
+            raise deadline_exceeded("deadline exceeded before requesting {}".format(url))
+        if timeout is None:
+            return remaining
+        if isinstance(timeout, tuple):
+            return tuple(remaining if t is None else min(t, remaining) for t in timeout)
+        return min(timeout, remaining)
+
+    def __count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+
+def deadline_exceeded(message : str):
+    """The exception raised when a call runs out of time, `requests.exceptions.Timeout` like a timed out request."""
+    import requests
+    return requests.exceptions.Timeout(message)
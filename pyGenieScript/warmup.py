@@ -0,0 +1,104 @@
+# Copyright 2023 The Board of Trustees of the Leland Stanford Junior University
+#
+# Author: Shicheng Liu <shicheng@cs.stanford.edu>
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation
+#  and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holder nor the names of its
+#  contributors may be used to endorse or promote products derived from
+#  this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+import time
+
+# exercise the parser, the yelp skill and the agent, which all load lazily
+DEFAULT_UTTERANCES = (
+    "hello",
+    "show me a chinese restaurant",
+    "show me restaurants with at least 4 stars in palo alto",
+    "what is the address of the first one",
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """
+    ### Description:
+    
+    Send synthetic utterances to a freshly started backend until its latency stops dropping,
+    see `Genie.initialize` and `Genie.nlu_server`.
+    
+    The utterances are sent in rounds. Warm-up ends once a round is no more than `tolerance` faster than the previous one
+    (after at least `min_rounds` rounds), or after `max_rounds` rounds.
+    
+    ### Args:
+    
+    `utterances` ([str], optional): utterances sent in each round. Defaults to `DEFAULT_UTTERANCES`.
+    
+    `min_rounds` (int, optional): minimum number of rounds. Defaults to 2.
+    
+    `max_rounds` (int, optional): maximum number of rounds. Defaults to 10.
+    
+    `tolerance` (float, optional): relative speed-up between two rounds under which latency is considered steady. Defaults to 0.2.
+    
+    `timeout` (float, optional): seconds the whole warm-up may take, after which the pending request fails. Defaults to 300.
+    """
+    def __init__(self, utterances = DEFAULT_UTTERANCES, min_rounds = 2, max_rounds = 10, tolerance = 0.2, timeout = 300):
+        self.utterances = list(utterances)
+        self.min_rounds = max(1, min_rounds)
+        self.max_rounds = max(self.min_rounds, max_rounds)
+        self.tolerance = tolerance
+        self.timeout = timeout
+    
+    def run(self, send, name = "backend") -> dict:
+        """
+        ### Description:
+        
+        Warm up by calling `send(utterance, deadline)` for each utterance of each round, where `deadline` is a
+        `time.monotonic()` value (or None) the call must not outlive.
+        
+        ### Returns:
+        
+        ```
+        {
+            'seconds': time spent warming up (float),
+            'rounds': seconds taken by each round ([float]),
+            'steady': whether latency reached steady state before `max_rounds` (bool)
+        }
+        ```
+        """
+        start = time.monotonic()
+        deadline = None if self.timeout is None else start + self.timeout
+        rounds = []
+        steady = False
+        while len(rounds) < self.max_rounds and not steady:
+            round_start = time.monotonic()
+            for utterance in self.utterances:
+                send(utterance, deadline)
+            rounds.append(time.monotonic() - round_start)
+            steady = len(rounds) >= max(2, self.min_rounds) and rounds[-1] >= rounds[-2] * (1 - self.tolerance)
+        
+        report = {"seconds": time.monotonic() - start, "rounds": rounds, "steady": steady}
+        logger.info("%s warmed up in %.2fs over %d rounds (last round %.3fs%s)", name, report["seconds"], len(rounds),
+                    rounds[-1], "" if steady else ", latency still dropping")
+        return report